@@ -0,0 +1,274 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Columnar on-disk storage for preprocessed ``columns`` dicts.
+
+Preprocessing scripts produce ``columns`` dicts mapping column name to a list
+of per-sample values, historically saved as pickles. This module stores each
+column in a directory of memory-mappable ``.npy`` files:
+
+- integer columns (e.g. ``day``) are stored as the narrowest integer dtype;
+- string columns (e.g. ``location``, ``clade``) are dictionary encoded as
+  ``int32`` codes into a list of unique strings;
+- any other column is stored as a pickled list.
+"""
+
+import json
+import logging
+import os
+import pickle
+import shutil
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+class DictColumn:
+    """
+    A dictionary-encoded column of strings.
+
+    This behaves like a read-only list of strings, but additionally exposes
+    ``.codes`` (an integer array) and ``.uniques`` (a list of strings) so that
+    vectorized consumers can avoid materializing per-row Python strings.
+
+    :param numpy.ndarray codes: An array of integer codes, one per row.
+    :param uniques: Either a list of strings or a filename of a pickled list
+        of strings, which will be loaded lazily.
+    """
+
+    def __init__(self, codes, uniques):
+        self.codes = codes
+        self._uniques = uniques
+
+    @staticmethod
+    def from_list(values):
+        """
+        Encodes a list of strings, ordering uniques by first appearance.
+        """
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        return DictColumn(codes.astype(np.int32), uniques.tolist())
+
+    @property
+    def uniques(self):
+        if isinstance(self._uniques, str):
+            with open(self._uniques, "rb") as f:
+                self._uniques = pickle.load(f)
+        return self._uniques
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        """
+        Returns a string for an integer index, or else a :class:`DictColumn`
+        for a slice, an index array or a mask.
+        """
+        if isinstance(i, (int, np.integer)):
+            return self.uniques[self.codes[i]]
+        return DictColumn(self.codes[i], self.uniques)
+
+    def __iter__(self, chunk_size=2**16):
+        uniques = self.uniques
+        for begin in range(0, len(self.codes), chunk_size):
+            yield from map(
+                uniques.__getitem__, self.codes[begin:][:chunk_size].tolist()
+            )
+
+    def tolist(self):
+        return list(self)
+
+    def value_counts(self, weights=None) -> Counter:
+        """
+        Counts occurrences of each string, without iterating over rows.
+
+        :param weights: An optional array of per-row weights.
+        """
+        counts = np.bincount(self.codes, weights, minlength=len(self.uniques))
+        if weights is not None:
+            counts = counts.astype(np.asarray(weights).dtype)
+        result: Counter = Counter()
+        for u, count in zip(self.uniques, counts.tolist()):
+            if count:
+                result[u] += count
+        return result
+
+    def map(self, fn):
+        """
+        Applies a function to each unique string, returning a new column.
+        Note the result may contain duplicate uniques.
+        """
+        return DictColumn(self.codes, list(map(fn, self.uniques)))
+
+
+def factorize(column):
+    """
+    Returns a pair ``(codes, uniques)`` for a list of values or a
+    :class:`DictColumn`. This is zero-copy for a :class:`DictColumn`.
+    """
+    if isinstance(column, DictColumn):
+        return column.codes, column.uniques
+    return pd.factorize(np.asarray(column, dtype=object))
+
+
+def value_counts(column, weights=None) -> Counter:
+    """
+    Counts occurrences of values in a list or :class:`DictColumn`, optionally
+    weighting each row.
+    """
+    if isinstance(column, DictColumn):
+        return column.value_counts(weights)
+    if weights is None:
+        return Counter(column)
+    result: Counter = Counter()
+    for value, weight in zip(column, np.asarray(weights).tolist()):
+        result[value] += weight
+    return result
+
+
+def concat_columns(parts) -> dict:
+    """
+    Concatenates a list of ``columns`` dicts with identical keys, preserving
+    dictionary encoding of columns that are :class:`DictColumn` s in all parts.
+
+    :param list parts: A list of ``columns`` dicts.
+    :returns: A single ``columns`` dict.
+    :rtype: dict
+    """
+    result: dict = {}
+    if not parts:
+        return result
+    for name in parts[0]:
+        values = [part[name] for part in parts]
+        if all(isinstance(v, DictColumn) for v in values):
+            offsets = np.cumsum([0] + [len(v.uniques) for v in values[:-1]])
+            codes = np.concatenate([v.codes + o for v, o in zip(values, offsets)])
+            uniques = [u for v in values for u in v.uniques]
+            unique_codes, uniques = pd.factorize(np.asarray(uniques, dtype=object))
+            codes = unique_codes.astype(np.int32)[codes]
+            result[name] = DictColumn(codes, uniques.tolist())
+        elif all(isinstance(v, np.ndarray) for v in values):
+            result[name] = np.concatenate(values)
+        else:
+            result[name] = [x for v in values for x in v]
+    return result
+
+
+def _encode(values):
+    if isinstance(values, DictColumn):
+        return "dict", values
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iu":
+        array = values
+    else:
+        array = np.asarray(values, dtype=object)
+        if len(array) and all(isinstance(v, str) for v in array):
+            return "dict", DictColumn.from_list(array)
+        if not (len(array) and all(isinstance(v, (int, np.integer)) for v in array)):
+            return "pickle", list(values)
+        array = array.astype(np.int64)
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not len(array) or info.min <= array.min() and array.max() <= info.max:
+            return "array", array.astype(dtype)
+    return "array", array.astype(np.int64)
+
+
+def save_columns(columns: dict, dirname: str) -> None:
+    """
+    Saves a ``columns`` dict to a columnar directory. The directory is written
+    to a temporary location and then moved into place.
+
+    :param dict columns: A dict mapping column name to a list of values.
+    :param str dirname: The output directory.
+    """
+    tempdir = dirname.rstrip("/") + ".tmp"
+    if os.path.exists(tempdir):
+        shutil.rmtree(tempdir)
+    os.makedirs(tempdir)
+    lengths = {len(v) for v in columns.values()}
+    assert len(lengths) <= 1, "columns have unequal length"
+    meta = {"version": FORMAT_VERSION, "num_rows": min(lengths, default=0)}
+    meta["columns"] = kinds = {}
+    for name, values in columns.items():
+        kind, encoded = _encode(values)
+        kinds[name] = kind
+        path = os.path.join(tempdir, name)
+        if kind == "array":
+            np.save(path + ".npy", encoded)
+        elif kind == "dict":
+            np.save(path + ".codes.npy", np.asarray(encoded.codes, dtype=np.int32))
+            with open(path + ".uniques.pkl", "wb") as f:
+                pickle.dump(list(encoded.uniques), f)
+        else:
+            with open(path + ".pkl", "wb") as f:
+                pickle.dump(encoded, f)
+    with open(os.path.join(tempdir, "columns.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    if os.path.exists(dirname):
+        shutil.rmtree(dirname)
+    os.rename(tempdir, dirname)
+
+
+def load_columns(filename: str, *, mmap: bool = True) -> dict:
+    """
+    Loads a ``columns`` dict either from a columnar directory written by
+    :func:`save_columns` or from a legacy pickle file.
+
+    Integer columns are returned as (possibly memory-mapped) numpy arrays and
+    string columns are returned as :class:`DictColumn` s.
+
+    :param str filename: A columnar directory or a ``.pkl`` file.
+    :param bool mmap: Whether to memory map arrays rather than reading them.
+    :returns: A dict mapping column name to column.
+    :rtype: dict
+    """
+    if not os.path.isdir(filename):
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+
+    with open(os.path.join(filename, "columns.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported columnar format version {meta['version']}")
+    mmap_mode = "r" if mmap else None
+    columns = {}
+    for name, kind in meta["columns"].items():
+        path = os.path.join(filename, name)
+        if kind == "array":
+            columns[name] = np.load(path + ".npy", mmap_mode=mmap_mode)
+        elif kind == "dict":
+            codes = np.load(path + ".codes.npy", mmap_mode=mmap_mode)
+            columns[name] = DictColumn(codes, path + ".uniques.pkl")
+        elif kind == "pickle":
+            with open(path + ".pkl", "rb") as f:
+                columns[name] = pickle.load(f)
+        else:
+            raise ValueError(f"Unknown column kind: {repr(kind)}")
+        assert len(columns[name]) == meta["num_rows"], name
+    return columns
+
+
+def convert_columns(filename_in: str, dirname_out: Optional[str] = None) -> str:
+    """
+    Converts a legacy pickled ``columns`` file to a columnar directory.
+
+    :param str filename_in: A ``.pkl`` file.
+    :param str dirname_out: The output directory. Defaults to
+        ``filename_in`` with the ``.pkl`` extension removed.
+    :returns: The output directory.
+    :rtype: str
+    """
+    if dirname_out is None:
+        assert filename_in.endswith(".pkl")
+        dirname_out = filename_in[: -len(".pkl")]
+    logger.info(f"Converting {filename_in} to {dirname_out}")
+    with open(filename_in, "rb") as f:
+        columns = pickle.load(f)
+    save_columns(columns, dirname_out)
+    return dirname_out
@@ -9,6 +9,7 @@ import typing
 from collections import OrderedDict, defaultdict
 from typing import Dict, List
 
+import numpy as np
 import pandas as pd
 import torch
 
@@ -252,6 +253,22 @@ def gisaid_normalize(gisaid_location):
     return x
 
 
+def gisaid_normalize_column(locations) -> np.ndarray:
+    """
+    Vectorized version of :func:`gisaid_normalize` that normalizes each unique
+    location once (via the ``GISAID_NORMALIZE`` cache) and broadcasts results.
+
+    :param locations: A list, array or series of location strings. Missing
+        values (None or NaN) are preserved as None.
+    :returns: An object array of normalized locations.
+    :rtype: numpy.ndarray
+    """
+    codes, uniques = pd.factorize(np.asarray(locations, dtype=object))
+    normalized = [gisaid_normalize(u) for u in uniques]
+    normalized.append(None)  # for missing values, with code -1
+    return np.array(normalized, dtype=object)[codes]
+
+
 GISAID_COUNTRY = {}
 
 
@@ -2,40 +2,25 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import datetime
-import functools
 import logging
-import math
-import pickle
 import re
 import warnings
-from collections import Counter, OrderedDict, defaultdict
-from timeit import default_timer
+from collections import Counter, OrderedDict
 from typing import List
 
 import numpy as np
 import pyro
 import pyro.distributions as dist
 import torch
-import tqdm
 from pyro import poutine
-from pyro.infer import SVI, JitTrace_ELBO, Trace_ELBO
-from pyro.infer.autoguide import (
-    AutoDelta,
-    AutoGuideList,
-    AutoLowRankMultivariateNormal,
-    AutoNormal,
-)
-from pyro.infer.autoguide.initialization import InitMessenger
 from pyro.infer.reparam import LocScaleReparam
-from pyro.ops.streaming import CountMeanVarianceStats, StatsOfDict
-from pyro.optim import ClippedAdam
-from pyro.poutine.util import site_is_subsample
 
 import pyrocov.geo
 
-from . import pangolin, sarscov2
-from .ops import sparse_multinomial_likelihood
-from .util import pearson_correlation
+from . import inference, pangolin, sarscov2
+from .columnar import DictColumn, load_columns, value_counts
+from .inference import Guide, get_likelihood, log_holdout_stats, predict  # noqa: F401
+from .ops import logistic_probs, time_chunk_size
 
 logger = logging.getLogger(__name__)
 
@@ -52,12 +37,12 @@ def get_fine_regions(columns, min_samples):
     """
     # Count number of samples in each subregion.
     counts = Counter()
-    for location in columns["location"]:
+    for location, count in value_counts(columns["location"]).items():
         parts = location.split("/")
         if len(parts) < 2:
             continue
         parts = tuple(p.strip() for p in parts[:3])
-        counts[parts] += 1
+        counts[parts] += count
 
     # Select fine countries.
     return frozenset(parts for parts, count in counts.items() if count >= min_samples)
@@ -127,7 +112,8 @@ def load_nextstrain_data(
     :param dict include: filters of data to include
     :param dict exclude: filters of data to exclude
     :param end_day: last day to include
-    :param str columns_filename: generated by scripts/preprocess_nextstrain.py
+    :param str columns_filename: generated by scripts/preprocess_nextstrain.py,
+        either a columnar directory or a legacy ``.pkl`` file.
     :param str features_filename: generated by scripts/preprocess_nextstrain.py
     :returns: A dataset dict
     :rtype: dict
@@ -140,10 +126,14 @@ def load_nextstrain_data(
         logger.info(f"Load nextstrain data end_day: {end_day}")
 
     # Load column data.
-    with open(columns_filename, "rb") as f:
-        columns = pickle.load(f)
+    columns = load_columns(columns_filename)
     # Clean up location ids.
-    columns["location"] = list(map(pyrocov.geo.gisaid_normalize, columns["location"]))
+    if isinstance(columns["location"], DictColumn):
+        columns["location"] = columns["location"].map(pyrocov.geo.gisaid_normalize)
+    else:
+        columns["location"] = list(
+            map(pyrocov.geo.gisaid_normalize, columns["location"])
+        )
     logger.info(f"Training on {len(columns['day'])} rows with columns:")
     logger.info(", ".join(columns.keys()))
 
@@ -241,7 +231,7 @@ def load_nextstrain_data(
     if end_day is not None:
         T = 1 + end_day // TIMESTEP
     else:
-        T = 1 + max(columns["day"]) // TIMESTEP
+        T = 1 + int(np.max(columns["day"])) // TIMESTEP
     P = len(location_id)
     L = len(lineage_id)
     weekly_counts = torch.zeros(T, P, L)
@@ -331,7 +321,7 @@ def load_jhu_data(nextstrain_data: dict) -> dict:
     }
 
 
-def model(dataset, model_type, *, forecast_steps=None):
+def model(dataset, model_type, *, forecast_steps=None, memory_budget=None):
     """
     Bayesian regression model of lineage portions as a function of mutation features.
 
@@ -341,6 +331,8 @@ def model(dataset, model_type, *, forecast_steps=None):
     - During prediction (after training), the likelihood statement is omitted
       and instead a ``probs`` tensor is recorded; this is the predicted lineage
       portions in each (time, region) bin.
+    If a ``memory_budget`` in bytes is given, ``[T, P, L]``-shaped
+    intermediate tensors are computed in time chunks that fit the budget.
     """
     # Tensor shapes are commented at at the end of some lines.
     features = dataset["features"]
@@ -384,56 +376,57 @@ def model(dataset, model_type, *, forecast_steps=None):
         # on lineage and place. Assume initial infections depend strongly on
         # lineage and place.
         coef = pyro.sample(
-            "coef", dist.Laplace(torch.zeros(F), coef_scale).to_event(1)
+            "coef", dist.Laplace(torch.zeros(F), coef_scale[..., None]).to_event(1)
         )  # [F]
+        if coef.dim() > 1:  # When vectorized, align coef with batch dims.
+            coef = coef.squeeze(-2)  # [..., 1, 1, F]
         with lineage_plate:
             rate_loc = pyro.deterministic("rate_loc", 0.01 * coef @ features.T)  # [L]
         with pl_plate:
-            pl_rate_loc = rate_loc.expand(P, L).reshape(-1)
+            batch_shape = rate_loc.shape[:-1]  # nonempty only when vectorized
+            pl_rate_loc = rate_loc.unsqueeze(-2).expand(batch_shape + (P, L))
+            pl_rate_loc = pl_rate_loc.reshape(batch_shape + (P * L,))
             pl_rate = pyro.sample(
-                "pl_rate", dist.Normal(pl_rate_loc[pl_index], rate_scale)
+                "pl_rate", dist.Normal(pl_rate_loc[..., pl_index], rate_scale)
             )  # [PL]
             pl_init = pyro.sample("pl_init", dist.Normal(0, init_scale))  # [PL]
         with place_plate, lineage_plate:
+            shape = pl_rate.shape[:-2] + (P, L)
             rate = pyro.deterministic(
                 "rate",
-                pl_rate_loc.scatter(0, pl_index, pl_rate).reshape(P, L),
+                pl_rate_loc.scatter(-1, pl_index.expand_as(pl_rate), pl_rate).reshape(
+                    shape
+                ),
             )  # [P, L]
             init = pyro.deterministic(
                 "init",
-                torch.full((P * L,), -1e2).scatter(0, pl_index, pl_init).reshape(P, L),
+                pl_init.new_full(pl_rate_loc.shape, -1e2)
+                .scatter(-1, pl_index.expand_as(pl_init), pl_init)
+                .reshape(shape),
             )  # [P, L]
-        logits = init + rate * time[:, None, None]  # [T, P, L]
 
         # Optionally predict probabilities (during prediction).
         if forecast_steps is not None:
-            probs = logits.softmax(-1)
+            chunk_size = time_chunk_size(
+                memory_budget, T, init.numel(), itemsize=init.element_size()
+            )
+            probs = logistic_probs(init, rate, time, chunk_size=chunk_size)
             with time_plate, place_plate, lineage_plate:
                 pyro.deterministic("probs", probs)
             return
 
         # Finally observe counts (during inference).
-        if "dense" in model_type:  # equivalent either way
-            # Compute a dense likelihood (more expensive).
-            with time_plate, place_plate:
-                pyro.sample(
-                    "obs",
-                    dist.Multinomial(logits=logits.unsqueeze(-2), validate_args=False),
-                    obs=weekly_counts.unsqueeze(-2),
-                )  # [T, P, 1, L]
-            return
-        # Compute a sparse likelihood (cheaper).
-        logits = logits.log_softmax(-1)
-        t, p, c = sparse_counts["index"]
-        pyro.factor(
-            "obs",
-            sparse_multinomial_likelihood(
-                sparse_counts["total"], logits[t, p, c], sparse_counts["value"]
-            ),
+        get_likelihood(model_type)(
+            init,
+            rate,
+            time,
+            weekly_counts,
+            sparse_counts,
+            memory_budget=memory_budget,
         )
 
 
-class InitLocFn:
+class InitLocFn(inference.InitLocFn):
     """
     Initializer for latent variables.
 
@@ -441,148 +434,8 @@ class InitLocFn:
     """
 
     def __init__(self, dataset):
-        # Initialize init.
         init = dataset["weekly_counts"].sum(0)  # [P, L]
-        init.add_(1 / init.size(-1)).div_(init.sum(-1, True))
-        init.log_().sub_(init.median(-1, True).values).add_(torch.randn(init.shape))
-        self.init = init  # [P, L]
-        self.init_decentered = init / 2
-        self.init_loc = init.mean(0)  # [L]
-        self.init_loc_decentered = self.init_loc / 2
-        self.pl_init = self.init.reshape(-1)[dataset["place_lineage_index"]]
-        self.pl_init = self.pl_init / 2
-        assert not torch.isnan(self.init).any()
-        logger.info(f"init stddev = {self.init.std():0.3g}")
-
-    def __call__(self, site):
-        name = site["name"]
-        shape = site["fn"].shape()
-        if hasattr(self, name):
-            result = getattr(self, name)
-            assert result.shape == shape
-            return result
-        if name in (
-            "coef_scale",
-            "init_scale",
-            "init_loc_scale",
-        ):
-            return torch.ones(shape)
-        if name == "logits_scale":
-            return torch.full(shape, 0.002)
-        if name in (
-            "rate_scale",
-            "place_scale",
-            "lineage_scale",
-        ):
-            return torch.full(shape, 0.01)
-        if name in (
-            "rate_loc",
-            "rate_loc_decentered",
-            "coef",
-            "coef_decentered",
-            "rate",
-            "rate_decentered",
-            "pl_rate",
-            "pl_rate_decentered",
-        ):
-            return torch.rand(shape).sub_(0.5).mul_(0.01)
-        if name == "coef_loc":
-            return torch.rand(shape).sub_(0.5).mul_(0.01).add_(1.0)
-        raise ValueError(f"InitLocFn found unhandled site {repr(name)}; please update.")
-
-
-class Guide(AutoGuideList):
-    """
-    Custom guide for large-scale inference.
-
-    This combines a low-rank multivariate normal guide over small variables
-    with a mean field guide over remaining latent variables.
-    """
-
-    def __init__(self, model, init_loc_fn, init_scale, rank):
-        super().__init__(InitMessenger(init_loc_fn)(model))
-
-        # Jointly estimate globals, mutation coefficients, and lineage coefficients.
-        mvn = [
-            "coef_scale",
-            "rate_loc_scale",
-            "init_loc_scale",
-            "rate_scale",
-            "init_scale",
-            "coef",
-            "coef_decentered",
-            "rate_loc",
-            "rate_loc_decentered",
-            "init_loc",
-            "init_loc_decentered",
-        ]
-        self.append(
-            AutoLowRankMultivariateNormal(
-                poutine.block(model, expose=mvn),
-                init_loc_fn=init_loc_fn,
-                init_scale=init_scale,
-                rank=rank,
-            )
-        )
-        model = poutine.block(model, hide=mvn)
-
-        # Mean-field estimate all remaining latent variables.
-        self.append(AutoNormal(model, init_loc_fn=init_loc_fn, init_scale=init_scale))
-
-
-@torch.no_grad()
-@poutine.mask(mask=False)
-def predict(
-    model,
-    guide,
-    dataset,
-    model_type,
-    *,
-    num_samples=1000,
-    vectorize=None,
-    save_params=("rate", "init", "probs"),
-    forecast_steps=0,
-) -> dict:
-    def get_conditionals(data):
-        trace = poutine.trace(poutine.condition(model, data)).get_trace(
-            dataset, model_type, forecast_steps=forecast_steps
-        )
-        return {
-            name: site["value"].detach()
-            for name, site in trace.nodes.items()
-            if site["type"] == "sample" and not site_is_subsample(site)
-            if not name.startswith("obs")
-        }
-
-    # Compute median point estimate.
-    result: dict = defaultdict(dict)
-    for name, value in get_conditionals(guide.median(dataset)).items():
-        if value.numel() < 1e5 or name in save_params:
-            result["median"][name] = value
-
-    # Compute moments.
-    save_params = {
-        k for k, v in result["median"].items() if v.numel() < 1e5 or k in save_params
-    }
-    if vectorize is None:
-        vectorize = result["median"]["probs"].numel() < 1e6
-    if vectorize:
-        with pyro.plate("particles", num_samples, dim=-4):
-            samples = get_conditionals(guide())
-        for k, v in samples.items():
-            if k in save_params:
-                result["mean"][k] = v.mean(0).squeeze()
-                result["std"][k] = v.std(0).squeeze()
-    else:
-        stats = StatsOfDict({k: CountMeanVarianceStats for k in save_params})
-        for _ in tqdm.tqdm(range(num_samples)):
-            stats.update(get_conditionals(guide()))
-        for name, stats_ in stats.get().items():
-            if "mean" in stats_:
-                result["mean"][name] = stats_["mean"]
-            if "variance" in stats_:
-                result["std"][name] = stats_["variance"].sqrt()
-    return dict(result)
+        super().__init__(init, dataset["place_lineage_index"], "pl")
 
 
 def fit_svi(
@@ -602,131 +455,45 @@ def fit_svi(
     log_every=50,
     seed=20210319,
     check_loss=False,
+    num_ell_particles=0,
+    vectorize=None,
+    memory_budget=None,
+    telemetry="eager",
+    compile_backend=None,
+    checkpoint_filename=None,
+    checkpoint_every=1000,
 ) -> dict:
     """
     Fits a variational posterior using stochastic variational inference (SVI).
-    """
-    start_time = default_timer()
-
-    logger.info(f"Fitting {guide_type} guide via SVI")
-    pyro.set_rng_seed(seed)
-    pyro.clear_param_store()
-    param_store = pyro.get_param_store()
-
-    # Initialize guide so we can count parameters and register hooks.
-    cond_data = {k: torch.as_tensor(v) for k, v in cond_data.items()}
-    model_ = poutine.condition(model, cond_data)
-    init_loc_fn = InitLocFn(dataset)
-    Elbo = JitTrace_ELBO if jit else Trace_ELBO
-    if guide_type == "map":
-        guide = AutoDelta(model_, init_loc_fn=init_loc_fn)
-    elif guide_type == "normal":
-        guide = AutoNormal(model_, init_loc_fn=init_loc_fn, init_scale=0.01)
-    elif guide_type == "full":
-        guide = AutoLowRankMultivariateNormal(
-            model_, init_loc_fn=init_loc_fn, init_scale=0.01, rank=rank
-        )
-    else:
-        guide = Guide(model_, init_loc_fn=init_loc_fn, init_scale=0.01, rank=rank)
-    # This initializes the guide:
-    latent_shapes = {k: v.shape for k, v in guide(dataset, model_type).items()}
-    latent_numel = {k: v.numel() for k, v in latent_shapes.items()}
-    logger.info(
-        "\n".join(
-            [f"Model has {sum(latent_numel.values())} latent variables of shapes:"]
-            + [f" {k} {tuple(v)}" for k, v in latent_shapes.items()]
-        )
-    )
-    param_shapes = {k: v.shape for k, v in pyro.get_param_store().named_parameters()}
-    param_numel = {k: v.numel() for k, v in param_shapes.items()}
-    logger.info(
-        "\n".join(
-            [f"Guide has {sum(param_numel.values())} parameters of shapes:"]
-            + [f" {k} {tuple(v)}" for k, v in param_shapes.items()]
-        )
-    )
 
-    # Log gradient norms during inference.
-    series: dict = defaultdict(list)
-
-    def hook(g, series):
-        series.append(torch.linalg.norm(g.reshape(-1), math.inf).item())
-
-    for name, value in pyro.get_param_store().named_parameters():
-        value.register_hook(functools.partial(hook, series=series[name]))
-
-    def optim_config(param_name):
-        config: dict = {
-            "lr": learning_rate,
-            "lrd": learning_rate_decay ** (1 / num_steps),
-            "clip_norm": clip_norm,
-        }
-        scalars = [k for k, v in latent_numel.items() if v == 1]
-        if any("locs." + s in name for s in scalars):
-            config["lr"] *= 0.2
-        elif "scales" in param_name:
-            config["lr"] *= 0.1
-        elif "scale_tril" in param_name:
-            config["lr"] *= 0.05
-        elif "factors" in param_name or "prec_sqrts" in param_name:
-            config["lr"] *= 0.05
-        elif "weight_" in param_name:
-            config["lr"] *= 0.01
-        elif "weight" in param_name:
-            config["lr"] *= 0.03
-        elif "_centered" in param_name:
-            config["lr"] *= 0.1
-        return config
-
-    optim = ClippedAdam(optim_config)
-    elbo = Elbo(max_plate_nesting=3, ignore_jit_warnings=True)
-    svi = SVI(model_, guide, optim, elbo)
-    losses = []
-    num_obs = dataset["weekly_counts"].count_nonzero()
-    for step in range(num_steps):
-        loss = svi.step(dataset=dataset, model_type=model_type)
-        assert not math.isnan(loss)
-        losses.append(loss)
-        median = guide.median()
-        for name, value in median.items():
-            if value.numel() == 1:
-                series[name].append(float(value))
-        if log_every and step % log_every == 0:
-            logger.info(
-                " ".join(
-                    [f"step {step: >4d} L={loss / num_obs:0.6g}"]
-                    + [
-                        "{}={:0.3g}".format(
-                            "".join(p[0] for p in k.split("_")).upper(), v.item()
-                        )
-                        for k, v in median.items()
-                        if v.numel() == 1
-                    ]
-                )
-            )
-        if check_loss and step >= 50:
-            prev = torch.tensor(losses[-50:-25], device="cpu").median().item()
-            curr = torch.tensor(losses[-25:], device="cpu").median().item()
-            assert (curr - prev) < num_obs, "loss is increasing"
-
-    result = predict(
-        model_,
-        guide,
+    See :func:`pyrocov.inference.fit_svi` for details.
+    """
+    return inference.fit_svi(
+        model,
+        InitLocFn,
         dataset,
-        model_type,
-        num_samples=num_samples,
+        model_type=model_type,
+        guide_type=guide_type,
+        cond_data=cond_data,
         forecast_steps=forecast_steps,
+        learning_rate=learning_rate,
+        learning_rate_decay=learning_rate_decay,
+        num_steps=num_steps,
+        num_samples=num_samples,
+        clip_norm=clip_norm,
+        rank=rank,
+        jit=jit,
+        log_every=log_every,
+        seed=seed,
+        check_loss=check_loss,
+        num_ell_particles=num_ell_particles,
+        vectorize=vectorize,
+        memory_budget=memory_budget,
+        telemetry=telemetry,
+        compile_backend=compile_backend,
+        checkpoint_filename=checkpoint_filename,
+        checkpoint_every=checkpoint_every,
     )
-    result["losses"] = losses
-    series["loss"] = losses
-    result["series"] = dict(series)
-    result["params"] = {
-        k: v.detach().float().cpu().clone()
-        for k, v in param_store.items()
-        if v.numel() < 1e8
-    }
-    result["walltime"] = default_timer() - start_time
-    return result
 
 
 @torch.no_grad()
@@ -739,151 +506,5 @@ def log_stats(dataset: dict, result: dict) -> dict:
     :param dict result: The output of :func:`fit_svi`.
     :returns: A dictionary of statistics.
     """
-    stats = {k: float(v) for k, v in result["median"].items() if v.numel() == 1}
-    stats["loss"] = float(np.median(result["losses"][-100:]))
-    mutations = dataset["mutations"]
-    mean = result["mean"]["coef"].cpu()
-    if not mean.shape:
-        return stats  # Work around error in map estimation.
-
-    # Statistical significance.
-    std = result["std"]["coef"].cpu()
-    sig = mean.abs() / std
-    logger.info(f"|μ|/σ [median,max] = [{sig.median():0.3g},{sig.max():0.3g}]")
-    stats["|μ|/σ median"] = sig.median()
-    stats["|μ|/σ max"] = sig.max()
-
-    # Effects of individual mutations.
-    for name in ["S:D614G", "S:N501Y", "S:E484K", "S:L452R"]:
-        if name not in mutations:
-            continue
-        i = mutations.index(name)
-        m = mean[i] * 0.01
-        s = std[i] * 0.01
-        logger.info(f"ΔlogR({name}) = {m:0.3g} ± {s:0.2f}")
-        stats[f"ΔlogR({name}) mean"] = m
-        stats[f"ΔlogR({name}) std"] = s
-
-    # Growth rates of individual lineages.
     rate = result["mean"]["rate"].mean(0)
-    rate = rate - rate[dataset["lineage_id"]["A"]]
-    for lineage in ["B.1.1.7", "B.1.617.2", "AY.23.1"]:
-        R_RA = float(rate[dataset["lineage_id"][lineage]].exp())
-        logger.info(f"R({lineage})/R(A) = {R_RA:0.3g}")
-        stats[f"R({lineage})/R(A)"] = R_RA
-
-    # Posterior predictive error.
-    true = dataset["weekly_counts"] + 1e-20  # avoid nans
-    counts = true.sum(-1, True)
-    true_probs = true / counts
-    pred = result["median"]["probs"][: len(true)] + 1e-20  # truncate, avoid nans
-    kl = true.mul(true_probs.log() - pred.log()).sum([0, -1])
-    error = (pred - true_probs) * counts**0.5  # scaled by Poisson stddev
-    mae = error.abs().mean(0)  # average over time
-    mse = error.square().mean(0)  # average over time
-    stats["MAE"] = float(mae.sum(-1).mean())  # average over region
-    stats["RMSE"] = float(mse.sum(-1).mean().sqrt())  # root average over region
-    stats["KL"] = float(kl.sum() / counts.sum())  # in units of nats / observation
-    logger.info("KL = {KL:0.4g}, MAE = {MAE:0.4g}, RMSE = {RMSE:0.4g}".format(**stats))
-
-    # Examine the MSE and RMSE over a few regions of interest.
-    queries = {
-        "England": ["B.1.1.7"],
-        # "England": ["B.1.1.7", "B.1.177", "B.1.1", "B.1"],
-        # "USA / California": ["B.1.1.7", "B.1.429", "B.1.427", "B.1.2", "B.1", "P.1"],
-    }
-    for place, lineages in queries.items():
-        matches = [p for name, p in dataset["location_id"].items() if place in name]
-        if not matches:
-            continue
-        assert len(matches) == 1, matches
-        p = matches[0]
-        stats[f"{place} KL"] = float(kl[p].sum() / true[:, p].sum())
-        stats[f"{place} MAE"] = float(mae[p].sum())
-        stats[f"{place} RMSE"] = float(mse[p].sum().sqrt())
-        logger.info(
-            "{}\tKL = {:0.3g}, MAE = {:0.3g}, RMSE = {:0.3g}".format(
-                place,
-                stats[f"{place} KL"],
-                stats[f"{place} MAE"],
-                stats[f"{place} RMSE"],
-            )
-        )
-
-        for lineage in lineages:
-            i = dataset["lineage_id"][lineage]
-            stats[f"{place} {lineage} MAE"] = mae[p, i]
-            stats[f"{place} {lineage} RMSE"] = mse[p, i].sqrt()
-            logger.info(
-                "{} {}\tMAE = {:0.3g}, RMSE = {:0.3g}".format(
-                    place,
-                    lineage,
-                    stats[f"{place} {lineage} MAE"],
-                    stats[f"{place} {lineage} RMSE"],
-                )
-            )
-
-    return {k: float(v) for k, v in stats.items()}
-
-
-@torch.no_grad()
-def log_holdout_stats(fits: dict) -> dict:
-    """
-    Logs statistics comparing multiple results from ``fit_svi``.
-    """
-    assert len(fits) > 1
-    fits = list(fits.items())
-    stats = {}
-    for i, (name1, fit1) in enumerate(fits[:-1]):
-        for name2, fit2 in fits[i + 1 :]:
-            # Compute mutation similarity.
-            mutations = sorted(set(fit1["mutations"]) & set(fit2["mutations"]))
-            medians = []
-            for fit in (fit1, fit2):
-                mutation_id = {m: i for i, m in enumerate(fit["mutations"])}
-                idx = torch.tensor([mutation_id[m] for m in mutations])
-                medians.append(fit["median"]["coef"][idx] * 0.01)
-            error = medians[0] - medians[1]
-            mutation_std = torch.cat(medians).std().item()
-            mutation_rmse = error.square().mean().sqrt().item()
-            mutation_mae = error.abs().mean().item()
-            mutation_correlation = pearson_correlation(medians[0], medians[1]).item()
-
-            # Compute lineage similarity.
-            means = []
-            for fit in (fit1, fit2):
-                rate = fit["mean"]["rate"]
-                if rate.dim() == 2:
-                    rate = rate.mean(0)
-                means.append(rate)
-            error = means[0] - means[1]
-            lineage_std = torch.cat(means).std().item()
-            lineage_rmse = error.square().mean().sqrt().item()
-            lineage_mae = error.abs().mean().item()
-            lineage_correlation = pearson_correlation(means[0], means[1]).item()
-
-            # Print stats.
-            logger.info(
-                f"{name1} vs {name2} mutations: "
-                f"ρ = {mutation_correlation:0.3g}, "
-                f"RMSE = {mutation_rmse:0.3g}, "
-                f"MAE = {mutation_mae:0.3g}"
-            )
-            logger.info(
-                f"{name1} vs {name2} lineages: "
-                f"ρ = {lineage_correlation:0.3g}, "
-                f"RMSE = {lineage_rmse:0.3g}, "
-                f"MAE = {lineage_mae:0.3g}"
-            )
-
-            # Save stats.
-            stats["mutation_corr"] = mutation_correlation
-            stats["mutation_rmse"] = mutation_rmse
-            stats["mutation_mae"] = mutation_mae
-            stats["mutation_stddev"] = mutation_std
-            stats["lineage_corr"] = lineage_correlation
-            stats["lineage_rmse"] = lineage_rmse
-            stats["lineage_mae"] = lineage_mae
-            stats["lineage_stdev"] = lineage_std
-
-    return {k: float(v) for k, v in stats.items()}
+    return inference.log_stats(dataset, result, dataset["weekly_counts"], rate)
@@ -0,0 +1,248 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Incrementally updatable aggregate counts of preprocessed ``columns``.
+
+Rebuilding a dataset from scratch requires a pass over every row of every
+snapshot. A :class:`CountStore` instead persists the dictionary-encoded key
+columns of each row (keyed by accession) together with counts of distinct
+rows. Updating the store to a new snapshot retracts removed or changed rows
+and appends new rows, and the resulting counts can be loaded directly by
+:func:`~pyrocov.mutrans.load_gisaid_data`, including prefix slices via
+``end_day``.
+"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from .columnar import DictColumn, factorize, load_columns, save_columns
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ("day", "location", "clade", "lineage")
+
+
+class CountStore:
+    """
+    A persistent multiset of rows keyed by accession, together with counts of
+    distinct rows.
+
+    :param tuple keys: Names of columns to aggregate. ``day`` is stored as an
+        integer; all other keys are dictionary-encoded strings.
+    """
+
+    def __init__(self, keys=KEY_COLUMNS):
+        self.keys = tuple(keys)
+        self.uniques = {k: [] for k in self.keys if k != "day"}
+        self._lookup = {k: {} for k in self.uniques}
+        self.accession = np.zeros(0, dtype=object)
+        self.codes = np.zeros((0, len(self.keys)), dtype=np.int64)
+        self.distinct = np.zeros((0, len(self.keys)), dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.accession)
+
+    def _encode(self, columns):
+        """
+        Encodes key columns as an ``[N, K]`` array of codes, extending
+        dictionaries with any new values.
+        """
+        missing = [k for k in self.keys + ("index",) if k not in columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        codes = np.empty((len(columns["index"]), len(self.keys)), dtype=np.int64)
+        for i, k in enumerate(self.keys):
+            if k == "day":
+                codes[:, i] = np.asarray(columns[k])
+                continue
+            row_codes, uniques = factorize(columns[k])
+            lookup = self._lookup[k]
+            mapping = np.empty(len(uniques), dtype=np.int64)
+            for j, u in enumerate(uniques):
+                code = lookup.get(u)
+                if code is None:
+                    code = lookup[u] = len(self.uniques[k])
+                    self.uniques[k].append(u)
+                mapping[j] = code
+            codes[:, i] = mapping[row_codes]
+        return codes
+
+    def _accumulate(self, codes, sign):
+        """
+        Adds ``sign`` times the rows ``codes`` to the distinct counts.
+        """
+        if not len(codes):
+            return
+        distinct = np.concatenate([self.distinct, codes])
+        count = np.concatenate([self.count, np.full(len(codes), sign, np.int64)])
+        distinct, inverse = _unique_rows(distinct)
+        count = np.bincount(inverse, count, len(distinct))
+        count = count.round().astype(np.int64)
+        assert (count >= 0).all(), "retracted rows that were never appended"
+        nonzero = count > 0
+        self.distinct = distinct[nonzero]
+        self.count = count[nonzero]
+
+    def append(self, columns):
+        """
+        Appends rows with new accessions ``columns["index"]``.
+
+        :param dict columns: A dict mapping column name to a list of values,
+            including at least ``index`` and all :attr:`keys`.
+        :raises ValueError: if any accession is duplicated or already present.
+        """
+        accession = pd.Index(np.asarray(columns["index"], dtype=object))
+        if accession.has_duplicates or accession.isin(self.accession).any():
+            raise ValueError("Cannot append duplicate accessions")
+        codes = self._encode(columns)
+        self.accession = np.concatenate([self.accession, accession.to_numpy()])
+        self.codes = np.concatenate([self.codes, codes])
+        self._accumulate(codes, 1)
+
+    def retract(self, accessions):
+        """
+        Removes rows with the given accessions.
+
+        :param accessions: A list of accessions.
+        :raises KeyError: if any accession is not present.
+        """
+        positions = pd.Index(self.accession).get_indexer(
+            np.asarray(accessions, dtype=object)
+        )
+        if (positions < 0).any():
+            raise KeyError("Cannot retract missing accessions")
+        remove = np.zeros(len(self.accession), dtype=bool)
+        remove[positions] = True
+        self._accumulate(self.codes[remove], -1)
+        self.accession = self.accession[~remove]
+        self.codes = self.codes[~remove]
+
+    def update(self, columns):
+        """
+        Updates the store to match a full snapshot ``columns``, retracting
+        rows that were removed or changed and appending rows that are new or
+        changed. Rows whose keys are unchanged are not touched.
+
+        :param dict columns: A dict mapping column name to a list of values,
+            including at least ``index`` and all :attr:`keys`.
+        :returns: A pair ``(num_appended, num_retracted)``.
+        :rtype: tuple
+        """
+        accession = np.asarray(columns["index"], dtype=object)
+        if pd.Index(accession).has_duplicates:
+            raise ValueError("Cannot update with duplicate accessions")
+        codes = self._encode(columns)
+        positions = pd.Index(self.accession).get_indexer(accession)
+        unchanged = positions >= 0
+        unchanged[unchanged] = (
+            self.codes[positions[unchanged]] == codes[unchanged]
+        ).all(-1)
+        keep = np.zeros(len(self.accession), dtype=bool)
+        keep[positions[unchanged]] = True
+
+        retracted = ~keep
+        appended = ~unchanged
+        self._accumulate(self.codes[retracted], -1)
+        self._accumulate(codes[appended], 1)
+        self.accession = np.concatenate([self.accession[keep], accession[appended]])
+        self.codes = np.concatenate([self.codes[keep], codes[appended]])
+        return int(appended.sum()), int(retracted.sum())
+
+    def to_columns(self):
+        """
+        Returns a ``columns`` dict of distinct rows with an additional
+        ``count`` column, suitable for
+        :func:`~pyrocov.mutrans.load_gisaid_data`.
+        """
+        columns = self._to_columns(self.distinct)
+        columns["count"] = self.count
+        return columns
+
+    def _to_columns(self, codes):
+        columns = {}
+        for i, k in enumerate(self.keys):
+            if k == "day":
+                columns[k] = codes[:, i].copy()
+            else:
+                columns[k] = DictColumn(codes[:, i].astype(np.int32), self.uniques[k])
+        return columns
+
+    def save(self, dirname):
+        """
+        Saves the store to a directory with subdirectories ``rows/`` and
+        ``counts/``. The latter may be passed as ``columns_filename`` to
+        :func:`~pyrocov.mutrans.load_gisaid_data`.
+        """
+        os.makedirs(dirname, exist_ok=True)
+        rows = self._to_columns(self.codes)
+        rows["index"] = list(self.accession)
+        save_columns(rows, os.path.join(dirname, "rows"))
+        save_columns(self.to_columns(), os.path.join(dirname, "counts"))
+
+    @staticmethod
+    def load(dirname):
+        """
+        Loads a store saved by :meth:`save`.
+        """
+        rows = load_columns(os.path.join(dirname, "rows"), mmap=False)
+        counts = load_columns(os.path.join(dirname, "counts"), mmap=False)
+        store = CountStore([k for k in rows if k != "index"])
+        for k in store.uniques:
+            store.uniques[k] = list(rows[k].uniques)
+            store._lookup[k] = {u: i for i, u in enumerate(store.uniques[k])}
+        store.accession = np.asarray(list(rows["index"]), dtype=object)
+        store.codes = _stack_codes(rows, store.keys)
+        store.distinct = _stack_codes(counts, store.keys)
+        store.count = np.asarray(counts["count"], dtype=np.int64)
+        return store
+
+
+def _unique_rows(codes):
+    """
+    Like ``np.unique(codes, axis=0, return_inverse=True)`` but faster, by
+    packing each row of nonnegative codes into a single integer.
+    """
+    shape = tuple(int(x) + 1 for x in codes.max(0))
+    if codes.min() < 0 or np.prod(shape, dtype=float) >= 2.0**63:
+        distinct, inverse = np.unique(codes, axis=0, return_inverse=True)
+        return distinct, inverse.reshape(-1)
+    packed = np.ravel_multi_index(tuple(codes.T), shape)
+    packed, inverse = np.unique(packed, return_inverse=True)
+    distinct = np.stack(np.unravel_index(packed, shape), -1).astype(np.int64)
+    return distinct, inverse.reshape(-1)
+
+
+def _stack_codes(columns, keys):
+    codes = np.empty((len(columns[keys[0]]), len(keys)), dtype=np.int64)
+    for i, k in enumerate(keys):
+        column = columns[k]
+        codes[:, i] = column.codes if isinstance(column, DictColumn) else column
+    return codes
+
+
+def update_count_store(columns, dirname):
+    """
+    Updates a :class:`CountStore` saved in ``dirname`` (creating it if needed)
+    to match a full snapshot ``columns``.
+
+    :param dict columns: A dict mapping column name to a list of values.
+    :param str dirname: The store directory.
+    :returns: The directory of aggregated counts.
+    :rtype: str
+    """
+    if os.path.exists(dirname):
+        store = CountStore.load(dirname)
+    else:
+        store = CountStore()
+    num_appended, num_retracted = store.update(columns)
+    logger.info(
+        f"Appended {num_appended} and retracted {num_retracted} rows, "
+        f"leaving {len(store)} rows in {len(store.count)} distinct groups"
+    )
+    store.save(dirname)
+    return os.path.join(dirname, "counts")
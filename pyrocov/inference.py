@@ -0,0 +1,1118 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Inference engine shared by the :mod:`pyrocov.mutrans` (usher clades) and
+:mod:`pyrocov.growth` (nextstrain lineages) regression models.
+
+Each data source provides a ``model(dataset, model_type, *, forecast_steps,
+memory_budget)`` and an :class:`InitLocFn` subclass. This module provides
+guides, training via :func:`fit_svi`, posterior prediction via
+:func:`predict`, and summary statistics. Models observe counts via
+:func:`get_likelihood`, which selects a likelihood backend by name from
+``model_type``; new backends can be added with :func:`register_likelihood`.
+"""
+
+import functools
+import logging
+import math
+import os
+from collections import defaultdict
+from contextlib import ExitStack
+from timeit import default_timer
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import pyro
+import pyro.distributions as dist
+import torch
+import tqdm
+from pyro import poutine
+from pyro.infer import SVI, JitTrace_ELBO, Trace_ELBO
+from pyro.infer.autoguide import (
+    AutoDelta,
+    AutoGuideList,
+    AutoLowRankMultivariateNormal,
+    AutoNormal,
+    AutoStructured,
+)
+from pyro.infer.autoguide.initialization import InitMessenger
+from pyro.nn.module import PyroModule, PyroParam
+from pyro.optim import ClippedAdam
+from pyro.poutine.util import prune_subsample_sites, site_is_subsample
+from torch.distributions import constraints
+
+from .ops import (
+    logistic_multinomial_likelihood,
+    sparse_multinomial_likelihood,
+    time_chunk_size,
+)
+from .util import (
+    BatchMeanVarianceStats,
+    CheckpointWriter,
+    ReservoirQuantileStats,
+    pearson_correlation,
+)
+
+# Requires https://github.com/pyro-ppl/pyro/pull/2953
+try:
+    from pyro.infer.autoguide.effect import AutoRegressiveMessenger
+except ImportError:
+    AutoRegressiveMessenger = object
+
+logger = logging.getLogger(__name__)
+
+LIKELIHOODS: Dict[str, Callable] = {}
+
+
+def register_likelihood(name: str):
+    """
+    Decorator to register a likelihood backend, to be selected by models
+    whose ``model_type`` contains ``name``.
+
+    A backend is a function ``fn(init, rate, time, weekly_counts,
+    sparse_counts, *, memory_budget=None)`` that observes a
+    ``[T, P, C]``-shaped count tensor, possibly sparse, under logits
+    ``init + rate * time[:, None, None]``, recording an ``"obs"`` site. Here
+    ``init`` and ``rate`` are ``[P, C]``-shaped, or ``[..., 1, P, C]``-shaped
+    when vectorized over particles, ``time`` is ``[T]``-shaped,
+    ``sparse_counts`` is the output of ``dense_to_sparse()``, and
+    ``memory_budget`` is an optional bound in bytes on temporary tensors.
+    """
+
+    def decorator(fn):
+        LIKELIHOODS[name] = fn
+        return fn
+
+    return decorator
+
+
+def get_likelihood(model_type: str) -> Callable:
+    """
+    Returns the first registered likelihood backend whose name appears in
+    ``model_type``, defaulting to ``"sparse"``.
+    """
+    for name, fn in LIKELIHOODS.items():
+        if name != "sparse" and name in model_type:
+            return fn
+    return LIKELIHOODS["sparse"]
+
+
+def _factor(name, log_prob):
+    # Align any batch dims of vectorized particles left of the model plates.
+    if log_prob.dim():
+        log_prob = log_prob.reshape(log_prob.shape + (1, 1, 1))
+    pyro.factor(name, log_prob)
+
+
+@register_likelihood("sparse")
+def sparse_likelihood(
+    init, rate, time, weekly_counts, sparse_counts, *, memory_budget=None
+):
+    """
+    Multinomial likelihood evaluated only at nonzero counts. If a
+    ``memory_budget`` is given, this computes the same value in time chunks
+    via :func:`fused_likelihood`.
+    """
+    if memory_budget is not None:
+        return fused_likelihood(
+            init, rate, time, weekly_counts, sparse_counts, memory_budget=memory_budget
+        )
+    logits = init + rate * time[:, None, None]  # [T, P, C]
+    logits = logits.log_softmax(-1)
+    t, p, c = sparse_counts["index"]
+    _factor(
+        "obs",
+        sparse_multinomial_likelihood(
+            sparse_counts["total"], logits[..., t, p, c], sparse_counts["value"]
+        ),
+    )
+
+
+@register_likelihood("dense")
+def dense_likelihood(
+    init, rate, time, weekly_counts, sparse_counts, *, memory_budget=None
+):
+    """
+    Multinomial likelihood of dense counts. This is equivalent to
+    :func:`sparse_likelihood` but more expensive, and ignores
+    ``memory_budget`` since counts are already dense.
+    """
+    logits = init + rate * time[:, None, None]  # [T, P, C]
+    if logits.dim() > 3:  # Align batch dims left of the model plates.
+        logits = logits.reshape(logits.shape[:-3] + (1, 1, 1) + logits.shape[-3:])
+    if weekly_counts.is_sparse:
+        weekly_counts = weekly_counts.to_dense()
+    # Sum over the time and place dims via .to_event(2) rather than plates,
+    # since models have already declared those plates.
+    pyro.sample(
+        "obs",
+        dist.Multinomial(logits=logits, validate_args=False).to_event(2),
+        obs=weekly_counts,
+    )  # [T, P, C]
+
+
+@register_likelihood("fused")
+def fused_likelihood(
+    init, rate, time, weekly_counts, sparse_counts, *, memory_budget=None
+):
+    """
+    Multinomial likelihood equivalent to :func:`sparse_likelihood`, but
+    computed by a fused op that never creates ``[T, P, C]``-shaped tensors;
+    see :func:`~pyrocov.ops.logistic_multinomial_likelihood`. By default
+    this streams over single time steps; a ``memory_budget`` allows larger
+    and faster time chunks.
+    """
+    init = init.reshape(init.shape[:-3] + init.shape[-2:])  # [..., P, C]
+    rate = rate.reshape(rate.shape[:-3] + rate.shape[-2:])  # [..., P, C]
+    chunk_size = 1
+    if memory_budget is not None:
+        chunk_size = time_chunk_size(
+            memory_budget, len(time), init.numel(), itemsize=init.element_size()
+        )
+    _factor(
+        "obs",
+        logistic_multinomial_likelihood(
+            sparse_counts["total"],
+            init,
+            rate,
+            time,
+            sparse_counts["index"],
+            sparse_counts["value"],
+            chunk_size=chunk_size,
+        ),
+    )
+
+
+class InitLocFn:
+    """
+    Initializer for latent variables.
+
+    This is passed as the ``init_loc_fn`` to guides.
+
+    :param torch.Tensor counts: A ``[P, C]``-shaped tensor of total counts.
+    :param torch.Tensor index: The index of observed ``(place, clade)``
+        pairs in ``counts.reshape(-1)``.
+    :param str prefix: The name prefix of pairwise latent variables, e.g.
+        ``"pc"`` for ``pc_init``.
+    """
+
+    def __init__(self, counts, index, prefix):
+        # Initialize init.
+        init = counts
+        init.add_(1 / init.size(-1)).div_(init.sum(-1, True))
+        init.log_().sub_(init.median(-1, True).values).add_(torch.randn(init.shape))
+        self.init = init  # [P, C]
+        self.init_decentered = init / 2
+        self.init_loc = init.mean(0)  # [C]
+        self.init_loc_decentered = self.init_loc / 2
+        setattr(self, f"{prefix}_init", self.init.reshape(-1)[index] / 2)
+        assert not torch.isnan(self.init).any()
+        logger.info(f"init stddev = {self.init.std():0.3g}")
+
+    def __call__(self, site):
+        name = site["name"]
+        shape = site["fn"].shape()
+        if hasattr(self, name):
+            result = getattr(self, name)
+            assert result.shape == shape
+            return result
+        if name in (
+            "coef_scale",
+            "init_scale",
+            "init_loc_scale",
+        ):
+            return torch.ones(shape)
+        if name == "logits_scale":
+            return torch.full(shape, 0.002)
+        if name in (
+            "rate_scale",
+            "rate_loc_scale",
+            "place_scale",
+            "clade_scale",
+            "lineage_scale",
+        ):
+            return torch.full(shape, 0.01)
+        if name in (
+            "rate_loc",
+            "rate_loc_decentered",
+            "coef",
+            "coef_decentered",
+            "rate",
+            "rate_decentered",
+            "pc_rate",
+            "pc_rate_decentered",
+            "pl_rate",
+            "pl_rate_decentered",
+        ):
+            return torch.rand(shape).sub_(0.5).mul_(0.01)
+        if name == "coef_loc":
+            return torch.rand(shape).sub_(0.5).mul_(0.01).add_(1.0)
+        raise ValueError(f"InitLocFn found unhandled site {repr(name)}; please update.")
+
+
+class Guide(AutoGuideList):
+    """
+    Custom guide for large-scale inference.
+
+    This combines a low-rank multivariate normal guide over small variables
+    with a mean field guide over remaining latent variables.
+    """
+
+    def __init__(self, model, init_loc_fn, init_scale, rank):
+        super().__init__(InitMessenger(init_loc_fn)(model))
+
+        # Jointly estimate globals, mutation coefficients, and clade coefficients.
+        mvn = [
+            "coef_scale",
+            "rate_loc_scale",
+            "init_loc_scale",
+            "rate_scale",
+            "init_scale",
+            "coef",
+            "coef_decentered",
+            "rate_loc",
+            "rate_loc_decentered",
+            "init_loc",
+            "init_loc_decentered",
+        ]
+        self.append(
+            AutoLowRankMultivariateNormal(
+                poutine.block(model, expose=mvn),
+                init_loc_fn=init_loc_fn,
+                init_scale=init_scale,
+                rank=rank,
+            )
+        )
+        model = poutine.block(model, hide=mvn)
+
+        # Mean-field estimate all remaining latent variables.
+        self.append(AutoNormal(model, init_loc_fn=init_loc_fn, init_scale=init_scale))
+
+
+class RegressiveGuide(AutoRegressiveMessenger):
+    def get_posterior(self, name, prior):
+        if name == "coef":
+            if not hasattr(self, "coef"):
+                # Initialize.
+                self.coef = PyroModule()
+                n = prior.shape()[-1]
+                rank = 100
+                assert n > 1
+                init_loc = self.init_loc_fn({"name": name, "fn": prior})
+                self.coef.loc = PyroParam(init_loc, event_dim=1)
+                self.coef.scale = PyroParam(
+                    torch.full((n,), self._init_scale),
+                    event_dim=1,
+                    constraint=constraints.positive,
+                )
+                self.coef.cov_factor = PyroParam(
+                    torch.empty(n, rank).normal_(0, 1 / rank**0.5),
+                    event_dim=2,
+                )
+            scale = self.coef.scale
+            cov_factor = self.coef.cov_factor * scale.unsqueeze(-1)
+            cov_diag = scale * scale
+            return dist.LowRankMultivariateNormal(self.coef.loc, cov_factor, cov_diag)
+
+        return super().get_posterior(name, prior)
+
+
+def make_guide(model, guide_type, init_loc_fn, rank=200):
+    """
+    Creates a guide of a given ``guide_type``, one of "map", "normal",
+    "full", "structured", "regressive", or otherwise a custom :class:`Guide`.
+    """
+    if guide_type == "map":
+        return AutoDelta(model, init_loc_fn=init_loc_fn)
+    if guide_type == "normal":
+        return AutoNormal(model, init_loc_fn=init_loc_fn, init_scale=0.01)
+    if guide_type == "full":
+        return AutoLowRankMultivariateNormal(
+            model, init_loc_fn=init_loc_fn, init_scale=0.01, rank=rank
+        )
+    if guide_type == "structured":
+        return AutoStructured(
+            model,
+            init_loc_fn=init_loc_fn,
+            init_scale=0.01,
+            conditionals=defaultdict(
+                lambda: "normal",
+                rate_scale="delta",
+                init_loc_scale="delta",
+                init_scale="delta",
+                coef="mvn",
+                coef_decentered="mvn",
+            ),
+        )
+    if guide_type == "regressive":
+        return RegressiveGuide(model, init_loc_fn=init_loc_fn, init_scale=0.01)
+    return Guide(model, init_loc_fn=init_loc_fn, init_scale=0.01, rank=rank)
+
+
+@torch.no_grad()
+@poutine.mask(mask=False)
+def _split_memory_budget(memory_budget):
+    """
+    Splits a memory budget in bytes into a pair ``(model_budget,
+    sample_budget)`` bounding respectively temporary tensors in the model and
+    the sample sites of a vectorized batch, which coexist in memory.
+    """
+    if memory_budget is None:
+        return None, None
+    model_budget = int(memory_budget) // 2
+    return model_budget, int(memory_budget) - model_budget
+
+
+def predict(
+    model,
+    guide,
+    dataset,
+    model_type,
+    *,
+    num_samples=1000,
+    vectorize=None,
+    save_params=("rate", "init", "probs"),
+    forecast_steps=0,
+    memory_budget=None,
+    batch_size=None,
+    quantiles=(),
+    sketch_size=100,
+) -> dict:
+    """
+    Computes the posterior median and streaming posterior moments of sample
+    sites, including a forecast of ``probs``.
+
+    Samples are drawn either sequentially or, if ``vectorize``, in batches
+    under a ``"particles"`` plate, and are streamed into running mean and
+    variance statistics, so memory does not grow with ``num_samples``.
+
+    :param bool vectorize: Whether to draw samples in batches, defaulting to
+        True if a ``memory_budget`` is given or if ``probs`` is small.
+    :param int memory_budget: An optional bound in bytes on the memory of each
+        batch, split evenly between its sample sites and temporary tensors in
+        the model.
+    :param int batch_size: An optional number of samples per batch,
+        overriding the batch size derived from ``memory_budget``.
+    :param tuple quantiles: Optional quantiles to estimate for each saved
+        site, stored in ``result["quantiles"]`` with the quantile dim
+        leftmost. These are estimated from a reservoir sample of at most
+        ``sketch_size`` samples; see :class:`~pyrocov.util.ReservoirQuantileStats`.
+    :returns: A dict with keys "median", "mean", "std", and optionally
+        "quantiles", each mapping site names to tensors.
+    :rtype: dict
+    """
+    model_budget, sample_budget = _split_memory_budget(memory_budget)
+    if memory_budget is not None:
+        model = functools.partial(model, memory_budget=model_budget)
+
+    def get_conditionals(data):
+        trace = poutine.trace(poutine.condition(model, data)).get_trace(
+            dataset, model_type, forecast_steps=forecast_steps
+        )
+        return {
+            name: site["value"].detach()
+            for name, site in trace.nodes.items()
+            if site["type"] == "sample" and not site_is_subsample(site)
+            if not name.startswith("obs")
+        }
+
+    # Compute median point estimate.
+    result: dict = defaultdict(dict)
+    median = get_conditionals(guide.median(dataset))
+    for name, value in median.items():
+        if value.numel() < 1e5 or name in save_params:
+            result["median"][name] = value
+
+    # Configure batching.
+    save_params = {
+        k for k, v in result["median"].items() if v.numel() < 1e5 or k in save_params
+    }
+    if vectorize is None:
+        vectorize = (
+            memory_budget is not None
+            or batch_size is not None
+            or result["median"]["probs"].numel() < 1e6
+        )
+    if not vectorize:
+        batch_size = 1
+    elif batch_size is None:
+        batch_size = num_samples
+        if memory_budget is not None:
+            sample_bytes = sum(v.numel() * v.element_size() for v in median.values())
+            batch_size = sample_budget // max(1, sample_bytes)
+    batch_size = max(1, min(num_samples, batch_size))
+
+    # Compute streaming moments and quantiles.
+    moments = {k: BatchMeanVarianceStats() for k in save_params}
+    sketches = {
+        k: ReservoirQuantileStats(sketch_size, quantiles)
+        for k in save_params
+        if quantiles
+    }
+    with tqdm.tqdm(total=num_samples) as progress:
+        for start in range(0, num_samples, batch_size):
+            size = min(batch_size, num_samples - start)
+            if vectorize:
+                with pyro.plate("particles", size, dim=-4):
+                    samples = get_conditionals(guide())
+            else:
+                samples = get_conditionals(guide())
+            for k in save_params:
+                shape = result["median"][k].shape
+                if vectorize:
+                    # Move particles to a leading batch dim.
+                    batch = samples[k].reshape((-1,) + shape).expand((size,) + shape)
+                    moments[k].update_batch(batch)
+                else:
+                    batch = samples[k][None]
+                    moments[k].update(samples[k])
+                if k in sketches:
+                    sketches[k].update_batch(batch)
+            progress.update(size)
+    for k, stats in moments.items():
+        stats = stats.get()
+        result["mean"][k] = stats["mean"]
+        result["std"][k] = stats["variance"].sqrt()
+    for k, stats in sketches.items():
+        result["quantiles"][k] = stats.get()["quantiles"]
+    return dict(result)
+
+
+@torch.no_grad()
+def expected_log_likelihood(
+    model,
+    guide,
+    dataset,
+    model_type,
+    *,
+    num_particles=256,
+    vectorize=None,
+    memory_budget=None,
+) -> Tuple[float, float]:
+    """
+    Estimates the expected log likelihood ``E_q[log p(obs | z)]`` of the
+    ``"obs"`` site under the guide by Monte Carlo.
+
+    :param int num_particles: The number of guide samples.
+    :param bool vectorize: Whether to draw particles in parallel under a
+        ``pyro.plate``, rather than in a sequential loop. Defaults to
+        vectorizing iff a ``memory_budget`` is given.
+    :param int memory_budget: An optional bound in bytes on the memory of
+        each vectorized chunk of particles, split evenly between its sample
+        sites and temporary tensors in the model.
+    :returns: A pair ``(ell, stderr)`` of the estimate and its Monte Carlo
+        standard error.
+    :rtype: tuple
+    """
+    if vectorize is None:
+        vectorize = memory_budget is not None
+    model_budget, sample_budget = _split_memory_budget(memory_budget)
+    if memory_budget is not None:
+        model = functools.partial(model, memory_budget=model_budget)
+
+    def get_log_likelihood(num_particles):
+        with poutine.block(), ExitStack() as stack:
+            if vectorize:
+                stack.enter_context(pyro.plate("particles", num_particles, dim=-4))
+            guide_trace = poutine.trace(guide).get_trace(
+                dataset=dataset, model_type=model_type
+            )
+            replayed_model = poutine.replay(model, trace=guide_trace)
+            model_trace = poutine.trace(replayed_model).get_trace(
+                dataset=dataset, model_type=model_type
+            )
+        model_trace.compute_log_prob()
+        return model_trace, model_trace.nodes["obs"]["unscaled_log_prob"]
+
+    if not vectorize:
+        values = [get_log_likelihood(1)[1].item() for _ in range(num_particles)]
+        ell = sum(v / float(num_particles) for v in values)
+        stderr = math.nan
+        if num_particles > 1:
+            stderr = float(np.std(values, ddof=1) / num_particles**0.5)
+        return ell, stderr
+
+    # Draw one particle to measure memory, then fill chunks within budget.
+    trace, value = get_log_likelihood(1)
+    values = [value.reshape(-1)]
+    batch_size = num_particles - 1
+    if memory_budget is not None:
+        sample_bytes = sum(
+            site["value"].numel() * site["value"].element_size()
+            for site in trace.nodes.values()
+            if site["type"] == "sample"
+        )
+        batch_size = max(1, min(batch_size, sample_budget // max(1, sample_bytes)))
+    del trace
+    remaining = num_particles - 1
+    while remaining > 0:
+        size = min(batch_size, remaining)
+        values.append(get_log_likelihood(size)[1].reshape(-1))
+        remaining -= size
+    values = torch.cat(values).double()
+    ell = values.mean().item()
+    stderr = math.nan
+    if num_particles > 1:
+        stderr = (values.std() / num_particles**0.5).item()
+    return ell, stderr
+
+
+class CompiledTrace_ELBO(Trace_ELBO):
+    """
+    A :class:`~pyro.infer.Trace_ELBO` that fuses the model and guide into a
+    single loss function and optionally compiles it via :func:`torch.compile`.
+
+    The first step runs eagerly through Pyro, creating all params. The loss is
+    then traced once via :func:`~torch.fx.experimental.proxy_tensor.make_fx`
+    into an aten-level graph that is free of Pyro effect handlers, refers to
+    params by reference so that in-place optimizer updates need no retracing,
+    and traces random draws as ops so that each step draws fresh noise.
+    Subsequent steps evaluate this graph. The arguments are assumed constant
+    between steps, and control flow must not depend on tensor values.
+
+    This falls back to :class:`~pyro.infer.Trace_ELBO` with a warning if
+    tracing fails, if the guide is not fully reparametrized, or if
+    ``num_particles > 1``. If compilation fails it falls back to the traced
+    graph.
+
+    :param str backend: A :func:`torch.compile` backend, or "fx" to evaluate
+        the traced graph without compiling.
+    """
+
+    def __init__(self, *, backend="inductor", **kwargs):
+        super().__init__(**kwargs)
+        self.backend = backend
+        self._key = None
+        self._graph = None
+        self._loss_fn = None
+        self._param_names = ()
+
+    def loss_and_grads(self, model, guide, *args, **kwargs):
+        key = (id(model), id(guide), tuple(map(id, args)))
+        key += tuple((k, id(v)) for k, v in sorted(kwargs.items()))
+        if key != self._key:
+            self._key = key
+            loss = super().loss_and_grads(model, guide, *args, **kwargs)
+            self._trace(model, guide, args, kwargs)
+            return loss
+        if self._loss_fn is None:
+            return super().loss_and_grads(model, guide, *args, **kwargs)
+
+        # Register params with the caller, e.g. the param capture of SVI.
+        for name in self._param_names:
+            pyro.param(name)
+        try:
+            loss = self._loss_fn()
+        except Exception as e:
+            if self._loss_fn is self._graph:
+                raise
+            logger.warning(f"Failed to compile ELBO, falling back to fx: {e}")
+            self._loss_fn = self._graph
+            loss = self._loss_fn()
+        loss.backward()
+        return loss.item()
+
+    def _trace(self, model, guide, args, kwargs):
+        from torch.fx.experimental.proxy_tensor import make_fx
+
+        self._graph = self._loss_fn = None
+        if self.num_particles != 1:
+            logger.warning("CompiledTrace_ELBO supports only num_particles=1")
+            return
+        guide_traces = []
+
+        def loss_fn():
+            guide_trace = poutine.trace(guide).get_trace(*args, **kwargs)
+            model_trace = poutine.trace(
+                poutine.replay(model, trace=guide_trace)
+            ).get_trace(*args, **kwargs)
+            guide_traces.append(guide_trace)
+            guide_trace = prune_subsample_sites(guide_trace)
+            model_trace = prune_subsample_sites(model_trace)
+            return guide_trace.log_prob_sum() - model_trace.log_prob_sum()
+
+        # Validation is disabled because it reads tensor values.
+        try:
+            with poutine.block(), poutine.trace(param_only=True) as capture:
+                with pyro.validation_enabled(False):
+                    graph = make_fx(loss_fn)()
+        except Exception as e:
+            logger.warning(f"Failed to trace ELBO, falling back to Pyro: {e}")
+            return
+        for site in prune_subsample_sites(guide_traces[0]).nodes.values():
+            if site["type"] == "sample" and not site["is_observed"]:
+                if not site["fn"].has_rsample:
+                    logger.warning(
+                        f"Site {site['name']} is not reparametrized, "
+                        "falling back to Pyro"
+                    )
+                    return
+        self._param_names = tuple(capture.trace.nodes)
+        self._graph = graph
+        self._loss_fn = graph
+        if self.backend != "fx":
+            self._loss_fn = torch.compile(graph, backend=self.backend)
+
+
+def fit_svi(
+    model,
+    make_init_loc_fn,
+    dataset: dict,
+    *,
+    model_type: str,
+    guide_type: str,
+    cond_data={},
+    forecast_steps=0,
+    learning_rate=0.05,
+    learning_rate_decay=0.1,
+    num_steps=3001,
+    num_samples=1000,
+    clip_norm=10.0,
+    rank=200,
+    jit=True,
+    log_every=50,
+    seed=20210319,
+    check_loss=False,
+    num_ell_particles=0,
+    vectorize=None,
+    memory_budget=None,
+    telemetry="eager",
+    compile_backend=None,
+    checkpoint_filename=None,
+    checkpoint_every=1000,
+) -> dict:
+    """
+    Fits a variational posterior using stochastic variational inference (SVI).
+
+    :param callable model: A model ``model(dataset, model_type, *,
+        forecast_steps=None, memory_budget=None)``.
+    :param callable make_init_loc_fn: A function inputting a ``dataset`` and
+        returning an ``init_loc_fn`` for guides, e.g. an :class:`InitLocFn`
+        subclass. This is called after seeding.
+    :param dict dataset: The dataset dictionary.
+    :param int num_ell_particles: The number of particles used to estimate
+        the expected log likelihood ``result["ELL"]`` and its standard error
+        ``result["ELL_stderr"]``, or zero to skip; see
+        :func:`expected_log_likelihood`.
+    :param bool vectorize: Whether to vectorize over particles when
+        estimating the ELL and over samples in :func:`predict`, or None to
+        decide automatically.
+    :param int memory_budget: An optional bound in bytes on temporary
+        ``[T, P, C]``-shaped tensors. If set, the model evaluates its
+        likelihood in time chunks that fit this budget. :func:`predict` and
+        :func:`expected_log_likelihood` split the budget evenly between the
+        model's temporaries and each vectorized batch of samples.
+    :param str telemetry: How to record ``result["series"]``, either "eager"
+        to record gradient norms and scalar medians on every step, or
+        "buffered" to record gradient norms into preallocated tensors on
+        device and copy them to the host only every ``log_every`` steps.
+        "buffered" avoids per-step host syncs and per-step evaluation of
+        ``guide.median()``; scalar medians are then recorded only every
+        ``log_every`` steps and at the final step.
+    :param str compile_backend: If set, fuse the model and guide into a single
+        traced loss function via :class:`CompiledTrace_ELBO`, compiled with
+        this :func:`torch.compile` backend, or evaluated uncompiled if "fx".
+        This overrides ``jit``.
+    :param str checkpoint_filename: An optional filename to periodically save
+        training state to, namely params, optimizer state, the torch RNG state,
+        losses and series. If this file exists, training resumes from it,
+        unless its ``num_steps``, ``model_type``, ``guide_type`` or param
+        shapes differ from this run, in which case it is ignored. The
+        file is written atomically in a background thread via
+        :class:`~pyrocov.util.CheckpointWriter` and deleted after training.
+    :param int checkpoint_every: The number of steps between checkpoints.
+    """
+    if telemetry not in ("eager", "buffered"):
+        raise ValueError(f"Unknown telemetry: {repr(telemetry)}")
+    start_time = default_timer()
+
+    logger.info(f"Fitting {guide_type} guide via SVI")
+    pyro.set_rng_seed(seed)
+    pyro.clear_param_store()
+    param_store = pyro.get_param_store()
+
+    # Initialize guide so we can count parameters and register hooks.
+    cond_data = {k: torch.as_tensor(v) for k, v in cond_data.items()}
+    if memory_budget is not None:
+        model = functools.partial(model, memory_budget=memory_budget)
+    model_ = poutine.condition(model, cond_data)
+    init_loc_fn = make_init_loc_fn(dataset)
+    Elbo = JitTrace_ELBO if jit else Trace_ELBO
+    if compile_backend is not None:
+        Elbo = functools.partial(CompiledTrace_ELBO, backend=compile_backend)
+    guide = make_guide(model_, guide_type, init_loc_fn, rank=rank)
+    # This initializes the guide:
+    latent_shapes = {k: v.shape for k, v in guide(dataset, model_type).items()}
+    latent_numel = {k: v.numel() for k, v in latent_shapes.items()}
+    logger.info(
+        "\n".join(
+            [f"Model has {sum(latent_numel.values())} latent variables of shapes:"]
+            + [f" {k} {tuple(v)}" for k, v in latent_shapes.items()]
+        )
+    )
+    param_shapes = {k: v.shape for k, v in pyro.get_param_store().named_parameters()}
+    param_numel = {k: v.numel() for k, v in param_shapes.items()}
+    logger.info(
+        "\n".join(
+            [f"Guide has {sum(param_numel.values())} parameters of shapes:"]
+            + [f" {k} {tuple(v)}" for k, v in param_shapes.items()]
+        )
+    )
+
+    config = {
+        "num_steps": num_steps,
+        "model_type": model_type,
+        "guide_type": guide_type,
+        "param_shapes": {k: list(v) for k, v in param_shapes.items()},
+    }
+    checkpoint = None
+    if checkpoint_filename is not None and os.path.exists(checkpoint_filename):
+        checkpoint = torch.load(checkpoint_filename, map_location="cpu")
+        mismatch = [k for k, v in config.items() if checkpoint.get(k) != v]
+        if mismatch:
+            logger.warning(
+                f"Ignoring {checkpoint_filename} with mismatched "
+                f"{', '.join(mismatch)}; training from scratch"
+            )
+            checkpoint = None
+        else:
+            logger.info(f"Resuming from {checkpoint_filename}")
+    if checkpoint is not None:
+        with torch.no_grad():
+            for name, value in checkpoint["params"].items():
+                pyro.param(name).unconstrained().copy_(value)
+
+    # Log gradient norms during inference.
+    series: dict = defaultdict(list)
+    buffered = telemetry == "buffered"
+    buffer_size = (log_every or num_steps) if buffered else 0
+    grad_norms: Dict[str, torch.Tensor] = {}
+    cursor = [0]  # The next position in each buffer.
+
+    def hook(g, series):
+        series.append(torch.linalg.norm(g.reshape(-1), math.inf).item())
+
+    def buffered_hook(g, buffer):
+        buffer[cursor[0]] = torch.linalg.norm(g.detach().reshape(-1), math.inf)
+
+    for name, value in pyro.get_param_store().named_parameters():
+        if buffered:
+            # Params without gradients on a step leave a nan to be skipped.
+            buffer = value.new_full((buffer_size,), math.nan)
+            grad_norms[name] = buffer
+            value.register_hook(functools.partial(buffered_hook, buffer=buffer))
+        else:
+            value.register_hook(functools.partial(hook, series=series[name]))
+
+    def flush():
+        for name, buffer in grad_norms.items():
+            values = buffer[: cursor[0]].tolist()
+            series[name].extend(v for v in values if not math.isnan(v))
+            buffer.fill_(math.nan)
+        cursor[0] = 0
+
+    def optim_config(param_name):
+        config: dict = {
+            "lr": learning_rate,
+            "lrd": learning_rate_decay ** (1 / num_steps),
+            "clip_norm": clip_norm,
+        }
+        scalars = [k for k, v in latent_numel.items() if v == 1]
+        if any("locs." + s in name for s in scalars):
+            config["lr"] *= 0.2
+        elif "scales" in param_name:
+            config["lr"] *= 0.1
+        elif "scale_tril" in param_name:
+            config["lr"] *= 0.05
+        elif "factors" in param_name or "prec_sqrts" in param_name:
+            config["lr"] *= 0.05
+        elif "weight_" in param_name:
+            config["lr"] *= 0.01
+        elif "weight" in param_name:
+            config["lr"] *= 0.03
+        elif "_centered" in param_name:
+            config["lr"] *= 0.1
+        return config
+
+    optim = ClippedAdam(optim_config)
+    elbo = Elbo(max_plate_nesting=3, ignore_jit_warnings=True)
+    svi = SVI(model_, guide, optim, elbo)
+    losses = []
+    start_step = 0
+    if checkpoint is not None:
+        optim.set_state(checkpoint["optim"])
+        losses.extend(checkpoint["losses"])
+        for name, values in checkpoint["series"].items():
+            series[name].extend(values)  # Hooks hold references to these lists.
+        torch.set_rng_state(checkpoint["rng"])
+        if "cuda_rng" in checkpoint:
+            torch.cuda.set_rng_state_all(checkpoint["cuda_rng"])
+        start_step = checkpoint["step"]
+    writer = None
+    if checkpoint_filename is not None:
+        writer = CheckpointWriter(checkpoint_filename)
+
+    def save_checkpoint(step):
+        if buffered:
+            flush()
+        state = {
+            **config,
+            "step": step,
+            "params": {k: v.detach() for k, v in param_store.named_parameters()},
+            "optim": optim.get_state(),
+            "rng": torch.get_rng_state(),
+            "losses": list(losses),
+            "series": {k: list(v) for k, v in series.items()},
+        }
+        if torch.cuda.is_initialized():
+            state["cuda_rng"] = torch.cuda.get_rng_state_all()
+        writer.save(state)
+
+    num_obs = dataset["sparse_counts"]["value"].numel()
+    for step in range(start_step, num_steps):
+        loss = svi.step(dataset=dataset, model_type=model_type)
+        assert not math.isnan(loss)
+        losses.append(loss)
+        logging_step = log_every and step % log_every == 0
+        if buffered:
+            cursor[0] += 1
+        if not buffered or logging_step or step == num_steps - 1:
+            if buffered:
+                flush()
+            median = guide.median()
+            for name, value in median.items():
+                if value.numel() == 1:
+                    series[name].append(float(value))
+        if logging_step:
+            logger.info(
+                " ".join(
+                    [f"step {step: >4d} L={loss / num_obs:0.6g}"]
+                    + [
+                        "{}={:0.3g}".format(
+                            "".join(p[0] for p in k.split("_")).upper(), v.item()
+                        )
+                        for k, v in median.items()
+                        if v.numel() == 1
+                    ]
+                )
+            )
+        if check_loss and step >= 50:
+            prev = torch.tensor(losses[-50:-25], device="cpu").median().item()
+            curr = torch.tensor(losses[-25:], device="cpu").median().item()
+            assert (curr - prev) < num_obs, "loss is increasing"
+        if writer is not None and (step + 1) % checkpoint_every == 0:
+            if step + 1 < num_steps:
+                save_checkpoint(step + 1)
+    if writer is not None:
+        writer.wait()
+        if os.path.exists(checkpoint_filename):
+            os.remove(checkpoint_filename)
+
+    result: dict = {}
+    if num_ell_particles:
+        result["ELL"], result["ELL_stderr"] = expected_log_likelihood(
+            model_,
+            guide,
+            dataset,
+            model_type,
+            num_particles=num_ell_particles,
+            vectorize=vectorize,
+            memory_budget=memory_budget,
+        )
+
+    result.update(
+        predict(
+            model_,
+            guide,
+            dataset,
+            model_type,
+            num_samples=num_samples,
+            vectorize=vectorize,
+            forecast_steps=forecast_steps,
+            memory_budget=memory_budget,
+        )
+    )
+    result["losses"] = losses
+    series["loss"] = losses
+    result["series"] = dict(series)
+    result["params"] = {
+        k: v.detach().float().cpu().clone()
+        for k, v in param_store.items()
+        if v.numel() < 1e8
+    }
+    result["walltime"] = default_timer() - start_time
+    return result
+
+
+@torch.no_grad()
+def log_stats(
+    dataset: dict,
+    result: dict,
+    weekly_lineages: torch.Tensor,
+    lineage_rate: torch.Tensor,
+) -> dict:
+    """
+    Logs statistics of predictions and model fit in the ``result`` of
+    ``fit_svi()``.
+
+    :param dict dataset: The dataset dictionary.
+    :param dict result: The output of :func:`fit_svi`.
+    :param torch.Tensor weekly_lineages: A dense ``[T, P, L]``-shaped tensor
+        of observed counts of each lineage in ``dataset["lineage_id"]``.
+    :param torch.Tensor lineage_rate: An ``[L]``-shaped tensor of mean
+        growth rates of each lineage.
+    :returns: A dictionary of statistics.
+    """
+    stats = {k: float(v) for k, v in result["median"].items() if v.numel() == 1}
+    stats["loss"] = float(np.median(result["losses"][-100:]))
+    mutations = dataset["mutations"]
+
+    if "coef" in result["mean"]:
+        mean = result["mean"]["coef"].cpu()
+        if not mean.shape:
+            return stats  # Work around error in map estimation.
+
+        # Statistical significance.
+        std = result["std"]["coef"].cpu()
+        sig = mean.abs() / std
+        logger.info(f"|μ|/σ [median,max] = [{sig.median():0.3g},{sig.max():0.3g}]")
+        stats["|μ|/σ median"] = sig.median()
+        stats["|μ|/σ max"] = sig.max()
+
+        # Effects of individual mutations.
+        for name in ["S:D614G", "S:N501Y", "S:E484K", "S:L452R"]:
+            if name not in mutations:
+                continue
+            i = mutations.index(name)
+            m = mean[i] * 0.01
+            s = std[i] * 0.01
+            logger.info(f"ΔlogR({name}) = {m:0.3g} ± {s:0.2f}")
+            stats[f"ΔlogR({name}) mean"] = m
+            stats[f"ΔlogR({name}) std"] = s
+
+    # Growth rates of individual lineages.
+    rate = lineage_rate - lineage_rate[dataset["lineage_id"]["A"]]
+    for lineage in ["B.1.1.7", "B.1.617.2", "AY.23.1"]:
+        R_RA = float(rate[dataset["lineage_id"][lineage]].exp())
+        logger.info(f"R({lineage})/R(A) = {R_RA:0.3g}")
+        stats[f"R({lineage})/R(A)"] = R_RA
+
+    # Posterior predictive error.
+    true = weekly_lineages + 1e-20  # avoid nans
+    counts = true.sum(-1, True)
+    true_probs = true / counts
+    pred = result["median"]["probs"][: len(true)] + 1e-20  # truncate, avoid nans
+    kl = true.mul(true_probs.log() - pred.log()).sum([0, -1])
+    error = (pred - true_probs) * counts**0.5  # scaled by Poisson stddev
+    mae = error.abs().mean(0)  # average over time
+    mse = error.square().mean(0)  # average over time
+    stats["MAE"] = float(mae.sum(-1).mean())  # average over region
+    stats["RMSE"] = float(mse.sum(-1).mean().sqrt())  # root average over region
+    stats["KL"] = float(kl.sum() / counts.sum())  # in units of nats / observation
+    if "ELL" in result:
+        stats["ELL"] = result["ELL"]
+
+    logger.info("KL = {KL:0.4g}, MAE = {MAE:0.4g}, RMSE = {RMSE:0.4g}".format(**stats))
+
+    # Examine the MSE and RMSE over a few regions of interest.
+    queries = {
+        "England": ["B.1.1.7"],
+        # "England": ["B.1.1.7", "B.1.177", "B.1.1", "B.1"],
+        # "USA / California": ["B.1.1.7", "B.1.429", "B.1.427", "B.1.2", "B.1", "P.1"],
+    }
+    for place, lineages in queries.items():
+        matches = [p for name, p in dataset["location_id"].items() if place in name]
+        if not matches:
+            continue
+        assert len(matches) == 1, matches
+        p = matches[0]
+        stats[f"{place} KL"] = float(kl[p].sum() / true[:, p].sum())
+        stats[f"{place} MAE"] = float(mae[p].sum())
+        stats[f"{place} RMSE"] = float(mse[p].sum().sqrt())
+        logger.info(
+            "{}\tKL = {:0.3g}, MAE = {:0.3g}, RMSE = {:0.3g}".format(
+                place,
+                stats[f"{place} KL"],
+                stats[f"{place} MAE"],
+                stats[f"{place} RMSE"],
+            )
+        )
+
+        for lineage in lineages:
+            i = dataset["lineage_id"][lineage]
+            stats[f"{place} {lineage} MAE"] = mae[p, i]
+            stats[f"{place} {lineage} RMSE"] = mse[p, i].sqrt()
+            logger.info(
+                "{} {}\tMAE = {:0.3g}, RMSE = {:0.3g}".format(
+                    place,
+                    lineage,
+                    stats[f"{place} {lineage} MAE"],
+                    stats[f"{place} {lineage} RMSE"],
+                )
+            )
+
+    return {k: float(v) for k, v in stats.items()}
+
+
+@torch.no_grad()
+def log_holdout_stats(fits: dict) -> dict:
+    """
+    Logs statistics comparing multiple results from ``fit_svi``.
+    """
+    assert len(fits) > 1
+    fits = list(fits.items())
+    stats = {}
+    for i, (name1, fit1) in enumerate(fits[:-1]):
+        for name2, fit2 in fits[i + 1 :]:
+            # Compute mutation similarity.
+            mutations = sorted(set(fit1["mutations"]) & set(fit2["mutations"]))
+            medians = []
+            for fit in (fit1, fit2):
+                mutation_id = {m: i for i, m in enumerate(fit["mutations"])}
+                idx = torch.tensor([mutation_id[m] for m in mutations])
+                medians.append(fit["median"]["coef"][idx] * 0.01)
+            error = medians[0] - medians[1]
+            mutation_std = torch.cat(medians).std().item()
+            mutation_rmse = error.square().mean().sqrt().item()
+            mutation_mae = error.abs().mean().item()
+            mutation_correlation = pearson_correlation(medians[0], medians[1]).item()
+
+            # Compute lineage similarity.
+            means = []
+            for fit in (fit1, fit2):
+                rate = fit["mean"]["rate"]
+                if rate.dim() == 2:
+                    rate = rate.mean(0)
+                means.append(rate)
+            error = means[0] - means[1]
+            lineage_std = torch.cat(means).std().item()
+            lineage_rmse = error.square().mean().sqrt().item()
+            lineage_mae = error.abs().mean().item()
+            lineage_correlation = pearson_correlation(means[0], means[1]).item()
+
+            # Print stats.
+            logger.info(
+                f"{name1} vs {name2} mutations: "
+                f"ρ = {mutation_correlation:0.3g}, "
+                f"RMSE = {mutation_rmse:0.3g}, "
+                f"MAE = {mutation_mae:0.3g}"
+            )
+            logger.info(
+                f"{name1} vs {name2} lineages: "
+                f"ρ = {lineage_correlation:0.3g}, "
+                f"RMSE = {lineage_rmse:0.3g}, "
+                f"MAE = {lineage_mae:0.3g}"
+            )
+
+            # Save stats.
+            stats["mutation_corr"] = mutation_correlation
+            stats["mutation_rmse"] = mutation_rmse
+            stats["mutation_mae"] = mutation_mae
+            stats["mutation_stddev"] = mutation_std
+            stats["lineage_corr"] = lineage_correlation
+            stats["lineage_rmse"] = lineage_rmse
+            stats["lineage_mae"] = lineage_mae
+            stats["lineage_stdev"] = lineage_std
+
+    return {k: float(v) for k, v in stats.items()}
@@ -2,49 +2,34 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import datetime
-import functools
+import itertools
 import logging
 import math
-import pickle
 import re
 import warnings
-from collections import Counter, OrderedDict, defaultdict
-from timeit import default_timer
+from collections import Counter, OrderedDict
 from typing import List
 
 import numpy as np
 import pyro
 import pyro.distributions as dist
 import torch
-import tqdm
 from pyro import poutine
-from pyro.infer import SVI, JitTrace_ELBO, Trace_ELBO
-from pyro.infer.autoguide import (
-    AutoDelta,
-    AutoGuideList,
-    AutoLowRankMultivariateNormal,
-    AutoNormal,
-    AutoStructured,
-)
-from pyro.infer.autoguide.initialization import InitMessenger
 from pyro.infer.reparam import LocScaleReparam
-from pyro.nn.module import PyroModule, PyroParam
-from pyro.ops.streaming import CountMeanVarianceStats, StatsOfDict
-from pyro.optim import ClippedAdam
-from pyro.poutine.util import site_is_subsample
-from torch.distributions import constraints
 
 import pyrocov.geo
 
-from . import pangolin, sarscov2
-from .ops import sparse_multinomial_likelihood
-from .util import pearson_correlation, quotient_central_moments
-
-# Requires https://github.com/pyro-ppl/pyro/pull/2953
-try:
-    from pyro.infer.autoguide.effect import AutoRegressiveMessenger
-except ImportError:
-    AutoRegressiveMessenger = object
+from . import inference, pangolin, sarscov2
+from .columnar import factorize, load_columns, value_counts
+from .inference import (  # noqa: F401
+    Guide,
+    RegressiveGuide,
+    get_likelihood,
+    log_holdout_stats,
+    predict,
+)
+from .ops import logistic_probs, time_chunk_size
+from .util import quotient_central_moments
 
 logger = logging.getLogger(__name__)
 
@@ -67,12 +52,13 @@ def get_fine_regions(columns, min_samples):
     """
     # Count number of samples in each subregion.
     counts = Counter()
-    for location in columns["location"]:
+    weights = columns.get("count")
+    for location, count in value_counts(columns["location"], weights).items():
         parts = location.split("/")
         if len(parts) < 2:
             continue
         parts = tuple(p.strip() for p in parts[:3])
-        counts[parts] += 1
+        counts[parts] += count
 
     # Select fine countries.
     return frozenset(parts for parts, count in counts.items() if count >= min_samples)
@@ -94,12 +80,12 @@ def rank_loo_lineages(full_dataset: dict, min_samples: int = 50) -> List[str]:
     # Compute sample counts.
     lineage_id_inv = full_dataset["lineage_id_inv"]
     lineage_id = full_dataset["lineage_id"]
-    clade_counts = full_dataset["weekly_clades"].sum([0, 1])
+    clade_counts = sparse_sum(full_dataset["weekly_clades"], [0, 1])
     lineage_counts = clade_counts.new_zeros(len(lineage_id)).scatter_add_(
         0, full_dataset["clade_id_to_lineage_id"], clade_counts
     )
     weekly_clades = full_dataset["weekly_clades"]  # [T, P, C]
-    lineage_counts = weekly_clades.sum([0, 1])  # [C]
+    lineage_counts = sparse_sum(weekly_clades, [0, 1])  # [C]
     descendent_counts = lineage_counts.clone()
     for c, lineage in enumerate(lineage_id_inv):
         ancestor = get_parent(lineage)
@@ -123,12 +109,337 @@ def rank_loo_lineages(full_dataset: dict, min_samples: int = 50) -> List[str]:
 
 
 def dense_to_sparse(x):
+    if x.is_sparse:
+        x = x.coalesce()
+        return {"index": x.indices(), "value": x.values(), "total": sparse_sum(x, -1)}
     index = x.nonzero(as_tuple=False).T.contiguous()
     value = x[tuple(index)]
     total = x.sum(-1)
     return {"index": index, "value": value, "total": total}
 
 
+def sparse_coo_tensor(index, value, shape):
+    """
+    Constructs a coalesced sparse COO tensor from possibly repeated indices,
+    summing values at repeated indices.
+    """
+    try:
+        x = torch.sparse_coo_tensor(index, value, shape, check_invariants=False)
+    except TypeError:  # torch<2.0 does not support check_invariants
+        x = torch.sparse_coo_tensor(index, value, shape)
+    return x.coalesce()
+
+
+def sparse_sum(x, dim=None):
+    """
+    Sums either a dense or a sparse tensor, returning a dense tensor.
+    """
+    if not x.is_sparse:
+        return x.sum() if dim is None else x.sum(dim)
+    if dim is None:
+        return torch.sparse.sum(x)
+    return torch.sparse.sum(x, dim).to_dense()
+
+
+def load_features(usher_features, feature_type="aa", *, sparse=False):
+    """
+    Extracts a ``[C, F]`` feature matrix from a dict loaded from a features
+    file, where features are stored either as a dense tensor under
+    ``{feature_type}_features`` or as sparse CSR indices of nonzero entries
+    under ``{feature_type}_features_csr``.
+
+    :param dict usher_features: A dict loaded from a features file.
+    :param str feature_type: Either "aa" or "nuc".
+    :param bool sparse: Whether to return a sparse COO tensor rather than a
+        dense tensor.
+    :returns: A feature matrix of the default dtype.
+    :rtype: torch.Tensor
+    """
+    csr = usher_features.get(f"{feature_type}_features_csr")
+    if csr is None:
+        features = usher_features[f"{feature_type}_features"]
+        features = features.to(torch.get_default_dtype())
+        return features.to_sparse() if sparse else features
+    crow_indices = csr["crow_indices"]
+    col_indices = csr["col_indices"]
+    rows = torch.arange(len(crow_indices) - 1).repeat_interleave(
+        crow_indices[1:] - crow_indices[:-1]
+    )
+    index = torch.stack([rows, col_indices])
+    features = sparse_coo_tensor(index, torch.ones(len(rows)), csr["shape"])
+    return features if sparse else features.to_dense()
+
+
+def features_matmul(coef, features):
+    """
+    Computes ``coef @ features.T`` for a dense or sparse ``[C, F]`` feature
+    matrix, without densifying sparse features. The sparse case gathers
+    ``coef`` at nonzero entries and sums into rows, so that both forward and
+    backward passes cost time linear in the number of nonzeros.
+    """
+    if not features.is_sparse:
+        return coef @ features.T
+    features = features.coalesce()
+    rows, cols = features.indices()
+    terms = coef[..., cols] * features.values()
+    result = coef.new_zeros(coef.shape[:-1] + features.shape[:1])
+    return result.index_add(-1, rows, terms)
+
+
+def get_pc_index(weekly_clades):
+    """
+    Returns a sorted index of flattened (place, clade) pairs having any
+    observations, for either a dense or sparse ``weekly_clades`` tensor.
+    """
+    if weekly_clades.is_sparse:
+        T, P, C = weekly_clades.shape
+        t, p, c = weekly_clades.coalesce().indices()
+        return torch.unique(p * C + c)
+    return weekly_clades.ne(0).any(0).reshape(-1).nonzero(as_tuple=True)[0]
+
+
+def zero_clades(weekly_clades, clade_ids):
+    """
+    Returns a copy of a dense or sparse ``weekly_clades`` tensor with counts of
+    the given clades set to zero.
+    """
+    clade_ids = torch.as_tensor(clade_ids, dtype=torch.long)
+    if weekly_clades.is_sparse:
+        weekly_clades = weekly_clades.coalesce()
+        index = weekly_clades.indices()
+        drop = torch.zeros(weekly_clades.size(-1), dtype=torch.bool)
+        drop[clade_ids] = True
+        keep = ~drop[index[-1]]
+        return sparse_coo_tensor(
+            index[:, keep], weekly_clades.values()[keep], weekly_clades.shape
+        )
+    weekly_clades = weekly_clades.clone()
+    weekly_clades[:, :, clade_ids] = 0
+    return weekly_clades
+
+
+def _coarsen_location(location, fine_regions):
+    """
+    Parses a raw location string into a tuple of parts, aggregating regions
+    not in ``fine_regions`` up to country level. Returns None for locations
+    without country information.
+    """
+    parts = location.split("/")
+    if len(parts) < 2:
+        return None
+    parts = tuple(p.strip() for p in parts[:3])
+    if len(parts) == 3 and parts not in fine_regions:
+        parts = parts[:2]
+    return parts
+
+
+def _add_location(parts, location_id, state_to_country):
+    """
+    Assigns an id to a location, populating countries on the left (with
+    nonnegative ids) and states on the right (with negative ids).
+    """
+    location = " / ".join(parts)
+    num_countries = len(location_id) - len(state_to_country)
+    if len(parts) == 2:  # country only
+        return location_id.setdefault(location, num_countries)
+    # state and country
+    country = " / ".join(parts[:2])
+    c = location_id.setdefault(country, num_countries)
+    p = location_id.setdefault(location, -1 - len(state_to_country))
+    state_to_country[p] = c
+    return p
+
+
+def _aggregate_rows(columns, clade_id, fine_regions, include, exclude, end_day):
+    """
+    Aggregates rows of ``columns`` into sparse (time, place, clade) counts,
+    one row at a time. See :func:`_aggregate_rows_vectorized` for a faster
+    equivalent.
+
+    If ``columns`` has a ``count`` column, each row is weighted by its count;
+    this is used for pre-aggregated columns, see :class:`~pyrocov.incremental.CountStore`.
+    """
+    sparse_data: dict = Counter()
+    state_to_country: dict = {}
+    location_id: dict = OrderedDict()
+    skipped_clades = set()
+    num_obs = 0
+    weights = columns.get("count", itertools.repeat(1))
+    for day, location, clade, weight in zip(
+        columns["day"], columns["location"], columns["clade"], weights
+    ):
+        if clade not in clade_id:
+            if clade not in skipped_clades:
+                skipped_clades.add(clade)
+                if not clade.startswith("fine"):
+                    logger.warning(f"WARNING skipping unsampled clade {clade}")
+            continue
+
+        # Filter by include/exclude
+        row = {
+            "location": location,
+            "day": day,
+            "clade": clade,
+        }
+        if not all(re.search(v, row[k]) for k, v in include.items()):
+            continue
+        if any(re.search(v, row[k]) for k, v in exclude.items()):
+            continue
+
+        # Filter by day
+        if end_day is not None:
+            if day > end_day:
+                continue
+
+        # preprocess parts
+        parts = _coarsen_location(location, fine_regions)
+        if parts is None:
+            continue
+        p = _add_location(parts, location_id, state_to_country)
+
+        # Save sparse data.
+        num_obs += weight
+        t = day // TIMESTEP
+        c = clade_id[clade]
+        sparse_data[t, p, c] += weight
+    logger.warning(f"WARNING skipped {len(skipped_clades)} unsampled clades")
+
+    index = torch.tensor(list(sparse_data), dtype=torch.long).reshape(-1, 3).T
+    value = torch.tensor(list(sparse_data.values()), dtype=torch.get_default_dtype())
+    return location_id, state_to_country, tuple(index), value, num_obs
+
+
+def _regex_mask(uniques, pattern):
+    """
+    Evaluates ``re.search(pattern, u)`` on each of an array of unique values.
+    """
+    pattern = re.compile(pattern)
+    return np.array([bool(pattern.search(u)) for u in uniques], dtype=bool)
+
+
+def _aggregate_rows_vectorized(
+    columns, clade_id, fine_regions, include, exclude, end_day
+):
+    """
+    Vectorized equivalent of :func:`_aggregate_rows`.
+
+    This factorizes string columns into integer codes once, evaluates filters
+    and location parsing only on unique values, and then aggregates rows by
+    array operations. Results are identical to :func:`_aggregate_rows`,
+    including the order of ``location_id``.
+    """
+    keep, codes, day, clade_map, location_parts = _filter_rows(
+        columns, clade_id, fine_regions, include, exclude, end_day
+    )
+
+    # Assign location ids in order of first appearance among kept rows.
+    kept_locations = codes["location"][keep]
+    seen, first = np.unique(kept_locations, return_index=True)
+    location_id, state_to_country, location_map = _assign_locations(
+        location_parts, seen[np.argsort(first)]
+    )
+
+    # Aggregate via a single scatter_add.
+    t = torch.from_numpy((day[keep] // TIMESTEP).astype(np.int64))
+    p = torch.from_numpy(location_map[kept_locations])
+    c = torch.from_numpy(clade_map[codes["clade"][keep]])
+    if "count" in columns:
+        weights = np.asarray(columns["count"])[keep]
+        value = torch.from_numpy(weights).to(torch.get_default_dtype())
+        return location_id, state_to_country, (t, p, c), value, int(weights.sum())
+    value = torch.ones(len(t))
+    return location_id, state_to_country, (t, p, c), value, len(t)
+
+
+def _assign_locations(location_parts, order):
+    """
+    Assigns location ids to unique raw locations in the given order, returning
+    ``location_id``, ``state_to_country`` and an array mapping raw location
+    codes to location ids.
+    """
+    location_id: dict = OrderedDict()
+    state_to_country: dict = {}
+    location_map = np.zeros(len(location_parts), dtype=np.int64)
+    for u in order.tolist():
+        location_map[u] = _add_location(
+            location_parts[u], location_id, state_to_country
+        )
+    return location_id, state_to_country, location_map
+
+
+def _filter_rows(columns, clade_id, fine_regions, include, exclude, end_day):
+    """
+    Factorizes columns and computes a mask of rows to keep, as used by
+    :func:`_aggregate_rows_vectorized`.
+    """
+    # Factorize columns, preserving order of first appearance.
+    codes = {}
+    uniques = {}
+    for k in {"location", "clade"} | set(include) | set(exclude):
+        codes[k], uniques[k] = factorize(columns[k])
+    day = np.asarray(columns["day"])
+
+    # Map clades to ids, skipping unsampled clades.
+    clade_map = np.array([clade_id.get(c, -1) for c in uniques["clade"]], np.int64)
+    skipped_clades = [c for c, i in zip(uniques["clade"], clade_map) if i < 0]
+    for clade in skipped_clades:
+        if not clade.startswith("fine"):
+            logger.warning(f"WARNING skipping unsampled clade {clade}")
+    logger.warning(f"WARNING skipped {len(skipped_clades)} unsampled clades")
+
+    # Filter by clade, include/exclude, and day.
+    keep = clade_map[codes["clade"]] >= 0
+    for k, v in include.items():
+        keep &= _regex_mask(uniques[k], v)[codes[k]]
+    for k, v in exclude.items():
+        keep &= ~_regex_mask(uniques[k], v)[codes[k]]
+    if end_day is not None:
+        keep &= day <= end_day
+
+    # Parse each unique location once.
+    location_parts = [_coarsen_location(u, fine_regions) for u in uniques["location"]]
+    keep &= np.array([p is not None for p in location_parts], dtype=bool)[
+        codes["location"]
+    ]
+    return keep, codes, day, clade_map, location_parts
+
+
+def _aggregate_days(columns, clade_id, fine_regions, include, exclude):
+    """
+    Aggregates rows into (day, raw location, clade) groups, recording the
+    count and first row position of each group. This retains enough
+    information to derive the aggregates of :func:`_aggregate_rows_vectorized`
+    for any ``end_day``. Returns a pair ``(groups, location_parts)``.
+    """
+    keep, codes, day, clade_map, location_parts = _filter_rows(
+        columns, clade_id, fine_regions, include, exclude, None
+    )
+    position = np.flatnonzero(keep)
+    day = day[keep].astype(np.int64)
+    location = codes["location"][keep].astype(np.int64)
+    clade = clade_map[codes["clade"][keep]]
+    if "count" in columns:
+        weights = np.asarray(columns["count"])[keep]
+    else:
+        weights = np.ones(len(day), dtype=np.int64)
+
+    # Group rows, noting that np.unique returns the first index of each group.
+    min_day = int(day.min()) if len(day) else 0
+    shape = (int(day.max()) + 1 - min_day if len(day) else 1,)
+    shape += (len(location_parts), len(clade_id))
+    packed = np.ravel_multi_index((day - min_day, location, clade), shape)
+    packed, first, inverse = np.unique(packed, return_index=True, return_inverse=True)
+    day, location, clade = np.unravel_index(packed, shape)
+    groups = {
+        "day": day + min_day,
+        "location": location,
+        "clade": clade,
+        "count": np.bincount(inverse.reshape(-1), weights, len(packed)),
+        "first": position[first],
+    }
+    return groups, location_parts
+
+
 def load_gisaid_data(
     *,
     device="cpu",
@@ -139,6 +450,9 @@ def load_gisaid_data(
     columns_filename="results/usher.columns.pkl",
     features_filename="results/usher.features.pt",
     feature_type="aa",
+    vectorize=True,
+    sparse=False,
+    sparse_features=False,
 ) -> dict:
     """
     Loads the two files columns_filename and features_filename,
@@ -149,10 +463,20 @@ def load_gisaid_data(
     :param dict include: filters of data to include
     :param dict exclude: filters of data to exclude
     :param end_day: last day to include
-    :param str columns_filename:
+    :param str columns_filename: Either a columnar directory or a legacy
+        ``.pkl`` file, see :func:`~pyrocov.columnar.load_columns`.
     :param str features_filename:
     :param str feature_type: Either "aa" for amino acid features or "nuc" for
         nucleotide features.
+    :param bool vectorize: Whether to aggregate rows via vectorized array
+        operations (default) or via a sequential Python loop. Both produce
+        identical datasets.
+    :param bool sparse: Whether to represent ``weekly_clades`` as a sparse COO
+        tensor rather than a dense ``[T, P, C]`` tensor. This saves memory for
+        large numbers of clades and is supported by all consumers of datasets.
+    :param bool sparse_features: Whether to represent ``features`` as a sparse
+        COO tensor rather than a dense ``[C, F]`` tensor. This is supported by
+        :func:`model` and :func:`subset_gisaid_data` .
     :returns: A dataset dict
     :rtype: dict
     """
@@ -163,9 +487,135 @@ def load_gisaid_data(
     if end_day:
         logger.info(f"Load gisaid data end_day: {end_day}")
 
+    inputs = _load_gisaid_inputs(
+        device=device,
+        min_region_size=min_region_size,
+        include=include,
+        exclude=exclude,
+        columns_filename=columns_filename,
+        features_filename=features_filename,
+        feature_type=feature_type,
+        sparse_features=sparse_features,
+    )
+    columns = inputs.pop("columns")
+
+    # Aggregate rows into sparse (time, place, clade) counts.
+    aggregate_rows = _aggregate_rows_vectorized if vectorize else _aggregate_rows
+    aggregate = aggregate_rows(
+        columns, inputs["clade_id"], inputs["fine_regions"], include, exclude, end_day
+    )
+    if end_day is not None:
+        T = 1 + end_day // TIMESTEP
+    else:
+        T = 1 + int(np.max(columns["day"])) // TIMESTEP
+    num_rows = _num_rows(columns)
+    return _make_gisaid_dataset(inputs, aggregate, T, num_rows, sparse)
+
+
+class GisaidEndDayViews:
+    """
+    Loads GISAID data once and cheaply derives datasets truncated at various
+    ``end_day`` s, as used in backtesting. Calling ``views(end_day)`` returns
+    a dataset identical to ``load_gisaid_data(end_day=end_day, **kwargs)``,
+    but without re-reading and re-filtering all rows.
+
+    :param kwargs: Keyword arguments as for :func:`load_gisaid_data`, except
+        ``end_day`` and ``vectorize``.
+    """
+
+    def __init__(
+        self,
+        *,
+        device="cpu",
+        min_region_size=50,
+        include={},
+        exclude={},
+        columns_filename="results/usher.columns.pkl",
+        features_filename="results/usher.features.pt",
+        feature_type="aa",
+        sparse=False,
+        sparse_features=False,
+    ):
+        logger.info("Loading data for end_day views")
+        include = include.copy()
+        exclude = exclude.copy()
+        self._inputs = _load_gisaid_inputs(
+            device=device,
+            min_region_size=min_region_size,
+            include=include,
+            exclude=exclude,
+            columns_filename=columns_filename,
+            features_filename=features_filename,
+            feature_type=feature_type,
+            sparse_features=sparse_features,
+        )
+        columns = self._inputs.pop("columns")
+        self._max_day = int(np.max(columns["day"]))
+        self._num_rows = _num_rows(columns)
+        self._groups, self._location_parts = _aggregate_days(
+            columns,
+            self._inputs["clade_id"],
+            self._inputs["fine_regions"],
+            include,
+            exclude,
+        )
+        self._sparse = sparse
+
+    def __call__(self, end_day=None) -> dict:
+        if end_day:
+            logger.info(f"Load gisaid data end_day: {end_day}")
+        groups = self._groups
+        if end_day is not None:
+            mask = groups["day"] <= end_day
+            groups = {k: v[mask] for k, v in groups.items()}
+
+        # Assign location ids in order of first appearance.
+        never = np.iinfo(np.int64).max
+        first = np.full(len(self._location_parts), never)
+        np.minimum.at(first, groups["location"], groups["first"])
+        seen = np.flatnonzero(first < never)
+        location_id, state_to_country, location_map = _assign_locations(
+            self._location_parts, seen[np.argsort(first[seen])]
+        )
+
+        t = torch.from_numpy(groups["day"] // TIMESTEP)
+        p = torch.from_numpy(location_map[groups["location"]])
+        c = torch.from_numpy(groups["clade"])
+        value = torch.from_numpy(groups["count"]).to(torch.get_default_dtype())
+        num_obs = int(groups["count"].sum())
+        aggregate = location_id, state_to_country, (t, p, c), value, num_obs
+        if end_day is not None:
+            T = 1 + end_day // TIMESTEP
+        else:
+            T = 1 + self._max_day // TIMESTEP
+        return _make_gisaid_dataset(
+            self._inputs, aggregate, T, self._num_rows, self._sparse
+        )
+
+
+def _num_rows(columns):
+    if "count" in columns:
+        return int(np.sum(columns["count"]))
+    return len(columns["clade"])
+
+
+def _load_gisaid_inputs(
+    *,
+    device,
+    min_region_size,
+    include,
+    exclude,
+    columns_filename,
+    features_filename,
+    feature_type,
+    sparse_features=False,
+) -> dict:
+    """
+    Loads columns and features. Note this pops gene and region filters from
+    ``include`` and ``exclude``.
+    """
     # Load column data.
-    with open(columns_filename, "rb") as f:
-        columns = pickle.load(f)
+    columns = load_columns(columns_filename)
     logger.info(f"Training on {len(columns['day'])} rows with columns:")
     logger.info(", ".join(columns.keys()))
 
@@ -175,9 +625,8 @@ def load_gisaid_data(
     # Filter features into numbers of mutations and possibly genes.
     usher_features = torch.load(features_filename)
     mutations = usher_features[f"{feature_type}_mutations"]
-    features = usher_features[f"{feature_type}_features"].to(
-        device=device, dtype=torch.get_default_dtype()
-    )
+    features = load_features(usher_features, feature_type, sparse=sparse_features)
+    features = features.to(device=device)
     keep = [m.count(",") == 0 for m in mutations]  # restrict to single mutations
     if include.get("gene"):
         re_gene = re.compile(include.pop("gene"))
@@ -200,105 +649,68 @@ def load_gisaid_data(
                 keep[i] = False
     mutations = [m for k, m in zip(keep, mutations) if k]
     if mutations:
-        features = features[:, keep]
+        ids = [i for i, k in enumerate(keep) if k]
+        features = features.index_select(1, torch.tensor(ids, device=device))
     else:
         warnings.warn("No mutations selected; using empty features")
         mutations = ["S:D614G"]  # bogus
-        features = features[:, :1] * 0
+        features = features.index_select(1, torch.tensor([0], device=device)) * 0
+    if features.is_sparse:
+        features = features.coalesce()
     logger.info("Loaded {} feature matrix".format(" x ".join(map(str, features.shape))))
 
     # Construct the list of clades.
     clade_id_inv = usher_features["clades"]
     clade_id = {k: i for i, k in enumerate(clade_id_inv)}
-    clades = columns["clade"]
 
-    # Generate sparse_data.
-    sparse_data: dict = Counter()
-    countries = set()
-    states = set()
-    state_to_country_dict = {}
-    location_id: dict = OrderedDict()
-    skipped_clades = set()
-    num_obs = 0
-    for day, location, clade in zip(columns["day"], columns["location"], clades):
-        if clade not in clade_id:
-            if clade not in skipped_clades:
-                skipped_clades.add(clade)
-                if not clade.startswith("fine"):
-                    logger.warning(f"WARNING skipping unsampled clade {clade}")
-            continue
-
-        # Filter by include/exclude
-        row = {
-            "location": location,
-            "day": day,
-            "clade": clade,
-        }
-        if not all(re.search(v, row[k]) for k, v in include.items()):
-            continue
-        if any(re.search(v, row[k]) for k, v in exclude.items()):
-            continue
-
-        # Filter by day
-        if end_day is not None:
-            if day > end_day:
-                continue
+    return {
+        "columns": columns,
+        "fine_regions": fine_regions,
+        "features": features,
+        "mutations": mutations,
+        "clade_id": clade_id,
+        "clade_id_inv": clade_id_inv,
+        "usher_features": usher_features,
+    }
 
-        # preprocess parts
-        parts = location.split("/")
-        if len(parts) < 2:
-            continue
-        parts = tuple(p.strip() for p in parts[:3])
-        if len(parts) == 3 and parts not in fine_regions:
-            parts = parts[:2]
-        location = " / ".join(parts)
-        # Populate countries on the left and states on the right.
-        if len(parts) == 2:  # country only
-            countries.add(location)
-            p = location_id.setdefault(location, len(countries) - 1)
-        else:  # state and country
-            country = " / ".join(parts[:2])
-            countries.add(country)
-            c = location_id.setdefault(country, len(countries) - 1)
-            states.add(location)
-            p = location_id.setdefault(location, -len(states))
-            state_to_country_dict[p] = c
 
-        # Save sparse data.
-        num_obs += 1
-        t = day // TIMESTEP
-        c = clade_id[clade]
-        sparse_data[t, p, c] += 1
-    logger.warning(f"WARNING skipped {len(skipped_clades)} unsampled clades")
-    state_to_country = torch.full((len(states),), 999999, dtype=torch.long)
+def _make_gisaid_dataset(inputs, aggregate, T, num_rows, sparse) -> dict:
+    """
+    Constructs a dataset from inputs loaded by :func:`_load_gisaid_inputs`
+    and sparse (time, place, clade) counts.
+    """
+    clade_id = inputs["clade_id"]
+    clade_id_inv = inputs["clade_id_inv"]
+    usher_features = inputs["usher_features"]
+    location_id, state_to_country_dict, tpc_index, tpc_value, num_obs = aggregate
+
+    num_countries = sum(1 for p in location_id.values() if p >= 0)
+    num_states = len(location_id) - num_countries
+    state_to_country = torch.full((num_states,), 999999, dtype=torch.long)
     for s, c in state_to_country_dict.items():
         state_to_country[s] = c
-    logger.info(f"Found {len(states)} states in {len(countries)} countries")
+    logger.info(f"Found {num_states} states in {num_countries} countries")
     location_id_inv = [None] * len(location_id)
     for k, i in location_id.items():
         location_id_inv[i] = k
     assert all(location_id_inv)
 
-    # Generate weekly_clades tensor from sparse_data.
-    if end_day is not None:
-        T = 1 + end_day // TIMESTEP
-    else:
-        T = 1 + max(columns["day"]) // TIMESTEP
+    # Generate weekly_clades tensor from sparse data.
     P = len(location_id)
     C = len(clade_id)
-    weekly_clades = torch.zeros(T, P, C)
-    for tps, n in sparse_data.items():
-        weekly_clades[tps] = n
+    t, p, c = tpc_index
+    index = torch.stack([t, p % P, c])  # convert negative state ids
+    sparse_clades = sparse_coo_tensor(index, tpc_value, (T, P, C))
+    weekly_clades = sparse_clades if sparse else sparse_clades.to_dense()
     logger.info(f"Dataset size [T x P x C] {T} x {P} x {C}")
 
     logger.info(
-        f"Keeping {num_obs}/{len(clades)} rows "
-        f"(dropped {len(clades) - int(num_obs)})"
+        f"Keeping {num_obs}/{num_rows} rows (dropped {num_rows - int(num_obs)})"
     )
 
-    # Construct sparse representation.
-    pc_index = weekly_clades.ne(0).any(0).reshape(-1).nonzero(as_tuple=True)[0]
-    sparse_counts = dense_to_sparse(weekly_clades)
+    # Construct sparse representation, avoiding scans of dense weekly_clades.
+    pc_index = get_pc_index(sparse_clades)
+    sparse_counts = dense_to_sparse(sparse_clades)
 
     # Construct time scales centered around observations.
     time = torch.arange(float(T)) * TIMESTEP / GENERATION_TIME
@@ -321,14 +733,14 @@ def load_gisaid_data(
         "clade_id_inv": clade_id_inv,
         "clade_id_to_lineage_id": clade_id_to_lineage_id,
         "clade_to_lineage": usher_features["clade_to_lineage"],
-        "features": features,
+        "features": inputs["features"],
         "lineage_id": lineage_id,
         "lineage_id_inv": lineage_id_inv,
         "lineage_id_to_clade_id": lineage_id_to_clade_id,
         "lineage_to_clade": usher_features["lineage_to_clade"],
         "location_id": location_id,
         "location_id_inv": location_id_inv,
-        "mutations": mutations,
+        "mutations": inputs["mutations"],
         "pc_index": pc_index,
         "sparse_counts": sparse_counts,
         "state_to_country": state_to_country,
@@ -366,8 +778,7 @@ def subset_gisaid_data(
     # Select clades.
     if new["weekly_clades"].size(-1) > max_clades:
         ids = (
-            new["weekly_clades"]
-            .sum([0, 1])
+            sparse_sum(new["weekly_clades"], [0, 1])
             .sort(0, descending=True)
             .indices[:max_clades]
         )
@@ -375,10 +786,30 @@ def subset_gisaid_data(
         new["features"] = new["features"].index_select(0, ids)
         new["clade_id_inv"] = [new["clade_id_inv"][i] for i in ids.tolist()]
         new["clade_id"] = {name: i for i, name in enumerate(new["clade_id_inv"])}
-        new["sparse_counts"] = dense_to_sparse(new["weekly_clades"])
+    new["sparse_counts"] = dense_to_sparse(new["weekly_clades"])
+    new["pc_index"] = get_pc_index(new["weekly_clades"])
 
     # Select mutations.
-    gaps = new["features"].max(0).values - new["features"].min(0).values
+    features = new["features"]
+    if features.is_sparse:
+        # Reduce over nonzeros only, so the matrix never has to be dense.
+        C, F = features.shape
+        features = features.coalesce()
+        col = features.indices()[1]
+        values = features.values()
+        nnz = torch.bincount(col, minlength=F)
+        has_zero = nnz < C
+        fmax = values.new_zeros(F).scatter_reduce(
+            0, col, values, "amax", include_self=False
+        )
+        fmin = values.new_zeros(F).scatter_reduce(
+            0, col, values, "amin", include_self=False
+        )
+        fmax = torch.where(has_zero, fmax.clamp(min=0), fmax)
+        fmin = torch.where(has_zero, fmin.clamp(max=0), fmin)
+        gaps = fmax - fmin
+    else:
+        gaps = features.max(0).values - features.min(0).values
     ids = (gaps >= 0.5).nonzero(as_tuple=True)[0]
     new["mutations"] = [new["mutations"][i] for i in ids.tolist()]
     new["features"] = new["features"].index_select(-1, ids)
@@ -391,8 +822,8 @@ def subset_gisaid_data(
             len(old["clade_id"]),
             len(new["mutations"]),
             len(old["mutations"]),
-            int(new["weekly_clades"].sum()),
-            int(old["weekly_clades"].sum()),
+            int(sparse_sum(new["weekly_clades"])),
+            int(sparse_sum(old["weekly_clades"])),
         )
     )
 
@@ -434,7 +865,7 @@ def load_jhu_data(gisaid_data: dict) -> dict:
     jhu_start_date = pyrocov.geo.parse_date(us_cases_df.columns[11])
     assert start_date < jhu_start_date
     dt = (jhu_start_date - start_date).days
-    T = len(gisaid_data["weekly_clades"])
+    T = gisaid_data["weekly_clades"].size(0)
     weekly_cases = daily_cases.new_zeros(T, len(locations))
     for w in range(TIMESTEP):
         t0 = (w + dt) // TIMESTEP
@@ -449,7 +880,7 @@ def load_jhu_data(gisaid_data: dict) -> dict:
     }
 
 
-def model(dataset, model_type, *, forecast_steps=None):
+def model(dataset, model_type, *, forecast_steps=None, memory_budget=None):
     """
     Bayesian regression model of clade portions as a function of mutation features.
 
@@ -459,6 +890,8 @@ def model(dataset, model_type, *, forecast_steps=None):
     - During prediction (after training), the likelihood statement is omitted
       and instead a ``probs`` tensor is recorded; this is the predicted clade
       portions in each (time, regin) bin.
+    If a ``memory_budget`` in bytes is given, ``[T, P, C]``-shaped
+    intermediate tensors are computed in time chunks that fit the budget.
     """
     # Tensor shapes are commented at at the end of some lines.
     features = dataset["features"]
@@ -516,78 +949,86 @@ def model(dataset, model_type, *, forecast_steps=None):
         # clade and place.
         if "nofeatures" not in model_type:
             coef = pyro.sample(
-                "coef", dist.Laplace(torch.zeros(F), coef_scale).to_event(1)
+                "coef", dist.Laplace(torch.zeros(F), coef_scale[..., None]).to_event(1)
             )  # [F]
+            if coef.dim() > 1:  # When vectorized, align coef with batch dims.
+                coef = coef.squeeze(-2)  # [..., 1, 1, F]
         with clade_plate:
             if "localrate" in model_type:
                 rate_loc = pyro.sample(
-                    "rate_loc", dist.Normal(0.01 * coef @ features.T, rate_loc_scale)
+                    "rate_loc",
+                    dist.Normal(0.01 * features_matmul(coef, features), rate_loc_scale),
                 )  # [C]
             elif "nofeatures" in model_type:
                 rate_loc = pyro.sample(
-                    "rate_loc", dist.Normal(torch.zeros((C,)), rate_loc_scale.expand(C))
+                    "rate_loc", dist.Normal(torch.zeros((C,)), rate_loc_scale)
                 )  # [C]
             else:
                 rate_loc = pyro.deterministic(
-                    "rate_loc", 0.01 * coef @ features.T
+                    "rate_loc", 0.01 * features_matmul(coef, features)
                 )  # [C]
             if "localinit" in model_type:
                 init_loc = pyro.sample(
                     "init_loc", dist.Normal(0, init_loc_scale)
                 )  # [C]
             else:
-                init_loc = rate_loc.new_zeros(())
+                init_loc = torch.zeros_like(rate_loc)
         with pc_plate:
-            pc_rate_loc = rate_loc.expand(P, C).reshape(-1)
-            pc_init_loc = init_loc.expand(P, C).reshape(-1)
+            batch_shape = rate_loc.shape[:-1]  # nonempty only when vectorized
+            pc_rate_loc = rate_loc.unsqueeze(-2).expand(batch_shape + (P, C))
+            pc_rate_loc = pc_rate_loc.reshape(batch_shape + (P * C,))
+            pc_init_loc = init_loc.unsqueeze(-2).expand(batch_shape + (P, C))
+            pc_init_loc = pc_init_loc.reshape(batch_shape + (P * C,))
             pc_rate = pyro.sample(
-                "pc_rate", dist.Normal(pc_rate_loc[pc_index], rate_scale)
+                "pc_rate", dist.Normal(pc_rate_loc[..., pc_index], rate_scale)
             )  # [PC]
             pc_init = pyro.sample(
-                "pc_init", dist.Normal(pc_init_loc[pc_index], init_scale)
+                "pc_init", dist.Normal(pc_init_loc[..., pc_index], init_scale)
             )  # [PC]
         with place_plate, clade_plate:
+            shape = pc_rate.shape[:-2] + (P, C)
             rate = pyro.deterministic(
                 "rate",
-                pc_rate_loc.scatter(0, pc_index, pc_rate).reshape(P, C),
+                pc_rate_loc.scatter(-1, pc_index.expand_as(pc_rate), pc_rate).reshape(
+                    shape
+                ),
             )  # [P, C]
             init = pyro.deterministic(
                 "init",
-                torch.full((P * C,), -1e2).scatter(0, pc_index, pc_init).reshape(P, C),
+                pc_init.new_full(pc_rate_loc.shape, -1e2)
+                .scatter(-1, pc_index.expand_as(pc_init), pc_init)
+                .reshape(shape),
             )  # [P, C]
-        logits = init + rate * time[:, None, None]  # [T, P, C]
 
         # Optionally predict probabilities (during prediction).
         if forecast_steps is not None:
-            probs = logits.new_zeros(logits.shape[:2] + (L,)).scatter_add_(
-                -1, clade_id_to_lineage_id.expand_as(logits), logits.softmax(-1)
+            chunk_size = time_chunk_size(
+                memory_budget, T, init.numel(), itemsize=init.element_size()
             )
+            probs = logistic_probs(
+                init,
+                rate,
+                time,
+                index=clade_id_to_lineage_id,
+                size=L,
+                chunk_size=chunk_size,
+            )  # [T, P, L]
             with time_plate, place_plate, pyro.plate("lineage", L, dim=-1):
                 pyro.deterministic("probs", probs)
             return
 
         # Finally observe counts (during inference).
-        if "dense" in model_type:  # equivalent either way
-            # Compute a dense likelihood.
-            with time_plate, place_plate:
-                pyro.sample(
-                    "obs",
-                    dist.Multinomial(logits=logits.unsqueeze(-2), validate_args=False),
-                    obs=weekly_clades.unsqueeze(-2),
-                )  # [T, P, 1, C]
-            return
-        # Compromise between sparse and dense.
-        logits = logits.log_softmax(-1)
-        t, p, c = sparse_counts["index"]
-        pyro.factor(
-            "obs",
-            sparse_multinomial_likelihood(
-                sparse_counts["total"], logits[t, p, c], sparse_counts["value"]
-            ),
+        get_likelihood(model_type)(
+            init,
+            rate,
+            time,
+            weekly_clades,
+            sparse_counts,
+            memory_budget=memory_budget,
         )
 
 
-class InitLocFn:
+class InitLocFn(inference.InitLocFn):
     """
     Initializer for latent variables.
 
@@ -595,177 +1036,8 @@ class InitLocFn:
     """
 
     def __init__(self, dataset):
-        # Initialize init.
-        init = dataset["weekly_clades"].sum(0)  # [P, C]
-        init.add_(1 / init.size(-1)).div_(init.sum(-1, True))
-        init.log_().sub_(init.median(-1, True).values).add_(torch.randn(init.shape))
-        self.init = init  # [P, C]
-        self.init_decentered = init / 2
-        self.init_loc = init.mean(0)  # [C]
-        self.init_loc_decentered = self.init_loc / 2
-        self.pc_init = self.init.reshape(-1)[dataset["pc_index"]]
-        self.pc_init = self.pc_init / 2
-        assert not torch.isnan(self.init).any()
-        logger.info(f"init stddev = {self.init.std():0.3g}")
-
-    def __call__(self, site):
-        name = site["name"]
-        shape = site["fn"].shape()
-        if hasattr(self, name):
-            result = getattr(self, name)
-            assert result.shape == shape
-            return result
-        if name in (
-            "coef_scale",
-            "init_scale",
-            "init_loc_scale",
-        ):
-            return torch.ones(shape)
-        if name == "logits_scale":
-            return torch.full(shape, 0.002)
-        if name in (
-            "rate_scale",
-            "rate_loc_scale",
-            "place_scale",
-            "clade_scale",
-        ):
-            return torch.full(shape, 0.01)
-        if name in (
-            "rate_loc",
-            "rate_loc_decentered",
-            "coef",
-            "coef_decentered",
-            "rate",
-            "rate_decentered",
-            "pc_rate",
-            "pc_rate_decentered",
-        ):
-            return torch.rand(shape).sub_(0.5).mul_(0.01)
-        if name == "coef_loc":
-            return torch.rand(shape).sub_(0.5).mul_(0.01).add_(1.0)
-        raise ValueError(f"InitLocFn found unhandled site {repr(name)}; please update.")
-
-
-class Guide(AutoGuideList):
-    """
-    Custom guide for large-scale inference.
-
-    This combines a low-rank multivariate normal guide over small variables
-    with a mean field guide over remaining latent variables.
-    """
-
-    def __init__(self, model, init_loc_fn, init_scale, rank):
-        super().__init__(InitMessenger(init_loc_fn)(model))
-
-        # Jointly estimate globals, mutation coefficients, and clade coefficients.
-        mvn = [
-            "coef_scale",
-            "rate_loc_scale",
-            "init_loc_scale",
-            "rate_scale",
-            "init_scale",
-            "coef",
-            "coef_decentered",
-            "rate_loc",
-            "rate_loc_decentered",
-            "init_loc",
-            "init_loc_decentered",
-        ]
-        self.append(
-            AutoLowRankMultivariateNormal(
-                poutine.block(model, expose=mvn),
-                init_loc_fn=init_loc_fn,
-                init_scale=init_scale,
-                rank=rank,
-            )
-        )
-        model = poutine.block(model, hide=mvn)
-
-        # Mean-field estimate all remaining latent variables.
-        self.append(AutoNormal(model, init_loc_fn=init_loc_fn, init_scale=init_scale))
-
-
-class RegressiveGuide(AutoRegressiveMessenger):
-    def get_posterior(self, name, prior):
-        if name == "coef":
-            if not hasattr(self, "coef"):
-                # Initialize.
-                self.coef = PyroModule()
-                n = prior.shape()[-1]
-                rank = 100
-                assert n > 1
-                init_loc = self.init_loc_fn({"name": name, "fn": prior})
-                self.coef.loc = PyroParam(init_loc, event_dim=1)
-                self.coef.scale = PyroParam(
-                    torch.full((n,), self._init_scale),
-                    event_dim=1,
-                    constraint=constraints.positive,
-                )
-                self.coef.cov_factor = PyroParam(
-                    torch.empty(n, rank).normal_(0, 1 / rank**0.5),
-                    event_dim=2,
-                )
-            scale = self.coef.scale
-            cov_factor = self.coef.cov_factor * scale.unsqueeze(-1)
-            cov_diag = scale * scale
-            return dist.LowRankMultivariateNormal(self.coef.loc, cov_factor, cov_diag)
-
-        return super().get_posterior(name, prior)
-
-
-@torch.no_grad()
-@poutine.mask(mask=False)
-def predict(
-    model,
-    guide,
-    dataset,
-    model_type,
-    *,
-    num_samples=1000,
-    vectorize=None,
-    save_params=("rate", "init", "probs"),
-    forecast_steps=0,
-) -> dict:
-    def get_conditionals(data):
-        trace = poutine.trace(poutine.condition(model, data)).get_trace(
-            dataset, model_type, forecast_steps=forecast_steps
-        )
-        return {
-            name: site["value"].detach()
-            for name, site in trace.nodes.items()
-            if site["type"] == "sample" and not site_is_subsample(site)
-            if not name.startswith("obs")
-        }
-
-    # Compute median point estimate.
-    result: dict = defaultdict(dict)
-    for name, value in get_conditionals(guide.median(dataset)).items():
-        if value.numel() < 1e5 or name in save_params:
-            result["median"][name] = value
-
-    # Compute moments.
-    save_params = {
-        k for k, v in result["median"].items() if v.numel() < 1e5 or k in save_params
-    }
-    if vectorize is None:
-        vectorize = result["median"]["probs"].numel() < 1e6
-    if vectorize:
-        with pyro.plate("particles", num_samples, dim=-4):
-            samples = get_conditionals(guide())
-        for k, v in samples.items():
-            if k in save_params:
-                result["mean"][k] = v.mean(0).squeeze()
-                result["std"][k] = v.std(0).squeeze()
-    else:
-        stats = StatsOfDict({k: CountMeanVarianceStats for k in save_params})
-        for _ in tqdm.tqdm(range(num_samples)):
-            stats.update(get_conditionals(guide()))
-        for name, stats_ in stats.get().items():
-            if "mean" in stats_:
-                result["mean"][name] = stats_["mean"]
-            if "variance" in stats_:
-                result["std"][name] = stats_["variance"].sqrt()
-    return dict(result)
+        init = sparse_sum(dataset["weekly_clades"], 0)  # [P, C]
+        super().__init__(init, dataset["pc_index"], "pc")
 
 
 def fit_svi(
@@ -786,165 +1058,44 @@ def fit_svi(
     seed=20210319,
     check_loss=False,
     num_ell_particles=256,
+    vectorize=None,
+    memory_budget=None,
+    telemetry="eager",
+    compile_backend=None,
+    checkpoint_filename=None,
+    checkpoint_every=1000,
 ) -> dict:
     """
     Fits a variational posterior using stochastic variational inference (SVI).
-    """
-    start_time = default_timer()
-
-    logger.info(f"Fitting {guide_type} guide via SVI")
-    pyro.set_rng_seed(seed)
-    pyro.clear_param_store()
-    param_store = pyro.get_param_store()
-
-    # Initialize guide so we can count parameters and register hooks.
-    cond_data = {k: torch.as_tensor(v) for k, v in cond_data.items()}
-    model_ = poutine.condition(model, cond_data)
-    init_loc_fn = InitLocFn(dataset)
-    Elbo = JitTrace_ELBO if jit else Trace_ELBO
-    if guide_type == "map":
-        guide = AutoDelta(model_, init_loc_fn=init_loc_fn)
-    elif guide_type == "normal":
-        guide = AutoNormal(model_, init_loc_fn=init_loc_fn, init_scale=0.01)
-    elif guide_type == "full":
-        guide = AutoLowRankMultivariateNormal(
-            model_, init_loc_fn=init_loc_fn, init_scale=0.01, rank=rank
-        )
-    elif guide_type == "structured":
-        guide = AutoStructured(
-            model_,
-            init_loc_fn=init_loc_fn,
-            init_scale=0.01,
-            conditionals=defaultdict(
-                lambda: "normal",
-                rate_scale="delta",
-                init_loc_scale="delta",
-                init_scale="delta",
-                coef="mvn",
-                coef_decentered="mvn",
-            ),
-        )
-    elif guide_type == "regressive":
-        guide = RegressiveGuide(model_, init_loc_fn=init_loc_fn, init_scale=0.01)
-    else:
-        guide = Guide(model_, init_loc_fn=init_loc_fn, init_scale=0.01, rank=rank)
-    # This initializes the guide:
-    latent_shapes = {k: v.shape for k, v in guide(dataset, model_type).items()}
-    latent_numel = {k: v.numel() for k, v in latent_shapes.items()}
-    logger.info(
-        "\n".join(
-            [f"Model has {sum(latent_numel.values())} latent variables of shapes:"]
-            + [f" {k} {tuple(v)}" for k, v in latent_shapes.items()]
-        )
-    )
-    param_shapes = {k: v.shape for k, v in pyro.get_param_store().named_parameters()}
-    param_numel = {k: v.numel() for k, v in param_shapes.items()}
-    logger.info(
-        "\n".join(
-            [f"Guide has {sum(param_numel.values())} parameters of shapes:"]
-            + [f" {k} {tuple(v)}" for k, v in param_shapes.items()]
-        )
-    )
-
-    # Log gradient norms during inference.
-    series: dict = defaultdict(list)
-
-    def hook(g, series):
-        series.append(torch.linalg.norm(g.reshape(-1), math.inf).item())
 
-    for name, value in pyro.get_param_store().named_parameters():
-        value.register_hook(functools.partial(hook, series=series[name]))
-
-    def optim_config(param_name):
-        config: dict = {
-            "lr": learning_rate,
-            "lrd": learning_rate_decay ** (1 / num_steps),
-            "clip_norm": clip_norm,
-        }
-        scalars = [k for k, v in latent_numel.items() if v == 1]
-        if any("locs." + s in name for s in scalars):
-            config["lr"] *= 0.2
-        elif "scales" in param_name:
-            config["lr"] *= 0.1
-        elif "scale_tril" in param_name:
-            config["lr"] *= 0.05
-        elif "factors" in param_name or "prec_sqrts" in param_name:
-            config["lr"] *= 0.05
-        elif "weight_" in param_name:
-            config["lr"] *= 0.01
-        elif "weight" in param_name:
-            config["lr"] *= 0.03
-        elif "_centered" in param_name:
-            config["lr"] *= 0.1
-        return config
-
-    optim = ClippedAdam(optim_config)
-    elbo = Elbo(max_plate_nesting=3, ignore_jit_warnings=True)
-    svi = SVI(model_, guide, optim, elbo)
-    losses = []
-    num_obs = dataset["weekly_clades"].count_nonzero()
-    for step in range(num_steps):
-        loss = svi.step(dataset=dataset, model_type=model_type)
-        assert not math.isnan(loss)
-        losses.append(loss)
-        median = guide.median()
-        for name, value in median.items():
-            if value.numel() == 1:
-                series[name].append(float(value))
-        if log_every and step % log_every == 0:
-            logger.info(
-                " ".join(
-                    [f"step {step: >4d} L={loss / num_obs:0.6g}"]
-                    + [
-                        "{}={:0.3g}".format(
-                            "".join(p[0] for p in k.split("_")).upper(), v.item()
-                        )
-                        for k, v in median.items()
-                        if v.numel() == 1
-                    ]
-                )
-            )
-        if check_loss and step >= 50:
-            prev = torch.tensor(losses[-50:-25], device="cpu").median().item()
-            curr = torch.tensor(losses[-25:], device="cpu").median().item()
-            assert (curr - prev) < num_obs, "loss is increasing"
-
-    # compute expected log probability
-    ell = 0.0
-    with torch.no_grad(), poutine.block():
-        for _ in range(num_ell_particles):
-            guide_trace = poutine.trace(guide).get_trace(
-                dataset=dataset, model_type=model_type
-            )
-            replayed_model = poutine.replay(model_, trace=guide_trace)
-            model_trace = poutine.trace(replayed_model).get_trace(
-                dataset=dataset, model_type=model_type
-            )
-            model_trace.compute_log_prob()
-            ell += model_trace.nodes["obs"]["unscaled_log_prob"].item() / float(
-                num_ell_particles
-            )
-
-    result = predict(
-        model_,
-        guide,
+    See :func:`pyrocov.inference.fit_svi` for details.
+    """
+    return inference.fit_svi(
+        model,
+        InitLocFn,
         dataset,
-        model_type,
-        num_samples=num_samples,
+        model_type=model_type,
+        guide_type=guide_type,
+        cond_data=cond_data,
         forecast_steps=forecast_steps,
+        learning_rate=learning_rate,
+        learning_rate_decay=learning_rate_decay,
+        num_steps=num_steps,
+        num_samples=num_samples,
+        clip_norm=clip_norm,
+        rank=rank,
+        jit=jit,
+        log_every=log_every,
+        seed=seed,
+        check_loss=check_loss,
+        num_ell_particles=num_ell_particles,
+        vectorize=vectorize,
+        memory_budget=memory_budget,
+        telemetry=telemetry,
+        compile_backend=compile_backend,
+        checkpoint_filename=checkpoint_filename,
+        checkpoint_every=checkpoint_every,
     )
-    result["ELL"] = ell
-    result["losses"] = losses
-    series["loss"] = losses
-    result["series"] = dict(series)
-    result["params"] = {
-        k: v.detach().float().cpu().clone()
-        for k, v in param_store.items()
-        if v.numel() < 1e8
-    }
-    result["walltime"] = default_timer() - start_time
-
-    return result
 
 
 @torch.no_grad()
@@ -957,169 +1108,33 @@ def log_stats(dataset: dict, result: dict) -> dict:
     :param dict result: The output of :func:`fit_svi`.
     :returns: A dictionary of statistics.
     """
-    stats = {k: float(v) for k, v in result["median"].items() if v.numel() == 1}
-    stats["loss"] = float(np.median(result["losses"][-100:]))
-    mutations = dataset["mutations"]
-
-    if "coef" in result["mean"]:
-        mean = result["mean"]["coef"].cpu()
-        if not mean.shape:
-            return stats  # Work around error in map estimation.
-        logger.info(
-            "Dense data has shape {} totaling {} sequences".format(
-                " x ".join(map(str, dataset["weekly_clades"].shape)),
-                int(dataset["weekly_clades"].sum()),
-            )
+    logger.info(
+        "Dense data has shape {} totaling {} sequences".format(
+            " x ".join(map(str, dataset["weekly_clades"].shape)),
+            int(sparse_sum(dataset["weekly_clades"])),
         )
+    )
 
-        # Statistical significance.
-        std = result["std"]["coef"].cpu()
-        sig = mean.abs() / std
-        logger.info(f"|μ|/σ [median,max] = [{sig.median():0.3g},{sig.max():0.3g}]")
-        stats["|μ|/σ median"] = sig.median()
-        stats["|μ|/σ max"] = sig.max()
-
-        # Effects of individual mutations.
-        for name in ["S:D614G", "S:N501Y", "S:E484K", "S:L452R"]:
-            if name not in mutations:
-                continue
-            i = mutations.index(name)
-            m = mean[i] * 0.01
-            s = std[i] * 0.01
-            logger.info(f"ΔlogR({name}) = {m:0.3g} ± {s:0.2f}")
-            stats[f"ΔlogR({name}) mean"] = m
-            stats[f"ΔlogR({name}) std"] = s
-
-    # Growth rates of individual clades.
+    # Aggregate clades to lineages.
     rate = quotient_central_moments(
         result["mean"]["rate"].mean(0), dataset["clade_id_to_lineage_id"]
     )[1]
-    rate = rate - rate[dataset["lineage_id"]["A"]]
-    for lineage in ["B.1.1.7", "B.1.617.2", "AY.23.1"]:
-        R_RA = float(rate[dataset["lineage_id"][lineage]].exp())
-        logger.info(f"R({lineage})/R(A) = {R_RA:0.3g}")
-        stats[f"R({lineage})/R(A)"] = R_RA
-
-    # Posterior predictive error.
     L = len(dataset["lineage_id"])
     weekly_clades = dataset["weekly_clades"]
-    weekly_lineages = torch.zeros(weekly_clades.shape[:-1] + (L,)).scatter_add_(
-        -1, dataset["clade_id_to_lineage_id"].expand_as(weekly_clades), weekly_clades
-    )
-    true = weekly_lineages + 1e-20  # avoid nans
-    counts = true.sum(-1, True)
-    true_probs = true / counts
-    pred = result["median"]["probs"][: len(true)] + 1e-20  # truncate, avoid nans
-    kl = true.mul(true_probs.log() - pred.log()).sum([0, -1])
-    error = (pred - true_probs) * counts**0.5  # scaled by Poisson stddev
-    mae = error.abs().mean(0)  # average over time
-    mse = error.square().mean(0)  # average over time
-    stats["MAE"] = float(mae.sum(-1).mean())  # average over region
-    stats["RMSE"] = float(mse.sum(-1).mean().sqrt())  # root average over region
-    stats["KL"] = float(kl.sum() / counts.sum())  # in units of nats / observation
-    if "ELL" in result:
-        stats["ELL"] = result["ELL"]
-
-    logger.info("KL = {KL:0.4g}, MAE = {MAE:0.4g}, RMSE = {RMSE:0.4g}".format(**stats))
-
-    # Examine the MSE and RMSE over a few regions of interest.
-    queries = {
-        "England": ["B.1.1.7"],
-        # "England": ["B.1.1.7", "B.1.177", "B.1.1", "B.1"],
-        # "USA / California": ["B.1.1.7", "B.1.429", "B.1.427", "B.1.2", "B.1", "P.1"],
-    }
-    for place, lineages in queries.items():
-        matches = [p for name, p in dataset["location_id"].items() if place in name]
-        if not matches:
-            continue
-        assert len(matches) == 1, matches
-        p = matches[0]
-        stats[f"{place} KL"] = float(kl[p].sum() / true[:, p].sum())
-        stats[f"{place} MAE"] = float(mae[p].sum())
-        stats[f"{place} RMSE"] = float(mse[p].sum().sqrt())
-        logger.info(
-            "{}\tKL = {:0.3g}, MAE = {:0.3g}, RMSE = {:0.3g}".format(
-                place,
-                stats[f"{place} KL"],
-                stats[f"{place} MAE"],
-                stats[f"{place} RMSE"],
-            )
+    T, P, C = weekly_clades.shape
+    weekly_lineages = torch.zeros(T, P, L)
+    if weekly_clades.is_sparse:
+        weekly_clades = weekly_clades.coalesce()
+        t, p, c = weekly_clades.indices()
+        weekly_lineages.index_put_(
+            (t, p, dataset["clade_id_to_lineage_id"][c]),
+            weekly_clades.values(),
+            accumulate=True,
         )
-
-        for lineage in lineages:
-            i = dataset["lineage_id"][lineage]
-            stats[f"{place} {lineage} MAE"] = mae[p, i]
-            stats[f"{place} {lineage} RMSE"] = mse[p, i].sqrt()
-            logger.info(
-                "{} {}\tMAE = {:0.3g}, RMSE = {:0.3g}".format(
-                    place,
-                    lineage,
-                    stats[f"{place} {lineage} MAE"],
-                    stats[f"{place} {lineage} RMSE"],
-                )
-            )
-
-    return {k: float(v) for k, v in stats.items()}
-
-
-@torch.no_grad()
-def log_holdout_stats(fits: dict) -> dict:
-    """
-    Logs statistics comparing multiple results from ``fit_svi``.
-    """
-    assert len(fits) > 1
-    fits = list(fits.items())
-    stats = {}
-    for i, (name1, fit1) in enumerate(fits[:-1]):
-        for name2, fit2 in fits[i + 1 :]:
-            # Compute mutation similarity.
-            mutations = sorted(set(fit1["mutations"]) & set(fit2["mutations"]))
-            medians = []
-            for fit in (fit1, fit2):
-                mutation_id = {m: i for i, m in enumerate(fit["mutations"])}
-                idx = torch.tensor([mutation_id[m] for m in mutations])
-                medians.append(fit["median"]["coef"][idx] * 0.01)
-            error = medians[0] - medians[1]
-            mutation_std = torch.cat(medians).std().item()
-            mutation_rmse = error.square().mean().sqrt().item()
-            mutation_mae = error.abs().mean().item()
-            mutation_correlation = pearson_correlation(medians[0], medians[1]).item()
-
-            # Compute lineage similarity.
-            means = []
-            for fit in (fit1, fit2):
-                rate = fit["mean"]["rate"]
-                if rate.dim() == 2:
-                    rate = rate.mean(0)
-                means.append(rate)
-            error = means[0] - means[1]
-            lineage_std = torch.cat(means).std().item()
-            lineage_rmse = error.square().mean().sqrt().item()
-            lineage_mae = error.abs().mean().item()
-            lineage_correlation = pearson_correlation(means[0], means[1]).item()
-
-            # Print stats.
-            logger.info(
-                f"{name1} vs {name2} mutations: "
-                f"ρ = {mutation_correlation:0.3g}, "
-                f"RMSE = {mutation_rmse:0.3g}, "
-                f"MAE = {mutation_mae:0.3g}"
-            )
-            logger.info(
-                f"{name1} vs {name2} lineages: "
-                f"ρ = {lineage_correlation:0.3g}, "
-                f"RMSE = {lineage_rmse:0.3g}, "
-                f"MAE = {lineage_mae:0.3g}"
-            )
-
-            # Save stats.
-            stats["mutation_corr"] = mutation_correlation
-            stats["mutation_rmse"] = mutation_rmse
-            stats["mutation_mae"] = mutation_mae
-            stats["mutation_stddev"] = mutation_std
-            stats["lineage_corr"] = lineage_correlation
-            stats["lineage_rmse"] = lineage_rmse
-            stats["lineage_mae"] = lineage_mae
-            stats["lineage_stdev"] = lineage_std
-
-    return {k: float(v) for k, v in stats.items()}
+    else:
+        weekly_lineages.scatter_add_(
+            -1,
+            dataset["clade_id_to_lineage_id"].expand_as(weekly_clades),
+            weekly_clades,
+        )
+    return inference.log_stats(dataset, result, weekly_lineages, rate)
@@ -126,10 +126,181 @@ def sparse_multinomial_likelihood(total_count, nonzero_logits, nonzero_value):
     return (
         log_factorial_sum(total_count)
         - log_factorial_sum(nonzero_value)
-        + torch.dot(nonzero_logits, nonzero_value)
+        + torch.matmul(nonzero_logits, nonzero_value)
     )
 
 
+def time_chunk_size(memory_budget, num_steps, step_numel, *, itemsize=4):
+    """
+    Computes the number of time steps per block such that a block of
+    ``step_numel`` elements per time step fits in ``memory_budget`` bytes.
+
+    :param memory_budget: A memory budget in bytes, or None for no limit.
+    :type memory_budget: int or None
+    :param int num_steps: The total number of time steps.
+    :param int step_numel: The number of tensor elements per time step.
+    :param int itemsize: The number of bytes per element.
+    :returns: A chunk size between 1 and ``num_steps``.
+    :rtype: int
+    """
+    if memory_budget is None:
+        return max(1, num_steps)
+    chunk_size = int(memory_budget) // max(1, step_numel * itemsize)
+    return max(1, min(num_steps, chunk_size))
+
+
+def logistic_multinomial_likelihood(
+    total_count,
+    init,
+    rate,
+    time,
+    nonzero_index,
+    nonzero_value,
+    *,
+    backend="fused",
+    chunk_size=1,
+):
+    """
+    Computes the sparse multinomial likelihood of logits linear in time::
+
+        logits = init + rate * time[:, None, None]  # [T, P, C]
+        t, p, c = nonzero_index
+        sparse_multinomial_likelihood(
+            total_count, logits.log_softmax(-1)[t, p, c], nonzero_value
+        )
+
+    where::
+
+        total_count.shape == [T, P]
+        init.shape == [..., P, C]
+        rate.shape == [..., P, C]
+        time.shape == [T]
+
+    and any leading batch dimensions of ``init`` and ``rate`` are preserved
+    in the result. The "fused" backend never creates ``[T, P, C]``-shaped tensors. It
+    gathers the numerator only at nonzero entries and streams over blocks of
+    ``chunk_size`` time steps to compute the normalizer. Its backward pass
+    recomputes each block rather than saving activations, so memory is
+    ``O(chunk_size * P * C + T * P)``.
+
+    :param str backend: One of "naive", "fused".
+    :param int chunk_size: The number of time steps per block in the "fused"
+        backend; see :func:`time_chunk_size`.
+    """
+    assert init.dim() >= 2
+    assert rate.shape == init.shape
+    assert time.dim() == 1
+    assert total_count.shape == (len(time), init.size(-2))
+    assert not time.requires_grad
+    t, p, c = nonzero_index
+
+    if backend == "naive":
+        logits = init.unsqueeze(-3) + rate.unsqueeze(-3) * time[:, None, None]
+        logits = logits.log_softmax(-1)  # [..., T, P, C]
+        return sparse_multinomial_likelihood(
+            total_count, logits[..., t, p, c], nonzero_value
+        )
+    if backend == "fused":
+        nonzero_logits = init[..., p, c] + rate[..., p, c] * time[t]  # unnormalized
+        return (
+            log_factorial_sum(total_count)
+            - log_factorial_sum(nonzero_value)
+            + torch.matmul(nonzero_logits, nonzero_value)
+            - LogisticLogNormalizer.apply(init, rate, time, total_count, chunk_size)
+        )
+    raise ValueError(f"Unknown backend: {repr(backend)}")
+
+
+class LogisticLogNormalizer(torch.autograd.Function):
+    """
+    Computes::
+
+        (total_count * (init + rate * time[:, None, None]).logsumexp(-1)).sum()
+
+    in blocks of ``chunk_size`` time steps.
+    """
+
+    @staticmethod
+    def forward(ctx, init, rate, time, total_count, chunk_size):
+        T, P = total_count.shape
+        batch_shape = init.shape[:-2]
+        log_normalizer = init.new_empty(batch_shape + (T, P))
+        for t0 in range(0, T, chunk_size):
+            t1 = min(T, t0 + chunk_size)
+            logits = rate.unsqueeze(-3) * time[t0:t1, None, None]
+            logits = logits.add_(init.unsqueeze(-3))  # [..., t, P, C]
+            log_normalizer[..., t0:t1, :] = logits.logsumexp(-1)  # [..., t, P]
+
+        ctx.chunk_size = chunk_size
+        ctx.save_for_backward(init, rate, time, total_count, log_normalizer)
+        return torch.matmul(
+            log_normalizer.reshape(batch_shape + (-1,)), total_count.reshape(-1)
+        )
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        init, rate, time, total_count, log_normalizer = ctx.saved_tensors
+        chunk_size = ctx.chunk_size
+        T = len(time)
+
+        grad_init = torch.zeros_like(init)  # [..., P, C]
+        grad_rate = torch.zeros_like(rate)  # [..., P, C]
+        for t0 in range(0, T, chunk_size):
+            t1 = min(T, t0 + chunk_size)
+            logits = rate.unsqueeze(-3) * time[t0:t1, None, None]
+            logits = logits.add_(init.unsqueeze(-3))  # [..., t, P, C]
+            probs = logits.sub_(log_normalizer[..., t0:t1, :, None]).exp_()
+            grad_logits = probs.mul_(total_count[t0:t1, :, None])  # [..., t, P, C]
+            grad_init += grad_logits.sum(-3)
+            grad_rate += torch.einsum("...tpc,t->...pc", grad_logits, time[t0:t1])
+
+        grad_output = grad_output[..., None, None]
+        return grad_init * grad_output, grad_rate * grad_output, None, None, None
+
+
+def logistic_probs(init, rate, time, *, index=None, size=None, chunk_size=None):
+    """
+    Computes probabilities of logits linear in time, optionally summed into
+    groups::
+
+        probs = (init + rate * time[:, None, None]).softmax(-1)  # [..., T, P, C]
+        if index is not None:
+            probs = probs.new_zeros(probs.shape[:-1] + (size,)).scatter_add_(
+                -1, index.expand_as(probs), probs
+            )  # [..., T, P, size]
+
+    where ``init`` and ``rate`` are ``[..., P, C]``-shaped and may have
+    leading batch dimensions. The ``[..., T, P, C]``-shaped logits are
+    computed in blocks of ``chunk_size`` time steps, so only the output is
+    materialized in full.
+
+    :param torch.Tensor index: An optional ``[C]``-shaped tensor of group
+        ids, e.g. a clade-to-lineage map.
+    :param int size: The number of groups, required if ``index`` is given.
+    :param int chunk_size: The number of time steps per block, defaulting
+        to all time steps; see :func:`time_chunk_size`.
+    """
+    T = len(time)
+    shape = torch.broadcast_shapes(init.shape, rate.shape, (T, 1, 1))
+    if chunk_size is None:
+        chunk_size = T
+    if index is None:
+        result = init.new_empty(shape)
+    else:
+        assert size is not None
+        result = init.new_zeros(shape[:-1] + (size,))
+    for t0 in range(0, T, chunk_size):
+        t1 = min(T, t0 + chunk_size)
+        logits = init + rate * time[t0:t1, None, None]  # [..., t, P, C]
+        if index is None:
+            result[..., t0:t1, :, :] = logits.softmax(-1)
+        else:
+            result[..., t0:t1, :, :].scatter_add_(
+                -1, index.expand_as(logits), logits.softmax(-1)
+            )
+    return result
+
+
 def sparse_categorical_kl(log_q, p_support, log_p):
     """
     Computes the restricted Kl divergence::
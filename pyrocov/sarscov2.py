@@ -3,13 +3,16 @@
 
 import os
 import re
-from collections import OrderedDict, defaultdict
-from typing import Dict, List, Tuple
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
 
 from .aa import DNA_TO_AA
 from .align import NEXTCLADE_DATA
 
 REFERENCE_SEQ = None  # loaded lazily
+TRANSLATOR = None  # created lazily
 
 # Adapted from https://github.com/nextstrain/ncov/blob/50ceffa/defaults/annotation.gff
 # Note these are 1-based positions
@@ -172,56 +175,183 @@ def aa_mutation_to_position(m: str) -> int:
     return start + aa_offset * 3
 
 
-def nuc_mutations_to_aa_mutations(ms: List[str]) -> List[str]:
-    global REFERENCE_SEQ
-    if REFERENCE_SEQ is None:
-        REFERENCE_SEQ = load_reference_sequence()
+class AminoAcidTranslator:
+    """
+    Translates sets of nucleotide mutations to amino acid mutations.
+
+    This precomputes arrays mapping each genome position to the genes,
+    codons, and offsets within codons that contain that position, then looks
+    up whole batches of mutation sets at once. Since related clades share
+    most of their mutations, the amino acid change of each mutated codon is
+    memoized.
+
+    :param str reference: A reference sequence, defaulting to the Wuhan
+        reference sequence.
+    """
 
-    ms_by_aa = defaultdict(list)
+    def __init__(self, reference: Optional[str] = None):
+        if reference is None:
+            reference = load_reference_sequence()
+        self.reference = reference
+        self.genes = list(GENE_TO_POSITION)
+        self._starts = [start for start, end in GENE_TO_POSITION.values()]
+        self._cache: Dict[tuple, Optional[str]] = {}
 
-    for m in ms:
-        # Parse a nucleotide mutation such as "A1234G" -> (1234, "G").
+        # Map each 1-based position to the (gene, codon, offset) triples of
+        # all genes containing it, in order of GENE_TO_POSITION, padding with
+        # gene = -1. Genes overlap, so a position may lie in multiple genes.
+        size = max(len(reference), *(end for _, end in GENE_TO_POSITION.values())) + 1
+        depth = np.zeros(size, dtype=np.int64)
+        for start, end in GENE_TO_POSITION.values():
+            depth[start : end + 1] += 1
+        shape = size, int(depth.max())
+        self._gene = np.full(shape, -1, dtype=np.int8)
+        self._codon = np.zeros(shape, dtype=np.int32)
+        self._offset = np.zeros(shape, dtype=np.int8)
+        depth[:] = 0
+        for g, (start, end) in enumerate(GENE_TO_POSITION.values()):
+            positions = np.arange(start, end + 1)
+            k = depth[positions]
+            self._gene[positions, k] = g
+            self._codon[positions, k] = (positions - start) // 3
+            self._offset[positions, k] = (positions - start) % 3
+            depth[positions] += 1
+
+    def translate(self, ms: Iterable) -> List[str]:
+        """
+        Translates a single set of nucleotide mutations.
+
+        :param ms: An iterable of either strings like ``"A23403G"`` or
+            :class:`pyrocov.usher.Mutation` s.
+        :returns: A list of amino acid mutations like ``"S:D614G"``.
+        :rtype: list
+        """
+        return self.translate_batch([ms])[0]
+
+    def translate_batch(self, mutation_sets: Iterable[Iterable]) -> List[List[str]]:
+        """
+        Translates a batch of sets of nucleotide mutations.
+
+        :param mutation_sets: An iterable of sets of mutations, each as in
+            :meth:`translate`.
+        :returns: A list of lists of amino acid mutations.
+        :rtype: list
+        """
+        # Parse nucleotide mutations such as "A1234G" -> (1234, "G").
         # Note this uses 1-based indexing.
-        if isinstance(m, str):
-            position_nuc = int(m[1:-1])
-            new_nuc = m[-1]
-        else:
-            # assert isinstance(m, pyrocov.usher.Mutation)
-            position_nuc = m.position
-            new_nuc = m.mut
-
-        # Find the first matching gene.
-        for gene, (start, end) in GENE_TO_POSITION.items():
-            if start <= position_nuc <= end:
-                position_aa = (position_nuc - start) // 3
-                position_codon = (position_nuc - start) % 3
-                ms_by_aa[gene, position_aa].append((position_codon, new_nuc))
-
-    # Format cumulative amino acid changes.
-    result = []
-    for (gene, position_aa), ms in ms_by_aa.items():
-        start, end = GENE_TO_POSITION[gene]
+        positions: list = []
+        new_nucs: list = []
+        ends = []
+        for ms in mutation_sets:
+            ms = list(ms)
+            if ms and isinstance(ms[0], str):
+                positions.extend(int(m[1:-1]) for m in ms)
+                new_nucs.extend(m[-1] for m in ms)
+            else:
+                # assert isinstance(m, pyrocov.usher.Mutation)
+                positions.extend(m.position for m in ms)
+                new_nucs.extend(m.mut for m in ms)
+            ends.append(len(positions))
+        if not ends:
+            return []
+        nuc_codes: dict = {}
+        new_nucs = [nuc_codes.setdefault(n, len(nuc_codes)) for n in new_nucs]
+        nucs = list(nuc_codes)
+
+        # Look up all matching genes at once. Each (mutation, gene) hit is a
+        # change to a codon.
+        positions = np.array(positions, dtype=np.int64)
+        positions[(positions < 0) | (positions >= len(self._gene))] = 0
+        mutation, k = np.nonzero(self._gene[positions] >= 0)
+        gene = self._gene[positions[mutation], k].astype(np.int64)
+        codon = self._codon[positions[mutation], k].astype(np.int64)
+        offset = self._offset[positions[mutation], k].astype(np.int64)
+        nuc = np.array(new_nucs, dtype=np.int64)[mutation]
+        set_id = np.searchsorted(ends, mutation, side="right")
+
+        # Group hits by (set, codon), ordering groups by first appearance.
+        codon_id = gene * len(self._gene) + codon
+        order = np.lexsort((codon_id, set_id))
+        is_first = np.ones(len(order), dtype=bool)
+        is_first[1:] = np.diff(set_id[order]) != 0
+        is_first[1:] |= np.diff(codon_id[order]) != 0
+        group_begin = np.flatnonzero(is_first)
+        group_size = np.diff(np.append(group_begin, len(order)))
+        first = order[group_begin]
+
+        # Translate each group, memoizing by codon change. Most groups are
+        # single mutations, which are first deduplicated within the batch.
+        result = np.empty(len(first), dtype=object)
+        single = np.flatnonzero(group_size == 1)
+        hits = first[single]
+        keys = (codon_id[hits] * 3 + offset[hits]) * len(nucs) + nuc[hits]
+        _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        hits = hits[index]
+        unique_result = np.empty(len(hits), dtype=object)
+        unique_result[:] = [
+            self._translate_codon(g, c, ((o, nucs[n]),))
+            for g, c, o, n in zip(
+                gene[hits].tolist(),
+                codon[hits].tolist(),
+                offset[hits].tolist(),
+                nuc[hits].tolist(),
+            )
+        ]
+        result[single] = unique_result[inverse.reshape(-1)]
+        for g in np.flatnonzero(group_size > 1).tolist():
+            hits = order[group_begin[g] :][: group_size[g]]
+            ms = tuple((o, nucs[n]) for o, n in zip(offset[hits].tolist(), nuc[hits]))
+            result[g] = self._translate_codon(
+                gene[hits[0]].item(), codon[hits[0]].item(), ms
+            )
+
+        # Split nonsynonymous mutations among sets.
+        perm = np.argsort(first, kind="stable")
+        result = result[perm]
+        keep = np.not_equal(result, None)
+        counts = np.bincount(set_id[first[perm]][keep], minlength=len(ends))
+        return [r.tolist() for r in np.split(result[keep], np.cumsum(counts)[:-1])]
+
+    def _translate_codon(self, gene, codon, ms):
+        key = gene, codon, ms
+        if key in self._cache:
+            return self._cache[key]
 
         # Apply mutation to determine new aa.
-        pos = start + position_aa * 3
+        pos = self._starts[gene] + codon * 3
         pos -= 1  # convert from 1-based to 0-based
-        old_codon = REFERENCE_SEQ[pos : pos + 3]
+        old_codon = self.reference[pos : pos + 3]
         new_codon = list(old_codon)
-        for position_codon, new_nuc in ms:
-            new_codon[position_codon] = new_nuc
+        for offset, new_nuc in ms:
+            new_codon[offset] = new_nuc
         new_codon = "".join(new_codon)
 
-        # Format.
+        # Format, ignoring synonymous substitutions.
         old_aa = DNA_TO_AA[old_codon]
         new_aa = DNA_TO_AA[new_codon]
-        if new_aa == old_aa:  # ignore synonymous substitutions
-            continue
-        if old_aa is None:
-            old_aa = "STOP"
-        if new_aa is None:
-            new_aa = "STOP"
-        result.append(f"{gene}:{old_aa}{position_aa + 1}{new_aa}")  # 1-based
-    return result
+        result = None
+        if new_aa != old_aa:
+            old_aa = "STOP" if old_aa is None else old_aa
+            new_aa = "STOP" if new_aa is None else new_aa
+            result = f"{self.genes[gene]}:{old_aa}{codon + 1}{new_aa}"  # 1-based
+        self._cache[key] = result
+        return result
+
+
+def get_translator() -> AminoAcidTranslator:
+    """
+    Returns a shared :class:`AminoAcidTranslator` for the reference sequence.
+    """
+    global REFERENCE_SEQ, TRANSLATOR
+    if TRANSLATOR is None:
+        if REFERENCE_SEQ is None:
+            REFERENCE_SEQ = load_reference_sequence()
+        TRANSLATOR = AminoAcidTranslator(REFERENCE_SEQ)
+    return TRANSLATOR
+
+
+def nuc_mutations_to_aa_mutations(ms: List[str]) -> List[str]:
+    return get_translator().translate(ms)
 
 
 def load_reference_sequence():
@@ -4,13 +4,18 @@
 import gzip
 import heapq
 import logging
+import math
+import mmap
+import os
+import re
 import shutil
 import warnings
-from collections import defaultdict, namedtuple
-from typing import Dict, FrozenSet, Optional, Set, Tuple
+from collections import OrderedDict, namedtuple
+from typing import Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
 
+import numpy as np
 import tqdm
-from Bio.Phylo.NewickIO import Parser, Writer
+from Bio.Phylo.NewickIO import Parser
 
 from . import pangolin
 from .external.usher import parsimony_pb2
@@ -22,15 +27,340 @@ Mutation = namedtuple("Mutation", ["position", "ref", "mut"])
 NUCLEOTIDE = "ACGT"
 
 
+# Tokens as in Bio.Phylo.NewickIO, but skipping all whitespace.
+NEWICK_TOKEN = re.compile(
+    r"\(|\)|,|;|\[(?:\\.|[^\]])*\]|'(?:\\.|[^'])*'"
+    r"|:\ ?[+-]?[0-9]*\.?[0-9]+(?:[eE][+-]?[0-9]+)?|[^\s()\[\]':;,]+"
+)
+NEWICK_UNQUOTED = re.compile(r"[^\s()\[\]':;,]+")
+
+
+try:
+    from isal import igzip as _gzip  # faster decompression, if installed
+except ImportError:
+    _gzip = gzip
+
+# A cache of recently loaded (proto, MutationTree) pairs.
+TREE_CACHE_SIZE = 2
+_TREE_CACHE: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+
+def _read_gzip(filename: str) -> bytearray:
+    """
+    Decompresses a gzipped file into a single preallocated buffer.
+    """
+    # The trailing 4 bytes store the uncompressed size modulo 2**32, which is
+    # exact for single-member files under 4GB. Otherwise we fall back to
+    # trimming or appending.
+    with open(filename, "rb") as f:
+        f.seek(-4, os.SEEK_END)
+        size = int.from_bytes(f.read(4), "little")
+    buf = bytearray(size)
+    view = memoryview(buf)
+    pos = 0
+    with _gzip.open(filename, "rb") as f:
+        while pos < size:
+            count = f.readinto(view[pos:])
+            if not count:
+                break
+            pos += count
+        rest = f.read()
+    view.release()
+    if pos < size:
+        del buf[pos:]
+    buf += rest
+    return buf
+
+
+def read_proto(filename):
+    """
+    Reads an usher protobuf, possibly gzipped.
+
+    Uncompressed files are parsed directly from a memory map, and gzipped
+    files are decompressed into a single preallocated buffer, so that at most
+    one copy of the serialized bytes is held in memory during parsing.
+    """
+    if filename.endswith(".gz"):
+        return parsimony_pb2.data.FromString(_read_gzip(filename))  # type: ignore
+    with open(filename, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return parsimony_pb2.data()  # type: ignore
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return parsimony_pb2.data.FromString(buf)  # type: ignore
+
+
 def load_proto(filename):
-    open_ = gzip.open if filename.endswith(".gz") else open
-    with open_(filename, "rb") as f:
-        proto = parsimony_pb2.data.FromString(f.read())  # type: ignore
+    proto = read_proto(filename)
     newick = proto.newick.replace(";", "")  # work around unescaped node names
     tree = next(Parser.from_string(newick).parse())
     return proto, tree
 
 
+def parse_newick(newick: str) -> Tuple[List[int], List[str], List[float]]:
+    """
+    Parses a newick string into lists ``(parent, names, branch_length)`` of
+    nodes in depth-first preorder, i.e. the order of
+    :meth:`Bio.Phylo.BaseTree.TreeMixin.find_clades`. The root has parent -1,
+    unnamed nodes have name ``""`` and missing branch lengths are NaN.
+    """
+    parent = [-1]
+    names = [""]
+    branch_length = [math.nan]
+    path = [0]  # from the root to the current node
+    for match in NEWICK_TOKEN.finditer(newick):
+        token = match.group()
+        if token == "(" or token == ",":
+            if token == ",":
+                path.pop()
+                if not path:
+                    raise ValueError("Parenthesis mismatch")
+            path.append(len(parent))
+            parent.append(path[-2])
+            names.append("")
+            branch_length.append(math.nan)
+        elif token == ")":
+            path.pop()
+            if not path:
+                raise ValueError("Parenthesis mismatch")
+        elif token == ";":
+            break
+        elif token[0] == ":":
+            branch_length[path[-1]] = float(token[1:])
+        elif token[0] == "'":
+            # Support escaped quotes as in Bio.Phylo.NewickIO.
+            name = names[path[-1]]
+            names[path[-1]] = name + token[:-1] if name else token[1:-1]
+        elif token[0] != "[":  # ignore comments
+            names[path[-1]] = token
+    if len(path) != 1:
+        raise ValueError("Parenthesis mismatch")
+    return parent, names, branch_length
+
+
+def _format_newick(parent, names, branch_length) -> str:
+    """
+    Formats a tree given in depth-first preorder as a newick string, as
+    :class:`Bio.Phylo.NewickIO.Writer` would.
+    """
+    num_children = np.bincount(np.asarray(parent[1:]), minlength=len(parent))
+
+    def label(i):
+        name = names[i]
+        if name:
+            match = NEWICK_UNQUOTED.match(name)
+            if match is None or match.end() < len(name):
+                name = "'{}'".format(name.replace("'", "''"))
+        length = branch_length[i]
+        return "{}:{:1.8g}".format(name, 0.0 if math.isnan(length) else length)
+
+    parts = []
+    path: List[int] = []  # open ancestors
+    for i, p in enumerate(parent):
+        while path and path[-1] != p:
+            parts.append(")" + label(path.pop()))
+        if path and parts[-1] != "(":
+            parts.append(",")
+        if num_children[i]:
+            path.append(i)
+            parts.append("(")
+        else:
+            parts.append(label(i))
+    while path:
+        parts.append(")" + label(path.pop()))
+    parts.append(";")
+    return "".join(parts)
+
+
+class MutationTree:
+    """
+    A compact array representation of an usher mutation-annotated tree, as a
+    lightweight alternative to a tree of :class:`Bio.Phylo.Newick.Clade`
+    objects.
+
+    Nodes are numbered in depth-first preorder, which is the order of
+    ``proto.metadata`` and ``proto.node_mutations``, so every node's parent
+    precedes it and every subtree is a contiguous range of nodes.
+
+    :ivar numpy.ndarray parent: An int32 array of parent ids, -1 at the root.
+    :ivar numpy.ndarray child_offsets: An int64 array of offsets such that
+        the children of node ``i`` are
+        ``children[child_offsets[i]:child_offsets[i + 1]]``.
+    :ivar numpy.ndarray children: An int32 array of child ids.
+    :ivar list names: A string table of node names, ``""`` if unnamed.
+    :ivar numpy.ndarray branch_length: A float array of branch lengths, NaN
+        where missing.
+    :ivar list clades: Clade names from ``proto.metadata``, ``""`` if missing.
+    :ivar numpy.ndarray mutation_offsets: An int64 array of offsets such that
+        the mutations of node ``i`` are those in
+        ``range(mutation_offsets[i], mutation_offsets[i + 1])``.
+    :ivar numpy.ndarray position: An int32 array of mutation positions.
+    :ivar numpy.ndarray ref: An int8 array of reference nucleotides, indexing
+        :data:`NUCLEOTIDE`.
+    :ivar numpy.ndarray mut: An int8 array of mutated nucleotides, indexing
+        :attr:`alleles`.
+    :ivar list alleles: A string table of mutated nucleotides, typically
+        single nucleotides.
+    :ivar int cache_size: The maximum number of accumulated mutation sets to
+        memoize in :meth:`get_mutations`.
+    """
+
+    def __init__(
+        self,
+        parent,
+        names,
+        branch_length,
+        clades,
+        mutation_offsets,
+        position,
+        ref,
+        mut,
+        alleles,
+        *,
+        cache_size=1024,
+    ):
+        self.parent = np.asarray(parent, dtype=np.int32)
+        assert self.parent[0] == -1
+        assert (self.parent[1:] < np.arange(1, len(self.parent))).all()
+        self.children = np.argsort(self.parent[1:], kind="stable").astype(np.int32)
+        self.children += 1
+        self.child_offsets = np.zeros(len(self.parent) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.parent[1:], minlength=len(self.parent)),
+            out=self.child_offsets[1:],
+        )
+        self.names = names
+        self.branch_length = np.asarray(branch_length, dtype=np.float64)
+        self.clades = clades
+        self.mutation_offsets = np.asarray(mutation_offsets, dtype=np.int64)
+        self.position = np.asarray(position, dtype=np.int32)
+        self.ref = np.asarray(ref, dtype=np.int8)
+        self.mut = np.asarray(mut, dtype=np.int8)
+        self.alleles = alleles
+        self.cache_size = cache_size
+        self._mutation_cache: OrderedDict = OrderedDict()
+        assert len(names) == len(self.parent)
+        assert len(clades) == len(self.parent)
+        assert len(self.mutation_offsets) == len(self.parent) + 1
+
+    @staticmethod
+    def from_proto(proto, **kwargs) -> "MutationTree":
+        """
+        Creates a tree from a ``parsimony_pb2.data`` proto. Keyword arguments
+        are passed to the constructor.
+        """
+        newick = proto.newick.replace(";", "")  # work around unescaped node names
+        parent, names, branch_length = parse_newick(newick)
+        assert len(proto.metadata) == len(parent)
+        assert len(proto.node_mutations) == len(parent)
+        clades = [str(meta.clade) for meta in proto.metadata]
+
+        allele_ids = {(i,): i for i in range(len(NUCLEOTIDE))}
+        alleles = list(NUCLEOTIDE)
+        mutation_offsets = [0]
+        position = []
+        ref = []
+        mut = []
+        for muts in proto.node_mutations:
+            for m in muts.mutation:
+                position.append(m.position)
+                ref.append(m.ref_nuc)
+                key = tuple(m.mut_nuc)
+                allele_id = allele_ids.get(key)
+                if allele_id is None:
+                    allele_id = allele_ids[key] = len(alleles)
+                    alleles.append("".join(NUCLEOTIDE[n] for n in key))
+                mut.append(allele_id)
+            mutation_offsets.append(len(position))
+        return MutationTree(
+            parent,
+            names,
+            branch_length,
+            clades,
+            mutation_offsets,
+            position,
+            ref,
+            mut,
+            alleles,
+            **kwargs,
+        )
+
+    def __len__(self):
+        return len(self.parent)
+
+    def get_children(self, i: int) -> np.ndarray:
+        return self.children[self.child_offsets[i] : self.child_offsets[i + 1]]
+
+    def num_mutations(self) -> np.ndarray:
+        """
+        Returns an array of the number of mutations on each node.
+        """
+        return np.diff(self.mutation_offsets)
+
+    def nearest_ancestor(self, mask) -> np.ndarray:
+        """
+        Returns for each node the id of its nearest ancestor-or-self where
+        ``mask`` is true. The root must satisfy ``mask``.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        assert mask[0]
+        result = np.where(mask, np.arange(len(self)), self.parent)
+        while True:  # pointer jumping, taking log(depth) steps
+            jumped = result[result]
+            if np.array_equal(jumped, result):
+                return result
+            result = jumped
+
+    def get_node_mutations(self, i: int) -> List[Mutation]:
+        """
+        Returns the mutations on node ``i`` relative to its parent.
+        """
+        begin, end = self.mutation_offsets[i], self.mutation_offsets[i + 1]
+        return [
+            Mutation(p, NUCLEOTIDE[r], self.alleles[m])
+            for p, r, m in zip(
+                self.position[begin:end].tolist(),
+                self.ref[begin:end].tolist(),
+                self.mut[begin:end].tolist(),
+            )
+        ]
+
+    def get_mutations(self, node: int) -> FrozenSet[Mutation]:
+        """
+        Accumulates mutations from the root down to ``node``, where later
+        mutations at a position overwrite earlier ones.
+
+        Results are memoized in an LRU cache of :attr:`cache_size` nodes, and
+        accumulation starts from the nearest cached ancestor. Thus requesting
+        nodes in preorder, e.g. a lineage after its parent lineage, costs only
+        the mutations in between.
+        """
+        cache = self._mutation_cache
+        path = []
+        i = node
+        while i >= 0 and i not in cache:
+            path.append(i)
+            i = int(self.parent[i])
+        if not path:
+            cache.move_to_end(node)
+            return cache[node][1]
+        by_position: Dict[int, Mutation] = {}
+        if i >= 0:
+            cache.move_to_end(i)
+            by_position.update(cache[i][0])
+        for i in reversed(path):
+            for m in self.get_node_mutations(i):
+                by_position[m.position] = m
+        result = frozenset(by_position.values())
+        if self.cache_size > 0:
+            cache[node] = by_position, result
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return result
+
+    def to_newick(self) -> str:
+        return _format_newick(self.parent.tolist(), self.names, self.branch_length)
+
+
 def load_usher_clades(filename: str) -> Dict[str, Tuple[str, str]]:
     """
     Loads usher's output clades.txt and extracts the best lineage and a list of
@@ -53,46 +383,70 @@ def load_usher_clades(filename: str) -> Dict[str, Tuple[str, str]]:
     return clades
 
 
+class LineageMutations(Mapping):
+    """
+    A read-only mapping from clade names in a :class:`MutationTree` to their
+    accumulated sets of mutations. Sets are materialized only on access, and
+    iteration follows preorder so that consecutive sets share cached ancestors.
+    """
+
+    def __init__(self, tree: MutationTree):
+        self.tree = tree
+        self._nodes = {clade: i for i, clade in enumerate(tree.clades) if clade}
+
+    def __getitem__(self, clade: str) -> FrozenSet[Mutation]:
+        return self.tree.get_mutations(self._nodes[clade])
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+
+def _load_tree_cached(filename: str) -> Tuple[object, MutationTree]:
+    """
+    Loads a proto and its :class:`MutationTree`, reusing the results of
+    recent calls if the file has not changed since. Cached results are shared
+    between callers and must not be modified.
+    """
+    stat = os.stat(filename)
+    path = os.path.realpath(filename)
+    key = path, stat.st_mtime_ns, stat.st_size
+    result = _TREE_CACHE.pop(key, None)
+    if result is None:
+        for old_key in [k for k in _TREE_CACHE if k[0] == path]:
+            del _TREE_CACHE[old_key]  # stale
+        proto = read_proto(filename)
+        result = proto, MutationTree.from_proto(proto)
+    _TREE_CACHE[key] = result
+    while len(_TREE_CACHE) > TREE_CACHE_SIZE:
+        _TREE_CACHE.popitem(last=False)
+    return result
+
+
 def load_mutation_tree(
     filename: str,
-) -> Tuple[Dict[str, FrozenSet[Mutation]], object, object]:
+    *,
+    cache: bool = True,
+) -> Tuple[Mapping[str, FrozenSet[Mutation]], object, MutationTree]:
     """
     Loads an usher lineageTree.pb or lineageTree.pb.gz annotated with mutations
-    and pango lineages, and creates a mapping from lineages to their set of
-    mutations.
+    and pango lineages, and creates a lazy mapping from lineages to their set
+    of mutations.
+
+    :param str filename: The input filename.
+    :param bool cache: Whether to reuse the proto and tree from a previous
+        call on the same unmodified file. Cached results are shared and must
+        not be modified. The number of cached files is ``TREE_CACHE_SIZE``.
     """
     logger.info(f"Loading tree from {filename}")
-    proto, tree = load_proto(filename)
-
-    # Extract phylogenetic tree.
-    clades = list(tree.find_clades())
-    assert len(proto.metadata) == len(clades)
-    assert len(proto.node_mutations) == len(clades)
-
-    # Map lineages to clades.
-    lineage_to_clade = {
-        str(meta.clade): clade
-        for clade, meta in zip(clades, proto.metadata)
-        if meta and meta.clade
-    }
-
-    # Accumulate mutations in each clade, which are overwritten at each position.
-    logger.info(f"Accumulating mutations on {len(clades)} nodes")
-    clade_to_muts: Dict[object, Dict[int, Mutation]] = defaultdict(dict)
-    for clade, muts in zip(tqdm.tqdm(clades), proto.node_mutations):
-        for mut in muts.mutation:
-            clade_to_muts[clade][mut.position] = Mutation(
-                mut.position,
-                NUCLEOTIDE[mut.ref_nuc],
-                "".join(NUCLEOTIDE[n] for n in mut.mut_nuc),
-            )
-        for c in clade.clades:
-            clade_to_muts[c].update(clade_to_muts[clade])
-
-    mutations_by_lineage = {
-        k: frozenset(clade_to_muts[v].values()) for k, v in lineage_to_clade.items()
-    }
-    return mutations_by_lineage, proto, tree
+    if cache:
+        proto, tree = _load_tree_cached(filename)
+    else:
+        proto = read_proto(filename)
+        tree = MutationTree.from_proto(proto)
+    return LineageMutations(tree), proto, tree
 
 
 def refine_mutation_tree(filename_in: str, filename_out: str) -> Dict[str, str]:
@@ -102,55 +456,271 @@ def refine_mutation_tree(filename_in: str, filename_out: str) -> Dict[str, str]:
     with have a .clade attribute, all descendents will have metadata.clade ==
     "". The tree structure remains unchanged.
     """
-    proto, tree = load_proto(filename_in)
-
-    # Extract phylogenetic tree.
-    clades = list(tree.find_clades())
-    logger.info(f"Refining a tree with {len(clades)} nodes")
-    assert len(proto.metadata) == len(clades)
-    assert len(proto.node_mutations) == len(clades)
-    metadata = dict(zip(clades, proto.metadata))
-    mutations = dict(zip(clades, proto.node_mutations))
-
-    # Add refined clades, collapsing clones.
-    num_children: Dict[str, int] = defaultdict(int)
-    clade_to_fine = {clades[0]: "fine"}
-    fine_to_clade = {"fine": clades[0]}
-    for parent in clades:
-        parent_fine = clade_to_fine[parent]
-        for child in parent.clades:
-            if mutations[child].mutation:
-                # Create a new fine id.
-                n = num_children[parent_fine]
-                fine = f"{parent_fine}.{n - 1}" if n else parent_fine + "."
-                num_children[parent_fine] += 1
-                clade_to_fine[child] = fine
-                fine_to_clade[fine] = child
-            else:
-                # Collapse clone into parent.
-                clade_to_fine[child] = parent_fine
+    proto = read_proto(filename_in)
+    tree = MutationTree.from_proto(proto)
+    logger.info(f"Refining a tree with {len(tree)} nodes")
+
+    # Collapse clones into their basal ancestor, the nearest ancestor-or-self
+    # with mutations.
+    is_basal = tree.num_mutations() > 0
+    is_basal[0] = True
+    basal = tree.nearest_ancestor(is_basal)
+    children = np.flatnonzero(is_basal)[1:]
+    parents = basal[tree.parent[children]]
+
+    # Rank each basal child among children of the same basal parent, ordered
+    # by their actual parent and then by preorder.
+    order = np.lexsort((tree.parent[children], parents))
+    sorted_parents = parents[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = sorted_parents[1:] != sorted_parents[:-1]
+    first = np.maximum.accumulate(np.where(is_first, np.arange(len(order)), 0))
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order)) - first
+
+    # Add refined clades.
+    node_to_fine = {0: "fine"}
+    for child, parent, n in zip(children.tolist(), parents.tolist(), ranks.tolist()):
+        parent_fine = node_to_fine[parent]
+        node_to_fine[child] = f"{parent_fine}.{n - 1}" if n else parent_fine + "."
 
     # Save basal fine clades and the fine -> coarse mapping.
     fine_to_coarse = {}
-    for clade, meta in metadata.items():
-        fine = clade_to_fine[clade]
+    for i, (b, meta) in enumerate(zip(basal.tolist(), proto.metadata)):
+        fine = node_to_fine[b]
         if meta.clade and pangolin.is_pango_lineage(meta.clade):
             fine_to_coarse[fine] = pangolin.compress(meta.clade)
-        meta.clade = fine if clade is fine_to_clade[fine] else ""
+        meta.clade = fine if b == i else ""
     # Propagate basal clade metadata downward.
-    for parent in clades:
-        parent_coarse = fine_to_coarse[clade_to_fine[parent]]
-        for child in parent.clades:
-            fine_to_coarse.setdefault(clade_to_fine[child], parent_coarse)
+    for child, parent in zip(children.tolist(), parents.tolist()):
+        parent_coarse = fine_to_coarse[node_to_fine[parent]]
+        fine_to_coarse.setdefault(node_to_fine[child], parent_coarse)
 
     with open(filename_out, "wb") as f:
         f.write(proto.SerializeToString())
 
-    logger.info(f"Found {len(clades) - len(fine_to_coarse)} clones")
+    logger.info(f"Found {len(tree) - len(fine_to_coarse)} clones")
     logger.info(f"Refined {len(set(fine_to_coarse.values()))} -> {len(fine_to_coarse)}")
     return fine_to_coarse
 
 
+def _prune_greedy(parent, num_mutations, weights, nodes, num_pruned) -> List[int]:
+    """
+    Greedily prunes ``num_pruned`` of ``nodes`` with least loss
+    ``weights[i] * num_mutations[i]``, breaking ties by node id. When a node is
+    pruned its weight is added to its parent and its mutations are prepended
+    to its children.
+
+    :param list parent: The parent of each node.
+    :param list num_mutations: The number of mutations on each node.
+    :param list weights: The weight of each node, updated in-place.
+    :param list nodes: Candidate nodes, excluding the root. The parent of each
+        candidate must be a candidate or the root.
+    :param int num_pruned: The number of nodes to prune.
+    :returns: The pruned nodes, in order of pruning.
+    :rtype: list
+    """
+    # Each pruned node i links to its parent at the time of pruning, and
+    # extra[i] counts mutations on pruned nodes from i up to link[i].
+    link = list(range(len(parent)))
+    extra = [0] * len(parent)
+
+    def find(i):
+        # Returns the nearest unpruned ancestor-or-self of node i, together
+        # with the number of mutations on pruned nodes along the way.
+        path = []
+        while link[i] != i:
+            path.append(i)
+            i = link[i]
+        total = 0
+        for j in reversed(path):
+            total += extra[j]
+            link[j] = i
+            extra[j] = total
+        return i, total
+
+    def get_loss(i):
+        return weights[i] * (num_mutations[i] + find(parent[i])[1])
+
+    heap = [(weights[i] * num_mutations[i], i) for i in nodes]
+    heapq.heapify(heap)
+    pruned = []
+    for step in tqdm.tqdm(range(num_pruned)):
+        # Find the clade with lowest loss.
+        stale_loss, i = heapq.heappop(heap)
+        loss = get_loss(i)
+        while loss != stale_loss:
+            # Reinsert clades whose loss was stale.
+            stale_loss, i = heapq.heappushpop(heap, (loss, i))
+            loss = get_loss(i)
+
+        # Prune this clade.
+        p, pruned_mutations = find(parent[i])
+        weights[p] += weights[i]  # makes the parent loss stale
+        weights[i] = 0
+        link[i] = p
+        extra[i] = num_mutations[i] + pruned_mutations
+        pruned.append(i)
+    return pruned
+
+
+def _resolve_chains(parent, num_mutations, batch, position):
+    """
+    Resolves each node in ``batch`` to its nearest ancestor outside the
+    batch, and sums mutations along the way including the node itself.
+    ``position`` maps nodes in ``batch`` to their positions and others to -1.
+    """
+    up = parent[batch]
+    chain_mutations = num_mutations[batch]
+    while True:  # pointer jumping, taking log(depth) steps
+        link = position[up]
+        linked = np.flatnonzero(link >= 0)
+        if not len(linked):
+            return up, chain_mutations
+        chain_mutations[linked] += chain_mutations[link[linked]]
+        up[linked] = up[link[linked]]
+
+
+def _prune_batched(
+    parent, num_mutations, weights, num_pruned, min_batch_fraction=0.01
+) -> List[int]:
+    """
+    Computes the same result as :func:`_prune_greedy` over all non-root
+    nodes, but prunes nodes in vectorized batches.
+
+    Pruning a node can only increase the losses of its parent (by adding its
+    weight) and of its children (by adding its mutations). Hence the greedy
+    algorithm prunes nodes in order of current loss, until it reaches a node
+    whose loss was changed by a node pruned earlier in that order. This
+    happens only when a node and its parent are both in that prefix and the
+    node has nonzero weight, since zero-weight nodes have zero loss and
+    transfer no weight. Each round prunes that maximal prefix at once and
+    then updates weights, parents and mutation counts in a single pass. Once
+    batches become small relative to the remaining tree (or if losses are
+    NaN, which the heap orders arbitrarily), this falls back to
+    :func:`_prune_greedy`.
+
+    :returns: The pruned nodes.
+    :rtype: list
+    """
+    parent = np.array(parent, dtype=np.int64)
+    num_mutations = np.array(num_mutations, dtype=np.int64)
+    weights = np.array(weights, dtype=np.float64)
+    alive = np.arange(1, len(parent))  # don't prune the root
+    is_pruned = np.zeros(len(parent), dtype=bool)
+    position = np.full(len(parent), -1)
+    pruned = []
+    while num_pruned > 0:
+        with np.errstate(invalid="ignore"):
+            loss = weights[alive] * num_mutations[alive]
+        if np.isnan(loss).any():
+            break
+
+        # Find the num_pruned least (loss, node) pairs.
+        if num_pruned < len(alive):
+            threshold = np.partition(loss, num_pruned - 1)[num_pruned - 1]
+            below = np.flatnonzero(loss < threshold)
+            tied = np.flatnonzero(loss == threshold)
+            candidates = np.concatenate([below, tied[: num_pruned - len(below)]])
+        else:
+            candidates = np.arange(len(alive))
+        order = np.lexsort((alive[candidates], loss[candidates]))
+        batch = alive[candidates[order]]
+
+        # Truncate at the first node whose loss depends on an earlier node.
+        position[batch] = np.arange(len(batch))
+        parent_position = position[parent[batch]]
+        position[batch] = -1
+        conflict = np.flatnonzero((parent_position >= 0) & (weights[batch] != 0))
+        if len(conflict):
+            end = np.maximum(conflict, parent_position[conflict]).min()
+            batch = batch[:end]
+        is_pruned[batch] = True
+
+        # Resolve chains of pruned nodes to their nearest unpruned ancestor,
+        # accumulating mutations along the way.
+        position[batch] = np.arange(len(batch))
+        up, chain_mutations = _resolve_chains(parent, num_mutations, batch, position)
+
+        # Only zero weights flow along chains, so adding weights directly to
+        # the nearest unpruned ancestor in pruning order matches greedy.
+        np.add.at(weights, up, weights[batch])
+        weights[batch] = 0
+        alive = alive[~is_pruned[alive]]
+        orphans = alive[is_pruned[parent[alive]]]
+        link = position[parent[orphans]]
+        position[batch] = -1
+        num_mutations[orphans] += chain_mutations[link]
+        parent[orphans] = up[link]
+        pruned.append(batch)
+        num_pruned -= len(batch)
+        if len(batch) < min_batch_fraction * len(alive):
+            break
+
+    pruned = np.concatenate(pruned).tolist() if pruned else []
+    if num_pruned > 0:
+        logger.info(f"Greedily pruning the remaining {num_pruned} nodes")
+        pruned += _prune_greedy(
+            parent.tolist(),
+            num_mutations.tolist(),
+            weights.tolist(),
+            alive.tolist(),
+            num_pruned,
+        )
+    return pruned
+
+
+def _get_node_weights(tree: MutationTree, weights: Optional[Dict[str, int]]):
+    if weights is None:
+        return [1] * len(tree)
+    name_set = {clade for clade in tree.clades if clade}
+    assert set(weights).issubset(name_set)
+    old_weights = weights.copy()
+    node_weights = [old_weights.pop(c, 0) if c else 0 for c in tree.clades]
+    assert not old_weights, list(old_weights)
+    return node_weights
+
+
+def _restrict_proto(proto, tree: MutationTree, kept: np.ndarray):
+    """
+    Creates a proto restricted to the ``kept`` nodes of ``tree``, prepending
+    mutations of pruned ancestors to each remaining node.
+    """
+    keep = np.flatnonzero(kept)
+    parent = tree.parent.tolist()
+
+    # Prepend mutations of pruned ancestors to each remaining node, ordered so
+    # as to be compatible with reversions.
+    node_mutations = []
+    for i in keep.tolist():
+        mutations = parsimony_pb2.mutation_list()  # type: ignore
+        ancestors = []
+        a = parent[i]
+        while a >= 0 and not kept[a]:
+            ancestors.append(a)
+            a = parent[a]
+        for a in reversed(ancestors):
+            mutations.mutation.extend(proto.node_mutations[a].mutation)
+        mutations.mutation.extend(proto.node_mutations[i].mutation)
+        node_mutations.append(mutations)
+
+    # Create the pruned proto. Since the pruned tree's nodes are a subset of
+    # the original preorder, they remain in preorder.
+    new_id = np.full(len(tree), -1, dtype=np.int64)
+    new_id[keep] = np.arange(len(keep))
+    new_parent = new_id[tree.nearest_ancestor(kept)[tree.parent[keep[1:]]]]
+    result = parsimony_pb2.data()  # type: ignore
+    result.newick = _format_newick(
+        [-1] + new_parent.tolist(),
+        [tree.names[i] for i in keep.tolist()],
+        tree.branch_length[keep],
+    )
+    result.node_mutations.extend(node_mutations)
+    result.condensed_nodes.extend(proto.condensed_nodes)
+    result.metadata.extend(proto.metadata[i] for i in keep.tolist())
+    return result
+
+
 def prune_mutation_tree(
     filename_in: str,
     filename_out: str,
@@ -163,80 +733,64 @@ def prune_mutation_tree(
 
         value(node) = num_mutations(node) * weights(node)
 
+    Nodes are pruned in vectorized batches, with the same result as pruning
+    one at a time; see :func:`_prune_batched`.
+
     Returns a restricted set of clade names.
     """
-    proto, tree = load_proto(filename_in)
-    num_pruned = len(proto.node_mutations) - max_num_nodes
-    if num_pruned < 0:
+    proto, tree = _load_tree_cached(filename_in)
+    if len(proto.node_mutations) < max_num_nodes:
         shutil.copyfile(filename_in, filename_out)
-        return {m.clade for m in proto.node_metadata if m.clade}
-
-    # Extract phylogenetic tree.
-    clades = list(tree.find_clades())
-    logger.info(f"Pruning {num_pruned}/{len(clades)} nodes")
-    assert len(clades) == len(set(clades))
-    clade_to_id = {c: i for i, c in enumerate(clades)}
-    assert len(proto.metadata) == len(clades)
-    assert len(proto.node_mutations) == len(clades)
-    metadata = dict(zip(clades, proto.metadata))
-    mutations = dict(zip(clades, proto.node_mutations))
-    name_set = {m.clade for m in proto.metadata if m.clade}
-
-    # Initialize weights and topology.
-    if weights is None:
-        weights = {c: 1 for c in clades}
-    else:
-        assert set(weights).issubset(name_set)
-        old_weights = weights.copy()
-        weights = {}
-        for c, m in metadata.items():
-            weights[c] = old_weights.pop(m.clade, 0) if m.clade else 0
-        assert not old_weights, list(old_weights)
-    parents = {c: parent for parent in clades for c in parent.clades}
-    assert tree.root not in parents
-
-    def get_loss(clade):
-        return weights[clade] * len(mutations[clade].mutation)
-
-    # Greedily prune nodes.
-    heap = [(get_loss(c), clade_to_id[c]) for c in clades[1:]]  # don't prune the root
-    heapq.heapify(heap)
-    for step in tqdm.tqdm(range(num_pruned)):
-        # Find the clade with lowest loss.
-        stale_loss, i = heapq.heappop(heap)
-        clade = clades[i]
-        loss = get_loss(clade)
-        while loss != stale_loss:
-            # Reinsert clades whose loss was stale.
-            stale_loss, i = heapq.heappushpop(heap, (loss, i))
-            clade = clades[i]
-            loss = get_loss(clade)
+        return {m.clade for m in proto.metadata if m.clade}
+    filenames_out = {max_num_nodes: filename_out}
+    result = prune_mutation_tree_multi(proto, filenames_out, weights, tree=tree)
+    return result[max_num_nodes]
 
-        # Prune this clade.
-        parent = parents.pop(clade)
-        weights[parent] += weights.pop(clade, 0)  # makes the parent loss stale
-        parent.clades.remove(clade)
-        parent.clades.extend(clade.clades)
-        mutation = list(mutations.pop(clade).mutation)
-        for child in clade.clades:
-            parents[child] = parent
-            m = mutations[child].mutation
-            cat = mutation + list(m)  # order so as to be compatible with reversions
-            del m[:]
-            m.extend(cat)
-    clades = list(tree.find_clades())
-    assert len(clades) == max_num_nodes
-
-    # Create the pruned proto.
-    proto.newick = next(iter(Writer([tree]).to_strings()))
-    del proto.metadata[:]
-    del proto.node_mutations[:]
-    proto.metadata.extend(metadata[clade] for clade in clades)
-    proto.node_mutations.extend(mutations[clade] for clade in clades)
-    with open(filename_out, "wb") as f:
-        f.write(proto.SerializeToString())
 
-    return {metadata[clade].clade for clade in clades if metadata[clade].clade}
+def prune_mutation_tree_multi(
+    proto,
+    filenames_out: Dict[int, str],
+    weights: Optional[Dict[str, int]] = None,
+    *,
+    tree: Optional[MutationTree] = None,
+) -> Dict[int, Set[str]]:
+    """
+    Condenses a mutation tree to each of multiple sizes in a single pass.
+
+    Since losses only increase as nodes are pruned, greedy pruning is nested:
+    the tree with ``N`` nodes is an intermediate state on the way to any
+    smaller tree. This prunes once down to the smallest size and snapshots
+    the larger trees along the way, with the same results as calling
+    :func:`prune_mutation_tree` once per size.
+
+    :param proto: An usher proto, e.g. loaded by :func:`read_proto`.
+    :param dict filenames_out: A dict mapping each ``max_num_nodes`` to an
+        output filename.
+    :param dict weights: An optional dict mapping clade name to weight.
+    :param MutationTree tree: An optional tree previously created from
+        ``proto``, to avoid recreating it.
+    :returns: A dict mapping each ``max_num_nodes`` to a restricted set of
+        clade names.
+    :rtype: dict
+    """
+    if tree is None:
+        tree = MutationTree.from_proto(proto)
+    num_pruned = max(0, len(tree) - min(filenames_out))
+    logger.info(f"Pruning {num_pruned}/{len(tree)} nodes")
+    pruned = _prune_batched(
+        tree.parent, tree.num_mutations(), _get_node_weights(tree, weights), num_pruned
+    )
+
+    result = {}
+    for max_num_nodes, filename_out in sorted(filenames_out.items(), reverse=True):
+        kept = np.ones(len(tree), dtype=bool)
+        kept[pruned[: max(0, len(tree) - max_num_nodes)]] = False
+        pruned_proto = _restrict_proto(proto, tree, kept)
+        assert len(pruned_proto.node_mutations) == min(len(tree), max_num_nodes)
+        with open(filename_out, "wb") as f:
+            f.write(pruned_proto.SerializeToString())
+        result[max_num_nodes] = {m.clade for m in pruned_proto.metadata if m.clade}
+    return result
 
 
 def apply_mutations(ref: str, mutations: FrozenSet[Mutation]) -> str:
@@ -1,17 +1,21 @@
 # Copyright Contributors to the Pyro-Cov project.
 # SPDX-License-Identifier: Apache-2.0
 
+import contextlib
 import functools
 import gzip
 import itertools
 import operator
 import os
+import queue
+import threading
 import weakref
-from typing import Dict
+from typing import Dict, Optional, Union
 
 import pyro
 import torch
 import tqdm
+from pyro.ops.streaming import StreamingStats
 from torch.distributions import constraints, transform_to
 
 
@@ -53,6 +57,154 @@ def quotient_central_moments(
     return moments
 
 
+class BatchMeanVarianceStats(StreamingStats):
+    """
+    Statistic tracking the count, mean, and elementwise variance of a single
+    :class:`torch.Tensor`, like
+    :class:`~pyro.ops.streaming.CountMeanVarianceStats` but additionally
+    supporting batched updates via :meth:`update_batch`, which combines a
+    whole batch with Chan et al.'s parallel variant of Welford's algorithm.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, sample: torch.Tensor) -> None:
+        sample = sample.detach()
+        if self.mean is None:
+            self.mean = torch.zeros_like(sample)
+            self.m2 = torch.zeros_like(sample)
+        self.count += 1
+        delta = sample - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (sample - self.mean)
+
+    def update_batch(self, samples: torch.Tensor) -> None:
+        """
+        Updates with a batch of samples along the leftmost dimension.
+        """
+        samples = samples.detach()
+        other = BatchMeanVarianceStats()
+        other.count = len(samples)
+        other.mean = samples.mean(0)
+        other.m2 = (samples - other.mean).square_().sum(0)
+        self._merge_(other)
+
+    def _merge_(self, other: "BatchMeanVarianceStats") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.clone()
+            self.m2 = other.m2.clone()
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * (other.count / count)
+        self.m2 += other.m2 + delta.square_() * (self.count * other.count / count)
+        self.count = count
+
+    def merge(self, other: "BatchMeanVarianceStats") -> "BatchMeanVarianceStats":
+        assert isinstance(other, type(self))
+        result = BatchMeanVarianceStats()
+        result._merge_(self)
+        result._merge_(other)
+        return result
+
+    def get(self) -> Dict[str, Union[int, torch.Tensor]]:
+        """
+        :returns: A dictionary with keys ``count: int`` and (if any samples
+            have been collected) ``mean: torch.Tensor`` and ``variance:
+            torch.Tensor``.
+        :rtype: dict
+        """
+        if self.count == 0:
+            return {"count": 0}
+        variance = self.m2 / (self.count - 1)
+        return {"count": self.count, "mean": self.mean, "variance": variance}
+
+
+class ReservoirQuantileStats(StreamingStats):
+    """
+    Statistic sketching elementwise quantiles of a single
+    :class:`torch.Tensor` by keeping a uniform reservoir sample of at most
+    ``size`` samples, so that memory is bounded regardless of the number of
+    updates. Quantile estimates have error ``O(1 / sqrt(size))``.
+
+    :param int size: The maximum number of samples to keep.
+    :param tuple quantiles: The quantiles to compute in :meth:`get`.
+    """
+
+    def __init__(self, size=100, quantiles=(0.05, 0.5, 0.95)):
+        assert size > 0
+        self.size = size
+        self.quantiles = tuple(quantiles)
+        self.count = 0
+        self.reservoir = None
+
+    def update(self, sample: torch.Tensor) -> None:
+        self.update_batch(sample[None])
+
+    def update_batch(self, samples: torch.Tensor) -> None:
+        """
+        Updates with a batch of samples along the leftmost dimension.
+        """
+        samples = samples.detach()
+        if self.reservoir is None:
+            self.reservoir = samples.new_empty((self.size,) + samples.shape[1:])
+        # Apply Vitter's Algorithm R, drawing all slots at once.
+        counts = torch.arange(self.count + 1, self.count + 1 + len(samples))
+        slots = (torch.rand(len(samples)) * counts).long()
+        num_fill = max(0, min(len(samples), self.size - self.count))
+        slots[:num_fill] = counts[:num_fill] - 1
+        for i in (slots < self.size).nonzero(as_tuple=True)[0].tolist():
+            self.reservoir[slots[i]] = samples[i]
+        self.count += len(samples)
+
+    def merge(self, other: "ReservoirQuantileStats") -> "ReservoirQuantileStats":
+        assert isinstance(other, type(self))
+        assert other.size == self.size and other.quantiles == self.quantiles
+        result = ReservoirQuantileStats(self.size, self.quantiles)
+        parts = [s for s in (self, other) if s.count]
+        if not parts:
+            return result
+        # Subsample the union, weighting items by the counts they represent.
+        samples = torch.cat([s.reservoir[: min(s.count, s.size)] for s in parts])
+        weights = torch.cat(
+            [
+                torch.full((min(s.count, s.size),), s.count / min(s.count, s.size))
+                for s in parts
+            ]
+        )
+        num_kept = min(self.size, len(samples))
+        index = torch.multinomial(weights, num_kept, replacement=False)
+        result.reservoir = samples.new_empty((self.size,) + samples.shape[1:])
+        result.reservoir[:num_kept] = samples[index]
+        result.count = sum(s.count for s in parts)
+        return result
+
+    def get(self) -> Dict[str, Union[int, torch.Tensor]]:
+        """
+        :returns: A dictionary with keys ``count: int`` and (if any samples
+            have been collected) ``quantiles: torch.Tensor`` of shape
+            ``(len(quantiles),) + sample.shape``.
+        :rtype: dict
+        """
+        if self.count == 0:
+            return {"count": 0}
+        n = min(self.count, self.size)
+        samples = self.reservoir[:n].sort(0).values
+        # Linearly interpolate between order statistics.
+        pos = torch.tensor(self.quantiles, dtype=torch.double) * (n - 1)
+        lo = pos.floor().long()
+        hi = pos.ceil().long()
+        frac = (pos - lo).to(samples.dtype).reshape((-1,) + (1,) * (samples.dim() - 1))
+        quantiles = samples[lo] + (samples[hi] - samples[lo]) * frac
+        return {"count": self.count, "quantiles": quantiles}
+
+
 def weak_memoize_by_id(fn):
     cache = {}
     missing = object()  # An arbitrary value that cannot be returned by fn.
@@ -130,6 +282,55 @@ def _torch_map_iterable(x, **kwargs):
     return (result, True) if changed else (x, False)
 
 
+class CheckpointWriter:
+    """
+    Writes checkpoints atomically in a background thread.
+
+    Each call to :meth:`save` copies tensors to the cpu, then a background
+    thread writes them via :func:`torch.save` to a temporary file that is
+    renamed over ``filename``. Readers thus see either a previous or a new
+    complete checkpoint, never a partial one. At most one write is in
+    flight, and errors raised while writing are re-raised by the next call
+    to :meth:`save` or :meth:`wait`.
+
+    :param str filename: The checkpoint filename.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def save(self, state) -> None:
+        """
+        Snapshots a nested data structure ``state`` and writes it in the
+        background, after waiting for any previous write.
+        """
+        self.wait()
+        state = torch_map(state, device="cpu", copy=True)
+        self._thread = threading.Thread(target=self._write, args=(state,))
+        self._thread.start()
+
+    def wait(self) -> None:
+        """
+        Waits for any write in flight, re-raising its error if it failed.
+        """
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write(self, state):
+        tmp = self.filename + ".tmp"
+        try:
+            torch.save(state, tmp)
+            os.replace(tmp, self.filename)
+        except BaseException as e:
+            self._error = e
+
+
 def pretty_print(x, *, name="", max_items=10):
     if isinstance(x, (int, float, str, bool)):
         print(f"{name} = {repr(x)}")
@@ -176,7 +377,79 @@ def open_tqdm(*args, **kwargs):
                 yield line
 
 
-def gzip_open_tqdm(filename, mode="rb"):
+def _prefetch(iterator, max_size):
+    """
+    Evaluates an iterator in a background thread, buffering up to
+    ``max_size`` items ahead of the consumer.
+    """
+    q: queue.Queue = queue.Queue(max_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in iterator:
+                if not put((True, item)):
+                    return
+        except BaseException as e:
+            put((False, e))
+        else:
+            put((False, None))
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, item = q.get()
+            if not ok:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _gzip_blocks(f, g, block_size):
+    while True:
+        lines = g.readlines(block_size)
+        if not lines:
+            return
+        yield f.tell(), lines
+
+
+def gzip_open_tqdm(
+    filename,
+    mode="rb",
+    *,
+    blocks=False,
+    block_size=2**20,
+    threaded=False,
+    max_blocks=8,
+):
+    """
+    Iterates over lines of a gzipped file while displaying a progress bar.
+
+    :param str filename: The input filename.
+    :param str mode: Either "rb" or "rt".
+    :param bool blocks: Whether to yield lists of lines of about
+        ``block_size`` decompressed bytes, rather than single lines.
+    :param int block_size: The approximate size of blocks read at a time.
+        Larger blocks amortize per-line overhead.
+    :param bool threaded: Whether to decompress in a background thread,
+        overlapping decompression with the caller's parsing.
+    :param int max_blocks: The maximum number of blocks that the background
+        thread may decompress ahead of the caller.
+    """
     with open(filename, "rb") as f, gzip.open(f, mode) as g:
         with tqdm.tqdm(
             total=os.stat(f.fileno()).st_size,
@@ -185,7 +458,21 @@ def gzip_open_tqdm(filename, mode="rb"):
             unit_divisor=1024,
             smoothing=0,
         ) as pbar:
-            for line in g:
-                pbar.n = f.tell()
-                pbar.update(0)
-                yield line
+            if not (blocks or threaded):
+                for line in g:
+                    pbar.n = f.tell()
+                    pbar.update(0)
+                    yield line
+                return
+
+            reader = _gzip_blocks(f, g, block_size)
+            if threaded:
+                reader = _prefetch(reader, max_blocks)
+            with contextlib.closing(reader):
+                for pos, lines in reader:
+                    pbar.n = pos
+                    pbar.update(0)
+                    if blocks:
+                        yield lines
+                    else:
+                        yield from lines
@@ -0,0 +1,520 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Benchmarks of data loading and preprocessing on synthetic data.
+
+Usage::
+
+    python scripts/benchmark.py load_gisaid_data --num-rows=10000000
+"""
+
+import argparse
+import datetime
+import functools
+import gzip
+import logging
+import os
+import pickle
+import random
+import re
+import shutil
+import tempfile
+import tracemalloc
+from timeit import default_timer
+
+import pandas as pd
+import pyro
+import torch
+from Bio.Phylo.BaseTree import Tree
+from Bio.Phylo.Newick import Clade
+from Bio.Phylo.NewickIO import Parser, Writer
+from pyro.infer import SVI, Trace_ELBO
+from pyro.optim import ClippedAdam
+
+from pyrocov import columnar, geo, mutrans, usher
+from pyrocov.external.usher import parsimony_pb2
+from pyrocov.inference import CompiledTrace_ELBO, make_guide
+from pyrocov.util import gzip_open_tqdm
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format="%(relativeCreated) 9d %(message)s", level=logging.INFO)
+
+BENCHMARKS = {}
+
+
+def benchmark(fn):
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def timed(name, fn, *args, **kwargs):
+    start = default_timer()
+    result = fn(*args, **kwargs)
+    elapsed = default_timer() - start
+    logger.info(f"{name} took {elapsed:0.3g} sec")
+    return result, elapsed
+
+
+def make_usher_data(args, dirname):
+    """
+    Writes synthetic columns and features files with realistic cardinalities.
+    """
+    logger.info(f"Generating {args.num_rows} synthetic rows")
+    rng = random.Random(args.seed)
+    clades = [f"fine.{i}" for i in range(args.num_clades)]
+    lineages = [f"B.1.{i}" for i in range((args.num_clades + 2) // 3)]
+    clade_to_lineage = {c: lineages[i // 3] for i, c in enumerate(clades)}
+    lineage_to_clade = {lineage: clades[3 * i] for i, lineage in enumerate(lineages)}
+    locations = []
+    for country in range(args.num_places // 10):
+        locations.append(f"Region / Country{country}")
+        for state in range(9):
+            locations.append(f"Region / Country{country} / State{state}")
+    clade_weights = [1 / (1 + i) for i in range(len(clades))]
+    location_weights = [1 / (1 + i) ** 0.5 for i in range(len(locations))]
+    columns = {
+        "day": [rng.randrange(args.num_days) for _ in range(args.num_rows)],
+        "location": rng.choices(locations, location_weights, k=args.num_rows),
+        "clade": rng.choices(clades, clade_weights, k=args.num_rows),
+    }
+    features = {
+        "clades": clades,
+        "clade_to_lineage": clade_to_lineage,
+        "lineage_to_clade": lineage_to_clade,
+        "aa_mutations": [f"S:A{i}B" for i in range(args.num_mutations)],
+        "aa_features": torch.rand(len(clades), args.num_mutations) < 0.05,
+    }
+    columns_filename = os.path.join(dirname, "columns.pkl")
+    features_filename = os.path.join(dirname, "features.pt")
+    with open(columns_filename, "wb") as f:
+        pickle.dump(columns, f)
+    torch.save(features, features_filename)
+    return {
+        "columns_filename": columns_filename,
+        "features_filename": features_filename,
+    }
+
+
+@benchmark
+def load_gisaid_data(args):
+    """
+    Compares sequential vs vectorized row aggregation in load_gisaid_data().
+    """
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = make_usher_data(args, dirname)
+        kwargs = dict(include={"location": "^Region"}, exclude={"clade": r"\.7$"})
+        results = {}
+        for vectorize in [False, True]:
+            name = "vectorized" if vectorize else "sequential"
+            results[name] = timed(
+                name,
+                mutrans.load_gisaid_data,
+                vectorize=vectorize,
+                **filenames,
+                **kwargs,
+            )
+        seq, seq_time = results["sequential"]
+        vec, vec_time = results["vectorized"]
+        assert torch.equal(seq["weekly_clades"], vec["weekly_clades"])
+        logger.info(f"end-to-end speedup = {seq_time / vec_time:0.3g}x")
+
+        # Time only the aggregation step.
+        with open(filenames["columns_filename"], "rb") as f:
+            columns = pickle.load(f)
+        fine_regions = mutrans.get_fine_regions(columns, 50)
+        clade_id = {c: i for i, c in enumerate(seq["clade_id_inv"])}
+        agg_args = columns, clade_id, fine_regions, kwargs["include"], kwargs["exclude"]
+        _, seq_time = timed(
+            "sequential aggregation", mutrans._aggregate_rows, *agg_args, None
+        )
+        _, vec_time = timed(
+            "vectorized aggregation",
+            mutrans._aggregate_rows_vectorized,
+            *agg_args,
+            None,
+        )
+        logger.info(f"aggregation speedup = {seq_time / vec_time:0.3g}x")
+
+
+@benchmark
+def load_columns(args):
+    """
+    Compares loading pickled vs columnar columns, in time and peak memory.
+    """
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = make_usher_data(args, dirname)
+        pkl_filename = filenames["columns_filename"]
+        columnar_dirname = columnar.convert_columns(pkl_filename)
+        stats = {}
+        for name, filename in [
+            ("pickle", pkl_filename),
+            ("columnar", columnar_dirname),
+        ]:
+            tracemalloc.start()
+            columns, elapsed = timed(
+                f"{name} load_columns", columnar.load_columns, filename
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            logger.info(f"{name} load_columns peak memory {peak / 2**20:0.1f} MB")
+            del columns
+            _, load_time = timed(
+                f"{name} load_gisaid_data",
+                mutrans.load_gisaid_data,
+                columns_filename=filename,
+                features_filename=filenames["features_filename"],
+            )
+            stats[name] = elapsed, peak, load_time
+        (pkl_time, pkl_peak, pkl_load), (col_time, col_peak, col_load) = stats.values()
+        logger.info(
+            f"load_columns speedup = {pkl_time / col_time:0.3g}x, "
+            f"memory reduction = {pkl_peak / col_peak:0.3g}x, "
+            f"load_gisaid_data speedup = {pkl_load / col_load:0.3g}x"
+        )
+
+
+@benchmark
+def end_day_views(args):
+    """
+    Compares repeated load_gisaid_data(end_day=...) calls as in backtesting
+    vs deriving each end_day dataset from a single GisaidEndDayViews.
+    """
+    end_days = list(range(150, args.num_days, 14))
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = make_usher_data(args, dirname)
+        filenames["columns_filename"] = columnar.convert_columns(
+            filenames["columns_filename"]
+        )
+
+        def load_each():
+            for end_day in end_days:
+                mutrans.load_gisaid_data(end_day=end_day, **filenames)
+
+        def load_views():
+            views = mutrans.GisaidEndDayViews(**filenames)
+            for end_day in end_days:
+                views(end_day)
+
+        logger.info(f"Loading {len(end_days)} end_days")
+        _, each_time = timed("repeated load_gisaid_data", load_each)
+        _, views_time = timed("GisaidEndDayViews", load_views)
+        logger.info(f"speedup = {each_time / views_time:0.3g}x")
+
+
+def make_metadata(args, filename):
+    """
+    Writes a synthetic usher metadata.tsv with realistic cardinalities.
+    """
+    logger.info(f"Generating {args.num_rows} synthetic metadata rows")
+    rng = random.Random(args.seed)
+    start = datetime.date(2019, 12, 1)
+    dates = [str(start + datetime.timedelta(days=d)) for d in range(args.num_days)]
+    dates += [d[:7] for d in dates[::30]] + ["?", "2021"]
+    prefixes = ["England", "Wales", "Scotland", "China", "USA", "Japan", "India"]
+    lineages = [f"B.1.{i}" for i in range(args.num_clades // 3)] + ["?"]
+    with open(filename, "w") as f:
+        f.write("strain\tgenbank_accession\tdate\tpangolin_lineage\n")
+        for i in range(args.num_rows):
+            strain = f"{rng.choice(prefixes)}/X-{i}/2021|MW{i}.1"
+            date = rng.choice(dates)
+            lineage = rng.choice(lineages)
+            f.write(f"{strain}\tMW{i}.1\t{date}\t{lineage}\n")
+
+
+@benchmark
+def parse_metadata(args):
+    """
+    Compares per-row vs vectorized date and location parsing of metadata.
+    """
+    import preprocess_usher
+
+    start_date = datetime.datetime(2019, 12, 1)
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "metadata.tsv")
+        make_metadata(args, filename)
+        df = pd.read_csv(filename, sep="\t", dtype=str)
+
+        def parse_rows():
+            for row in df.itertuples():
+                date = preprocess_usher.try_parse_date(row.date)
+                if date is not None:
+                    max(0, (date - start_date).days)
+                prefix = re.split(r"[/|_]", row.strain)[0]
+                location = preprocess_usher.USHER_LOCATIONS.get(prefix)
+                if location is not None:
+                    geo.gisaid_normalize(location)
+
+        def parse_columns():
+            preprocess_usher.try_parse_days(df["date"], start_date)
+            prefixes = df["strain"].str.extract(r"^([^/|_]*)", expand=False)
+            geo.gisaid_normalize_column(prefixes.map(preprocess_usher.USHER_LOCATIONS))
+
+        _, rows_time = timed("per-row parsing", parse_rows)
+        _, columns_time = timed("vectorized parsing", parse_columns)
+        logger.info(
+            f"per-row {len(df) / rows_time:0.3g} rows/sec, "
+            f"vectorized {len(df) / columns_time:0.3g} rows/sec, "
+            f"speedup = {rows_time / columns_time:0.3g}x"
+        )
+
+
+@benchmark
+def gzip_lines(args):
+    """
+    Compares line throughput of gzip_open_tqdm() with and without blocks
+    and background decompression, with and without per-line parsing.
+    """
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, "metadata.tsv")
+        make_metadata(args, filename)
+        with open(filename, "rb") as f, gzip.open(filename + ".gz", "wb") as g:
+            shutil.copyfileobj(f, g)
+        filename += ".gz"
+
+        for parse in [False, True]:
+            for kwargs in [
+                {},
+                {"threaded": True},
+                {"blocks": True},
+                {"blocks": True, "threaded": True},
+            ]:
+                name = ", ".join(f"{k}={v}" for k, v in kwargs.items()) or "default"
+                if parse:
+                    name += ", parse"
+
+                def read():
+                    num_lines = 0
+                    reader = gzip_open_tqdm(filename, "rt", **kwargs)
+                    for block in (
+                        reader if kwargs.get("blocks") else ([x] for x in reader)
+                    ):
+                        num_lines += len(block)
+                        if parse:
+                            for line in block:
+                                line.strip().split("\t")
+                    return num_lines
+
+                num_lines, elapsed = timed(name, read)
+                logger.info(f"{name}: {num_lines / elapsed:0.3g} lines/sec")
+
+
+def make_nextstrain_metadata(args, filename):
+    """
+    Writes a synthetic nextstrain metadata.tsv.gz with realistic cardinalities.
+    """
+    logger.info(f"Generating {args.num_rows} synthetic nextstrain rows")
+    rng = random.Random(args.seed)
+    start = datetime.date(2019, 12, 1)
+    dates = [str(start + datetime.timedelta(days=d)) for d in range(args.num_days)]
+    dates += ["2021-05", "?"]
+    countries = [f"Country{i}" for i in range(args.num_places // 10)]
+    divisions = [f"State{i}" for i in range(9)] + ["?"]
+    lineages = [f"B.1.{i}" for i in range(args.num_clades)] + ["?"]
+    aa = [f"S:A{i}B" for i in range(args.num_mutations)]
+    lineage_aa = {
+        lineage: [",".join(rng.sample(aa, 20)) for _ in range(3)]
+        for lineage in lineages
+    }
+    lineage_weights = [1 / (1 + i) for i in range(len(lineages))]
+    with gzip.open(filename, "wt") as f:
+        f.write("strain\tdate\tcountry\tdivision\tpango_lineage\taaSubstitutions\n")
+        row_lineages = rng.choices(lineages, lineage_weights, k=args.num_rows)
+        for i, lineage in enumerate(row_lineages):
+            f.write(
+                f"X-{i}\t{rng.choice(dates)}\t{rng.choice(countries)}\t"
+                f"{rng.choice(divisions)}\t{lineage}\t"
+                f"{rng.choice(lineage_aa[lineage])}\n"
+            )
+
+
+@benchmark
+def preprocess_nextstrain(args):
+    """
+    Compares per-row vs vectorized construction of counts and features in
+    preprocess_nextstrain.py.
+    """
+    import preprocess_nextstrain
+
+    with tempfile.TemporaryDirectory() as dirname:
+        pp_args = argparse.Namespace(
+            metadata_file_in=os.path.join(dirname, "metadata.tsv.gz"),
+            columns_file_out=os.path.join(dirname, "columns.pkl"),
+            stats_file_out=os.path.join(dirname, "stats.pkl"),
+            features_file_out=os.path.join(dirname, "features.pt"),
+            dataset_file_out=os.path.join(dirname, "data.pt"),
+            start_date=datetime.datetime(2019, 12, 1),
+            time_step_days=14,
+            min_region_size=50,
+        )
+        make_nextstrain_metadata(args, pp_args.metadata_file_in)
+        timed("preprocess_nextstrain.main", preprocess_nextstrain.main, pp_args)
+        with open(pp_args.columns_file_out, "rb") as f:
+            columns = pickle.load(f)
+        with open(pp_args.stats_file_out, "rb") as f:
+            stats = pickle.load(f)
+        features = torch.load(pp_args.features_file_out)
+    lineages = features["lineages"]
+    aa_mutations = features["aa_mutations"]
+    locations, coarsen_location = preprocess_nextstrain.coarsen_locations(
+        pp_args, stats["location"]
+    )
+
+    def features_loop():
+        aa_features = torch.zeros(len(lineages), len(aa_mutations))
+        for s, lineage in enumerate(lineages):
+            for f, aa in enumerate(aa_mutations):
+                count = stats["lineage_aa"].get((lineage, aa))
+                if count is None:
+                    continue
+                aa_features[s, f] = count / stats["lineage"][lineage]
+        return aa_features
+
+    def counts_loop():
+        location_id = {location: i for i, location in enumerate(locations)}
+        lineage_id = {lineage: i for i, lineage in enumerate(lineages)}
+        T = max(stats["day"]) // pp_args.time_step_days + 1
+        counts = torch.zeros(T, len(locations), len(lineages))
+        for day, location, lineage in zip(
+            columns["day"], columns["location"], columns["lineage"]
+        ):
+            location = coarsen_location.get(location, location)
+            t = day // pp_args.time_step_days
+            counts[t, location_id[location], lineage_id[lineage]] += 1
+        return counts
+
+    expected, loop_time = timed("per-row features", features_loop)
+    actual, vec_time = timed(
+        "vectorized features",
+        preprocess_nextstrain.make_features,
+        stats,
+        lineages,
+        aa_mutations,
+    )
+    assert torch.equal(actual, expected)
+    assert torch.equal(actual, features["aa_features"])
+    logger.info(f"features speedup = {loop_time / vec_time:0.3g}x")
+
+    expected, loop_time = timed("per-row counts", counts_loop)
+    actual, vec_time = timed(
+        "vectorized counts",
+        preprocess_nextstrain.make_counts,
+        columns,
+        pp_args.time_step_days,
+        locations,
+        coarsen_location,
+        lineages,
+    )
+    assert torch.equal(actual, expected)
+    logger.info(f"counts speedup = {loop_time / vec_time:0.3g}x")
+
+
+def make_usher_tree(args):
+    """
+    Creates a synthetic usher proto with ``args.num_rows`` nodes.
+    """
+    logger.info(f"Generating a synthetic tree with {args.num_rows} nodes")
+    rng = random.Random(args.seed)
+    clades = [Clade(name="node_0")]
+    for i in range(1, args.num_rows):
+        clade = Clade(name=f"node_{i}", branch_length=1)
+        clades[rng.randrange(i)].clades.append(clade)
+        clades.append(clade)
+    proto = parsimony_pb2.data()
+    proto.newick = next(iter(Writer([Tree(root=clades[0])]).to_strings()))
+    for _ in clades:
+        proto.metadata.add()
+        mutation = proto.node_mutations.add().mutation.add()
+        mutation.position = rng.randrange(1, 30000)
+        mutation.mut_nuc.append(rng.randrange(4))
+    return proto
+
+
+@benchmark
+def load_usher_tree(args):
+    """
+    Compares building a Bio.Phylo tree vs a MutationTree from an usher proto,
+    in time and peak memory.
+    """
+    proto = make_usher_tree(args)
+
+    def load_bio():
+        newick = proto.newick.replace(";", "")
+        tree = next(Parser.from_string(newick).parse())
+        return list(tree.find_clades())
+
+    stats = {}
+    for name, fn in [
+        ("Bio.Phylo", load_bio),
+        ("MutationTree", lambda: usher.MutationTree.from_proto(proto)),
+    ]:
+        tracemalloc.start()
+        tree, elapsed = timed(name, fn)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        logger.info(f"{name} peak memory {peak / 2**20:0.1f} MB")
+        del tree
+        stats[name] = elapsed, peak
+    (bio_time, bio_peak), (arr_time, arr_peak) = stats.values()
+    logger.info(
+        f"speedup = {bio_time / arr_time:0.3g}x, "
+        f"memory reduction = {bio_peak / arr_peak:0.3g}x"
+    )
+
+
+@benchmark
+def svi_step(args):
+    """
+    Compares SVI steps/sec of the Pyro ELBO vs the fused CompiledTrace_ELBO,
+    uncompiled and compiled, on the reparam-localinit mutrans model with a
+    full guide. Warmup steps including tracing and compilation are excluded.
+    """
+    with tempfile.TemporaryDirectory() as dirname:
+        filenames = make_usher_data(args, dirname)
+        dataset = mutrans.load_gisaid_data(**filenames)
+    model_type = "reparam-localinit"
+
+    def steps(svi, num_steps):
+        for _ in range(num_steps):
+            svi.step(dataset, model_type)
+
+    rates = {}
+    for name, Elbo in [
+        ("pyro", Trace_ELBO),
+        ("fx", functools.partial(CompiledTrace_ELBO, backend="fx")),
+        ("inductor", functools.partial(CompiledTrace_ELBO, backend="inductor")),
+    ]:
+        pyro.set_rng_seed(args.seed)
+        pyro.clear_param_store()
+        guide = make_guide(mutrans.model, "full", mutrans.InitLocFn(dataset))
+        guide(dataset, model_type)
+        optim = ClippedAdam({"lr": 0.01, "clip_norm": 10.0})
+        svi = SVI(mutrans.model, guide, optim, Elbo(max_plate_nesting=3))
+        timed(f"{name} warmup", steps, svi, 3)
+        _, elapsed = timed(f"{name} {args.num_steps} steps", steps, svi, args.num_steps)
+        rates[name] = args.num_steps / elapsed
+        logger.info(f"{name}: {rates[name]:0.3g} steps/sec")
+    logger.info(
+        f"speedup fx = {rates['fx'] / rates['pyro']:0.3g}x, "
+        f"inductor = {rates['inductor'] / rates['pyro']:0.3g}x"
+    )
+
+
+def main(args):
+    for name in args.benchmarks:
+        logger.info(f"Running benchmark {name}")
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmarks", nargs="+", choices=sorted(BENCHMARKS))
+    parser.add_argument("--num-rows", default=1000000, type=int)
+    parser.add_argument("--num-days", default=900, type=int)
+    parser.add_argument("--num-places", default=1000, type=int)
+    parser.add_argument("--num-clades", default=3000, type=int)
+    parser.add_argument("--num-mutations", default=2000, type=int)
+    parser.add_argument("--num-steps", default=100, type=int)
+    parser.add_argument("--seed", default=20210319, type=int)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,30 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import argparse
+import glob
+import logging
+
+from pyrocov.columnar import convert_columns
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format="%(relativeCreated) 9d %(message)s", level=logging.INFO)
+
+
+def main(args):
+    """
+    Converts legacy pickled columns files to memory-mappable columnar
+    directories, e.g. results/columns.3000.pkl -> results/columns.3000/
+    """
+    for infile in sorted(glob.glob(args.pattern)):
+        if "temp" in infile:
+            continue
+        outfile = convert_columns(infile)
+        logger.info(f"Saved {outfile}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert columns to columnar format")
+    parser.add_argument("--pattern", default="results/*columns*.pkl")
+    args = parser.parse_args()
+    main(args)
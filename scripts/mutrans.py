@@ -67,6 +67,12 @@ def _load_data_filename(args, **kwargs):
     parts.append(str(args.max_num_clades))
     parts.append(str(args.min_num_mutations))
     parts.append(str(args.min_region_size))
+    if args.sparse:
+        parts.append("sparse")
+    if args.sparse_features:
+        parts.append("sparsefeatures")
+    if args.incremental:
+        parts.append("incremental")
     for k, v in sorted(kwargs.get("include", {}).items()):
         parts.append(f"I{k}={_safe_str(v)}")
     for k, v in sorted(kwargs.get("exclude", {}).items()):
@@ -75,23 +81,54 @@ def _load_data_filename(args, **kwargs):
     return "results/mutrans.{}.pt".format(".".join(parts))
 
 
-@cached(_load_data_filename)
-def load_data(args, **kwargs):
-    """
-    Cached wrapper to load GENBANK or GISAID data.
-    """
+def _load_data_kwargs(args):
     features_filename = (
         f"results/features.{args.max_num_clades}.{args.min_num_mutations}.pt"
     )
-    return mutrans.load_gisaid_data(
+    # Prefer columnar data, falling back to legacy pickled columns.
+    columns_filename = f"results/columns.{args.max_num_clades}"
+    if args.incremental:
+        columns_filename = f"results/counts.{args.max_num_clades}/counts"
+    elif not os.path.isdir(columns_filename):
+        columns_filename += ".pkl"
+    return dict(
         device=args.device,
-        columns_filename=f"results/columns.{args.max_num_clades}.pkl",
+        columns_filename=columns_filename,
         features_filename=features_filename,
         min_region_size=args.min_region_size,
-        **kwargs,
+        sparse=args.sparse,
+        sparse_features=args.sparse_features,
     )
 
 
+_END_DAY_VIEWS: dict = {}
+
+
+def _load_end_day_views(args, **kwargs):
+    """
+    Memoized loader of GisaidEndDayViews, so that datasets for multiple
+    end_days (as in backtesting) are derived from a single pass over rows.
+    """
+    key = holdout_to_hashable(kwargs)
+    if key not in _END_DAY_VIEWS:
+        _END_DAY_VIEWS.clear()  # Keep at most one set of views in memory.
+        _END_DAY_VIEWS[key] = mutrans.GisaidEndDayViews(
+            **_load_data_kwargs(args), **kwargs
+        )
+    return _END_DAY_VIEWS[key]
+
+
+@cached(_load_data_filename)
+def load_data(args, **kwargs):
+    """
+    Cached wrapper to load GENBANK or GISAID data.
+    """
+    end_day = kwargs.pop("end_day", None)
+    if end_day is not None:
+        return _load_end_day_views(args, **kwargs)(end_day)
+    return mutrans.load_gisaid_data(**_load_data_kwargs(args), **kwargs)
+
+
 def _fit_filename(name, *args):
     parts = [name]
     parts.append(str(args[0].max_num_clades))
@@ -106,7 +143,23 @@ def _fit_filename(name, *args):
 
 
 @cached(lambda *args: _fit_filename("svi", *args))
-def fit_svi(
+def fit_svi(args, dataset, *config):
+    """
+    Cached wrapper to fit a model via SVI, checkpointing so that a killed fit
+    resumes where it stopped, unless ``--force`` is set.
+    """
+    checkpoint_filename = None
+    if args.checkpoint_every and not (args.test or args.no_cache):
+        filename = _fit_filename("svi", args, dataset, *config)
+        checkpoint_filename = re.sub(r"\.pt$", ".checkpoint.pt", filename)
+        if args.force and os.path.exists(checkpoint_filename):
+            # Refit from scratch rather than resume a possibly stale fit.
+            logger.info(f"removing {checkpoint_filename}")
+            os.remove(checkpoint_filename)
+    return _fit_svi(args, dataset, *config, checkpoint_filename=checkpoint_filename)
+
+
+def _fit_svi(
     args,
     dataset,
     cond_data="",
@@ -120,9 +173,11 @@ def fit_svi(
     f=6,
     end_day=None,
     holdout=(),
+    *,
+    checkpoint_filename=None,
 ):
     """
-    Cached wrapper to fit a model via SVI.
+    Fits a model via SVI.
     """
     cond_data = [kv.split("=") for kv in cond_data.split(",") if kv]
     cond_data = {k: float(v) for k, v in cond_data}
@@ -143,6 +198,11 @@ def fit_svi(
         seed=args.seed,
         jit=args.jit,
         num_samples=args.num_samples,
+        memory_budget=args.memory_budget,
+        telemetry=args.telemetry,
+        compile_backend=args.compile_backend,
+        checkpoint_filename=checkpoint_filename,
+        checkpoint_every=args.checkpoint_every,
     )
 
     if "lineage" in holdout.get("exclude", {}):
@@ -259,7 +319,7 @@ def vary_leaves(args, default_config):
     # Run inference for each lineage. This is very expensive.
     lineage_to_clade = dataset["lineage_to_clade"]
     clade_id = dataset["clade_id"]
-    num_obs = int(dataset["weekly_clades"].sum())
+    num_obs = int(mutrans.sparse_sum(dataset["weekly_clades"]))
     results = {}
     for lineage in tqdm.tqdm([None] + lineages):
         if lineage is None:
@@ -274,14 +334,11 @@ def vary_leaves(args, default_config):
             for descendent in descendents[clade]:
                 heldout.append(clade_id[descendent])
             loo_dataset = dataset.copy()
-            weekly_clades = dataset["weekly_clades"].clone()
-            weekly_clades[:, :, heldout] = 0
+            weekly_clades = mutrans.zero_clades(dataset["weekly_clades"], heldout)
             loo_dataset["weekly_clades"] = weekly_clades
             loo_dataset["sparse_counts"] = mutrans.dense_to_sparse(weekly_clades)
-            loo_dataset["pc_index"] = (
-                weekly_clades.ne(0).any(0).reshape(-1).nonzero(as_tuple=True)[0]
-            )
-            loo_num_obs = int(loo_dataset["weekly_clades"].sum())
+            loo_dataset["pc_index"] = mutrans.get_pc_index(weekly_clades)
+            loo_num_obs = int(mutrans.sparse_sum(weekly_clades))
             logger.info(f"Holding out {num_obs - loo_num_obs}/{num_obs} samples")
 
         # Run SVI
@@ -632,6 +689,21 @@ if __name__ == "__main__":
     parser.add_argument("--max-num-clades", default=3000, type=int)
     parser.add_argument("--min-num-mutations", default=1, type=int)
     parser.add_argument("--min-region-size", default=50, type=int)
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="store weekly_clades as a sparse tensor to save memory",
+    )
+    parser.add_argument(
+        "--sparse-features",
+        action="store_true",
+        help="store features as a sparse tensor to save memory",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="load aggregated counts from preprocess_usher.py --incremental",
+    )
     parser.add_argument("-cd", "--cond-data", default="coef_scale=0.05")
     parser.add_argument("-m", "--model-type", default="reparam-localinit")
     parser.add_argument("-g", "--guide-type", default="full")
@@ -642,6 +714,11 @@ if __name__ == "__main__":
     parser.add_argument("-cn", "--clip-norm", default=10.0, type=float)
     parser.add_argument("-r", "--rank", default=200, type=int)
     parser.add_argument("-f", "--forecast-steps", default=6, type=int)
+    parser.add_argument(
+        "--memory-budget-gb",
+        type=float,
+        help="bound temporary [T,P,C] tensors to this many GB by chunking time",
+    )
     parser.add_argument("-fp64", "--double", action="store_true")
     parser.add_argument("-fp32", "--float", action="store_false", dest="double")
     parser.add_argument(
@@ -651,8 +728,25 @@ if __name__ == "__main__":
     parser.add_argument("--cpu", dest="cuda", action="store_false")
     parser.add_argument("--jit", action="store_true", default=False)
     parser.add_argument("--no-jit", dest="jit", action="store_false")
+    parser.add_argument(
+        "--compile-backend",
+        help="fuse the SVI loss into one graph compiled with this backend, "
+        "e.g. inductor, or fx to trace without compiling",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        default=1000,
+        type=int,
+        help="checkpoint SVI every this many steps to resume if killed, 0 to disable",
+    )
     parser.add_argument("--seed", default=20210319, type=int)
     parser.add_argument("-l", "--log-every", default=100, type=int)
+    parser.add_argument(
+        "--telemetry",
+        default="eager",
+        choices=["eager", "buffered"],
+        help="buffered avoids per-step host syncs while recording series",
+    )
     parser.add_argument("--no-new", action="store_true")
     parser.add_argument("--no-cache", action="store_true")
     parser.add_argument("--force", action="store_true")
@@ -660,4 +754,7 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true")
     args = parser.parse_args()
     args.device = "cuda" if args.cuda else "cpu"
+    args.memory_budget = None
+    if args.memory_budget_gb is not None:
+        args.memory_budget = int(args.memory_budget_gb * 2**30)
     main(args)
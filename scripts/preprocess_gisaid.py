@@ -2,15 +2,24 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import argparse
+import contextlib
 import datetime
+import functools
 import json
 import logging
+import multiprocessing as mp
 import os
 import pickle
+import re
 import warnings
 from collections import Counter, defaultdict
+from timeit import default_timer
+
+import numpy as np
+import tqdm
 
 from pyrocov import pangolin
+from pyrocov.columnar import DictColumn, concat_columns, save_columns
 from pyrocov.geo import gisaid_normalize
 from pyrocov.mutrans import START_DATE
 from pyrocov.util import open_tqdm
@@ -19,6 +28,7 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(relativeCreated) 9d %(message)s", level=logging.INFO)
 
 DATE_FORMATS = {4: "%Y", 7: "%Y-%m", 10: "%Y-%m-%d"}
+DEFAULT_TRUNCATE = int(1e10)
 
 
 def parse_date(string):
@@ -35,11 +45,168 @@ def parse_date(string):
 FIELDS = ["virus_name", "accession_id", "collection_date", "location", "add_location"]
 
 
+def parse_datum(datum, start_date):
+    """
+    Filters and parses a dict of ``covv_*`` fields, returning a tuple
+    ``(lineage, day)`` or None if the row should be dropped.
+    """
+    collection_date = datum.get("covv_collection_date")
+    if collection_date is None or len(collection_date) < 7:
+        return  # Drop rows with no month information.
+    date = parse_date(collection_date)
+    if date < start_date:
+        date = start_date  # Clip rows before start date.
+    lineage = datum.get("covv_lineage")
+    if lineage in (None, "None", ""):
+        return  # Drop rows with unknown lineage.
+    try:
+        lineage = pangolin.compress(lineage)
+        lineage = pangolin.decompress(lineage)
+        assert lineage
+    except (ValueError, AssertionError) as e:
+        warnings.warn(str(e))
+        return
+
+    # Fix duplicate locations.
+    datum["covv_location"] = gisaid_normalize(datum["covv_location"])
+    return lineage, (date - start_date).days
+
+
+# Matches a string value of a "sequence" key. Nucleotide sequences contain no
+# quotes or escapes, so the payload ends at the next quote.
+SEQUENCE_VALUE = re.compile(rb'([{,]\s*"sequence"\s*:\s*)"[^"\\]*"(?=\s*[,}])')
+
+
+def parse_line(line):
+    """
+    Parses a line of JSON bytes, replacing a large string ``sequence`` value
+    by null before decoding. Lines whose ``sequence`` key is missing,
+    ambiguous or not a plain string are decoded as is.
+    """
+    stripped, count = SEQUENCE_VALUE.subn(rb"\1null", line)
+    if count == 1:
+        try:
+            return json.loads(stripped)
+        except json.JSONDecodeError:
+            pass
+    return json.loads(line)
+
+
+def get_byte_ranges(filename, num_ranges):
+    """
+    Splits a file into contiguous byte ranges aligned to line boundaries.
+    """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, num_ranges):
+            f.seek(max(bounds[-1], size * i // num_ranges))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(b, e) for b, e in zip(bounds[:-1], bounds[1:]) if b < e]
+
+
+def parse_byte_range(filename, start_date, byte_range):
+    """
+    Parses lines in a byte range of a GISAID feed, returning a tuple
+    ``(num_lines, columns, stats)`` with dictionary-encoded columns.
+    """
+    begin, end = byte_range
+    columns = defaultdict(list)
+    stats = defaultdict(Counter)
+    num_lines = 0
+    with open(filename, "rb") as f:
+        f.seek(begin)
+        while f.tell() < end:
+            line = f.readline()
+            if not line.strip():
+                continue
+            num_lines += 1
+            datum = parse_line(line)
+            parsed = parse_datum(datum, start_date)
+            if parsed is None:
+                continue
+            lineage, day = parsed
+
+            # Collate.
+            columns["lineage"].append(lineage)
+            for key in FIELDS:
+                columns[key].append(datum.get("covv_" + key))
+            columns["day"].append(day)
+
+            # Aggregate statistics.
+            stats["date"][datum["covv_collection_date"]] += 1
+            stats["location"][datum["covv_location"]] += 1
+            stats["lineage"][lineage] += 1
+
+    # Encode columns compactly before returning to the parent process.
+    for key, values in columns.items():
+        if key == "day":
+            columns[key] = np.array(values, dtype=np.int32)
+        elif all(isinstance(v, str) for v in values):
+            columns[key] = DictColumn.from_list(values)
+    return num_lines, dict(columns), dict(stats)
+
+
+def main_streaming(args):
+    """
+    Parses byte ranges of the feed, possibly in parallel, and saves a
+    columnar directory rather than a pickle.
+    """
+    if args.truncate < DEFAULT_TRUNCATE:
+        raise ValueError("--truncate is not supported with --streaming")
+    num_ranges = max(1, args.processes) * 16
+    byte_ranges = get_byte_ranges(args.gisaid_file_in, num_ranges)
+    parse = functools.partial(parse_byte_range, args.gisaid_file_in, args.start_date)
+
+    start_time = default_timer()
+    num_lines = 0
+    parts = []
+    stats = defaultdict(Counter)
+    with contextlib.ExitStack() as stack:
+        if args.processes:
+            pool = stack.enter_context(mp.Pool(args.processes))
+            results = pool.imap(parse, byte_ranges)
+        else:
+            results = map(parse, byte_ranges)
+        for part_lines, part_columns, part_stats in tqdm.tqdm(
+            results, total=len(byte_ranges)
+        ):
+            num_lines += part_lines
+            if part_columns:
+                parts.append(part_columns)
+            for key, counts in part_stats.items():
+                stats[key].update(counts)
+    columns = concat_columns(parts)
+    num_rows = len(columns["day"]) if columns else 0
+    elapsed = default_timer() - start_time
+    logger.info(
+        f"Parsed {num_lines} rows in {elapsed:0.1f} sec "
+        f"({num_lines / max(elapsed, 1e-6):0.0f} rows/sec)"
+    )
+    num_dropped = num_lines - num_rows
+    logger.info(
+        f"dropped {num_dropped}/{num_lines} = "
+        f"{num_dropped*100/max(num_lines, 1):0.2g}% rows"
+    )
+
+    columns_dir_out = args.columns_file_out.rsplit(".pkl", 1)[0]
+    logger.info(f"saving {columns_dir_out}")
+    save_columns(columns, columns_dir_out)
+
+    logger.info(f"saving {args.stats_file_out}")
+    with open(args.stats_file_out, "wb") as f:
+        pickle.dump(dict(stats), f)
+
+
 def main(args):
     logger.info(f"Filtering {args.gisaid_file_in}")
     if not os.path.exists(args.gisaid_file_in):
         raise OSError(f"Missing {args.gisaid_file_in}; you may need to request a feed")
     os.makedirs("results", exist_ok=True)
+    if args.streaming:
+        return main_streaming(args)
 
     columns = defaultdict(list)
     stats = defaultdict(Counter)
@@ -52,35 +219,20 @@ def main(args):
 
         # Filter out bad data.
         datum = json.loads(line)
-        if len(datum["covv_collection_date"]) < 7:
-            continue  # Drop rows with no month information.
-        date = parse_date(datum["covv_collection_date"])
-        if date < args.start_date:
-            date = args.start_date  # Clip rows before start date.
-        lineage = datum["covv_lineage"]
-        if lineage in (None, "None", ""):
-            continue  # Drop rows with unknown lineage.
-        try:
-            lineage = pangolin.compress(lineage)
-            lineage = pangolin.decompress(lineage)
-            assert lineage
-        except (ValueError, AssertionError) as e:
-            warnings.warn(str(e))
-            continue
-
-        # Fix duplicate locations.
-        datum["covv_location"] = gisaid_normalize(datum["covv_location"])
-
-        # Collate.
-        columns["lineage"].append(lineage)
-        for covv_key, key in zip(covv_fields, FIELDS):
-            columns[key].append(datum[covv_key])
-        columns["day"].append((date - args.start_date).days)
-
-        # Aggregate statistics.
-        stats["date"][datum["covv_collection_date"]] += 1
-        stats["location"][datum["covv_location"]] += 1
-        stats["lineage"][lineage] += 1
+        parsed = parse_datum(datum, args.start_date)
+        if parsed is not None:
+            lineage, day = parsed
+
+            # Collate.
+            columns["lineage"].append(lineage)
+            for covv_key, key in zip(covv_fields, FIELDS):
+                columns[key].append(datum[covv_key])
+            columns["day"].append(day)
+
+            # Aggregate statistics.
+            stats["date"][datum["covv_collection_date"]] += 1
+            stats["location"][datum["covv_location"]] += 1
+            stats["lineage"][lineage] += 1
 
         if i >= args.truncate:
             break
@@ -103,7 +255,19 @@ if __name__ == "__main__":
     parser.add_argument("--columns-file-out", default="results/gisaid.columns.pkl")
     parser.add_argument("--stats-file-out", default="results/gisaid.stats.pkl")
     parser.add_argument("--start-date", default=START_DATE)
-    parser.add_argument("--truncate", default=int(1e10), type=int)
+    parser.add_argument("--truncate", default=DEFAULT_TRUNCATE, type=int)
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="parse byte ranges of the feed and save a columnar directory",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        default=0,
+        type=int,
+        help="number of worker processes for --streaming, or 0 to parse serially",
+    )
     args = parser.parse_args()
     args.start_date = parse_date(args.start_date)
     main(args)
@@ -14,12 +14,15 @@ gs://nextstrain-data/files/ncov/open/metadata.tsv.gz
 
 import argparse
 import datetime
+import functools
 import logging
 import pickle
 from collections import Counter, defaultdict
 
+import numpy as np
 import torch
 
+from pyrocov.columnar import factorize, save_columns
 from pyrocov.growth import START_DATE, dense_to_sparse
 from pyrocov.util import gzip_open_tqdm
 
@@ -27,6 +30,7 @@ logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(relativeCreated) 9d %(message)s", level=logging.INFO)
 
 
+@functools.lru_cache(maxsize=None)
 def parse_date(string):
     return datetime.datetime.strptime(string, "%Y-%m-%d")
 
@@ -49,6 +53,56 @@ def coarsen_locations(args, counts):
     return locations, coarsen_location
 
 
+def make_features(stats, lineages, aa_mutations):
+    """
+    Creates a dense ``(lineage, aa_mutation)`` matrix of the fraction of each
+    lineage's samples having each mutation, by scattering the sparse
+    ``stats["lineage_aa"]`` counts.
+    """
+    lineage_id = {lineage: i for i, lineage in enumerate(lineages)}
+    aa_id = {aa: i for i, aa in enumerate(aa_mutations)}
+    rows, cols, values = [], [], []
+    for (lineage, aa), count in stats["lineage_aa"].items():
+        f = aa_id.get(aa)
+        if f is not None:
+            rows.append(lineage_id[lineage])
+            cols.append(f)
+            values.append(count / stats["lineage"][lineage])
+    aa_features = torch.zeros(len(lineages), len(aa_mutations), dtype=torch.float)
+    aa_features[rows, cols] = torch.tensor(values, dtype=torch.float)
+    return aa_features
+
+
+def make_counts(columns, time_step_days, locations, coarsen_location, lineages):
+    """
+    Creates a dense ``(time, location, lineage)`` tensor of sample counts.
+
+    String columns are factorized once, so that lookups happen only on unique
+    values, and rows are then counted by a single scatter on the flattened
+    index.
+    """
+    location_id = {location: i for i, location in enumerate(locations)}
+    lineage_id = {lineage: i for i, lineage in enumerate(lineages)}
+    location_codes, location_uniques = factorize(columns["location"])
+    location_map = np.array(
+        [location_id[coarsen_location.get(u, u)] for u in location_uniques],
+        dtype=np.int64,
+    )
+    lineage_codes, lineage_uniques = factorize(columns["lineage"])
+    lineage_map = np.array([lineage_id[u] for u in lineage_uniques], dtype=np.int64)
+
+    t = np.asarray(columns["day"], dtype=np.int64) // time_step_days
+    p = location_map[location_codes]
+    s = lineage_map[lineage_codes]
+    T = int(t.max()) + 1
+    P = len(locations)
+    S = len(lineages)
+    index = torch.from_numpy((t * P + p) * S + s)
+    counts = torch.zeros(T * P * S)
+    counts.index_put_((index,), torch.ones(()).expand(len(index)), accumulate=True)
+    return counts.reshape(T, P, S)
+
+
 def main(args):
     columns = defaultdict(list)
     stats = defaultdict(Counter)
@@ -57,7 +111,7 @@ def main(args):
     # Process rows one at a time.
     logger.info(f"Reading {args.metadata_file_in}")
     header = None
-    for line in gzip_open_tqdm(args.metadata_file_in, "rt"):
+    for line in gzip_open_tqdm(args.metadata_file_in, "rt", threaded=True):
         line = line.strip().split("\t")
         if header is None:
             header = line
@@ -114,6 +168,9 @@ def main(args):
     logger.info(f"saving {args.columns_file_out}")
     with open(args.columns_file_out, "wb") as f:
         pickle.dump(columns, f)
+    columns_dir_out = args.columns_file_out.rsplit(".pkl", 1)[0]
+    logger.info(f"saving {columns_dir_out}")
+    save_columns(columns, columns_dir_out)
 
     # Create contiguous coordinates.
     locations = sorted(stats["location"])
@@ -126,16 +183,10 @@ def main(args):
     aa_mutations = [aa for aa, _ in aa_counts.most_common()]
 
     # Create a dense feature matrix.
-    aa_features = torch.zeros(len(lineages), len(aa_mutations), dtype=torch.float)
+    aa_features = make_features(stats, lineages, aa_mutations)
     logger.info(
         f"saving {tuple(aa_features.shape)} features to {args.features_file_out}"
     )
-    for s, lineage in enumerate(lineages):
-        for f, aa in enumerate(aa_mutations):
-            count = stats["lineage_aa"].get((lineage, aa))
-            if count is None:
-                continue
-            aa_features[s, f] = count / stats["lineage"][lineage]
     features = {
         "lineages": lineages,
         "aa_mutations": aa_mutations,
@@ -146,20 +197,9 @@ def main(args):
 
     # Create a dense dataset.
     locations, coarsen_location = coarsen_locations(args, stats["location"])
-    location_id = {location: i for i, location in enumerate(locations)}
-    lineage_id = {lineage: i for i, lineage in enumerate(lineages)}
-    T = max(stats["day"]) // args.time_step_days + 1
-    P = len(locations)
-    S = len(lineages)
-    counts = torch.zeros(T, P, S)
-    for day, location, lineage in zip(
-        columns["day"], columns["location"], columns["lineage"]
-    ):
-        location = coarsen_location.get(location, location)
-        t = day // args.time_step_days
-        p = location_id[location]
-        s = lineage_id[lineage]
-        counts[t, p, s] += 1
+    counts = make_counts(
+        columns, args.time_step_days, locations, coarsen_location, lineages
+    )
     logger.info(f"counts data is {counts.ne(0).float().mean().item()*100:0.3g}% dense")
     sparse_counts = dense_to_sparse(counts)
     place_lineage_index = counts.ne(0).any(0).reshape(-1).nonzero(as_tuple=True)[0]
@@ -2,25 +2,35 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import argparse
+import contextlib
 import datetime
+import functools
+import itertools
 import logging
 import math
+import multiprocessing as mp
 import pickle
 import re
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
+from timeit import default_timer
 
+import numpy as np
 import pandas as pd
 import torch
 import tqdm
 
-from pyrocov.geo import get_canonical_location_generator, gisaid_normalize
+from pyrocov.columnar import save_columns
+from pyrocov.geo import (
+    get_canonical_location_generator,
+    gisaid_normalize_column,
+)
+from pyrocov.incremental import update_count_store
 from pyrocov.mutrans import START_DATE
-from pyrocov.sarscov2 import nuc_mutations_to_aa_mutations
+from pyrocov.sarscov2 import get_translator
 from pyrocov.usher import (
     FineToMeso,
     load_mutation_tree,
-    load_proto,
-    prune_mutation_tree,
+    prune_mutation_tree_multi,
     refine_mutation_tree,
 )
 from pyrocov.util import gzip_open_tqdm
@@ -40,6 +50,47 @@ def try_parse_date(string):
             return
 
 
+def try_parse_days(dates, start_date):
+    """
+    Vectorized version of :func:`try_parse_date` that parses each unique date
+    string once. Returns a pair ``(days, mask)`` of day offsets from
+    ``start_date`` (clipping earlier dates to ``start_date``) and a mask of
+    successfully parsed dates.
+    """
+    codes, uniques = pd.factorize(np.asarray(dates, dtype=object))
+    days = np.zeros(len(uniques) + 1, dtype=np.int64)
+    mask = np.zeros(len(uniques) + 1, dtype=bool)  # final entry for missing
+    for i, string in enumerate(uniques):
+        if isinstance(string, str):
+            date = try_parse_date(string)
+            if date is not None:
+                days[i] = max(0, (date - start_date).days)
+                mask[i] = True
+    return days[codes], mask[codes]
+
+
+def is_valid_string(values, invalid=("", "?")):
+    """
+    Returns a mask of values that are strings and not in ``invalid``.
+    """
+    values = pd.Series(np.asarray(values, dtype=object))
+    return (values.map(type) == str).to_numpy() & ~values.isin(invalid).to_numpy()
+
+
+def _metadata_dicts(keys, **fields):
+    """
+    Creates a dict of dictionaries from keys to each field's values, where
+    each field is a pair ``(values, mask)``. Later keys override earlier keys.
+    """
+    keys = np.asarray(keys, dtype=object)
+    result = defaultdict(dict)
+    for name, (values, mask) in fields.items():
+        if mask.any():
+            values = np.asarray(values, dtype=object)
+            result[name] = dict(zip(keys[mask].tolist(), values[mask].tolist()))
+    return result
+
+
 def try_parse_genbank(strain):
     match = re.search(r"([A-Z]+[0-9]+)\.[0-9]", strain)
     if match:
@@ -56,48 +107,120 @@ def try_parse_gisaid(string, public_to_gisaid):
             return result
 
 
-def load_nextstrain_metadata(args):
+def imap_bounded(pool, fn, items, max_pending):
     """
-    Returns a dict of dictionaries from genbank_accession to metadata.
+    Like ``pool.imap(fn, items)`` but reads at most ``max_pending`` items
+    ahead of the consumer, bounding memory when items are large chunks.
     """
-    logger.info("Loading nextstrain metadata")
-    get_canonical_location = get_canonical_location_generator(
-        args.recover_missing_usa_state
-    )
-    df = pd.read_csv("results/nextstrain/metadata.tsv", sep="\t", dtype=str)
-    result = defaultdict(dict)
-    for row in tqdm.tqdm(df.itertuples(), total=len(df)):
-        # Key on genbank accession.
-        key = row.genbank_accession
-        if not isinstance(key, str) or not key:
-            continue
-
-        # Extract date.
-        date = row.date
-        if isinstance(date, str) and date and date != "?":
-            date = try_parse_date(date)
-            if date is not None:
-                if date < args.start_date:
-                    date = args.start_date  # Clip rows before start date.
-                result["day"][key] = (date - args.start_date).days
-
-        # Extract a standard location.
-        location = get_canonical_location(
-            row.strain, row.region, row.country, row.division, row.location
-        )
-        if location is not None:
-            location = gisaid_normalize(location)
-            result["location"][key] = location
+    pending: deque = deque()
+    for item in items:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(fn, (item,)))
+    while pending:
+        yield pending.popleft().get()
 
-        # Extract pango lineage.
-        lineage = row.pango_lineage
-        if isinstance(lineage, str) and lineage and lineage != "?":
-            result["lineage"][key] = lineage
 
+def _parse_chunks(parse_chunk, chunks, args, name, initializer=None, initargs=()):
+    """
+    Parses chunks of rows either sequentially or in worker processes,
+    merging the resulting dicts of dictionaries in order. If provided,
+    ``initializer(*initargs)`` is called once per worker process.
+    """
+    start_time = default_timer()
+    result = defaultdict(dict)
+    num_rows = 0
+    with contextlib.ExitStack() as stack:
+        if args.processes:
+            pool = stack.enter_context(mp.Pool(args.processes, initializer, initargs))
+            chunk_results = imap_bounded(pool, parse_chunk, chunks, 2 * args.processes)
+        else:
+            if initializer is not None:
+                initializer(*initargs)
+            chunk_results = map(parse_chunk, chunks)
+        for chunk_size, chunk_result in tqdm.tqdm(chunk_results, unit="chunk"):
+            num_rows += chunk_size
+            for field, col in chunk_result.items():
+                result[field].update(col)
+    elapsed = default_timer() - start_time
+    logger.info(
+        f"Parsed {num_rows} {name} rows in {elapsed:0.1f} sec "
+        f"({num_rows / max(elapsed, 1e-6):0.0f} rows/sec)"
+    )
     logger.info("Found metadata:\n{}".format({k: len(v) for k, v in result.items()}))
     return result
 
 
+_GET_CANONICAL_LOCATION = None
+
+
+def _init_nextstrain_worker(recover_missing_usa_state):
+    global _GET_CANONICAL_LOCATION
+    _GET_CANONICAL_LOCATION = get_canonical_location_generator(
+        recover_missing_usa_state
+    )
+
+
+def _parse_nextstrain_chunk(start_date, df):
+    get_canonical_location = _GET_CANONICAL_LOCATION
+    num_rows = len(df)
+
+    # Key on genbank accession.
+    df = df[is_valid_string(df["genbank_accession"], invalid=("",))]
+    keys = df["genbank_accession"].to_numpy(dtype=object)
+
+    # Extract date.
+    days, has_day = try_parse_days(df["date"], start_date)
+
+    # Extract a standard location, once per unique combination of fields.
+    # Strains are needed only to recover missing USA states.
+    use_strain = (df["country"] == "USA") & (df["division"] == "USA")
+    strains = df["strain"].where(use_strain, None)
+    columns = strains, df["region"], df["country"], df["division"], df["location"]
+    cache: dict = {}
+    locations = []
+    for parts in zip(*columns):
+        if parts not in cache:
+            cache[parts] = get_canonical_location(*parts)
+        locations.append(cache[parts])
+    locations = gisaid_normalize_column(locations)
+    has_location = pd.notna(locations)
+
+    # Extract pango lineage.
+    lineages = df["pango_lineage"].to_numpy(dtype=object)
+    has_lineage = is_valid_string(lineages)
+
+    result = _metadata_dicts(
+        keys,
+        day=(days, has_day),
+        location=(locations, has_location),
+        lineage=(lineages, has_lineage),
+    )
+    return num_rows, result
+
+
+def load_nextstrain_metadata(args):
+    """
+    Returns a dict of dictionaries from genbank_accession to metadata.
+    """
+    logger.info("Loading nextstrain metadata")
+    chunks = pd.read_csv(
+        "results/nextstrain/metadata.tsv",
+        sep="\t",
+        dtype=str,
+        chunksize=args.chunksize,
+    )
+    parse_chunk = functools.partial(_parse_nextstrain_chunk, args.start_date)
+    return _parse_chunks(
+        parse_chunk,
+        chunks,
+        args,
+        "nextstrain",
+        initializer=_init_nextstrain_worker,
+        initargs=(args.recover_missing_usa_state,),
+    )
+
+
 # These are merely fallback locations in case nextrain is missing genbank ids.
 USHER_LOCATIONS = {
     "England": "Europe / United Kingdom / England",
@@ -109,42 +232,78 @@ USHER_LOCATIONS = {
 }
 
 
+def _parse_usher_chunk(start_date, df):
+    # Key on usher strain.
+    keys = df["strain"].to_numpy(dtype=object)
+    assert is_valid_string(keys, invalid=("",)).all()
+
+    # Extract date.
+    days, has_day = try_parse_days(df["date"], start_date)
+
+    # Extract a standard location.
+    prefixes = df["strain"].str.extract(r"^([^/|_]*)", expand=False)
+    locations = gisaid_normalize_column(prefixes.map(USHER_LOCATIONS))
+    has_location = pd.notna(locations)
+
+    # Extract pango lineage.
+    lineages = df["pangolin_lineage"].to_numpy(dtype=object)
+    has_lineage = is_valid_string(lineages)
+
+    result = _metadata_dicts(
+        keys,
+        day=(days, has_day),
+        location=(locations, has_location),
+        lineage=(lineages, has_lineage),
+    )
+    return len(df), result
+
+
 def load_usher_metadata(args):
     """
     Returns a dict of dictionaries from usher strain id to metadata.
     """
     logger.info("Loading usher metadata")
-    df = pd.read_csv("results/usher/metadata.tsv", sep="\t", dtype=str)
-    result = defaultdict(dict)
-    for row in tqdm.tqdm(df.itertuples(), total=len(df)):
-        # Key on usher strain.
-        key = row.strain
-        assert isinstance(key, str) and key
-
-        # Extract date.
-        date = row.date
-        if isinstance(date, str) and date and date != "?":
-            date = try_parse_date(date)
-            if date is not None:
-                if date < args.start_date:
-                    date = args.start_date  # Clip rows before start date.
-                result["day"][key] = (date - args.start_date).days
-
-        # Extract a standard location.
-        if isinstance(row.strain, str) and row.strain:
-            prefix = re.split(r"[/|_]", row.strain)[0]
-            location = USHER_LOCATIONS.get(prefix)
-            if location is not None:
-                location = gisaid_normalize(location)
-                result["location"][key] = location
-
-        # Extract pango lineage.
-        lineage = row.pangolin_lineage
-        if isinstance(lineage, str) and lineage and lineage != "?":
-            result["lineage"][key] = lineage
-
-    logger.info("Found metadata:\n{}".format({k: len(v) for k, v in result.items()}))
-    return result
+    chunks = pd.read_csv(
+        "results/usher/metadata.tsv", sep="\t", dtype=str, chunksize=args.chunksize
+    )
+    parse_chunk = functools.partial(_parse_usher_chunk, args.start_date)
+    return _parse_chunks(parse_chunk, chunks, args, "usher")
+
+
+def _parse_gisaid_chunk(start_date, header, lines):
+    # Split lines, using the last of any duplicate header names.
+    rows = [line.strip().split("\t") for line in lines]
+    index = {name: i for i, name in enumerate(header)}
+
+    def get_column(name):
+        i = index.get(name)
+        if i is None:
+            return np.full(len(rows), None, dtype=object)
+        return np.array([row[i] if i < len(row) else None for row in rows], object)
+
+    # Key on gisaid accession id.
+    keys = get_column("Accession ID")
+    valid = is_valid_string(keys, invalid=("",))
+
+    # Extract date.
+    days, has_day = try_parse_days(get_column("Collection date"), start_date)
+
+    # Extract location.
+    locations = get_column("Location")
+    has_location = is_valid_string(locations, invalid=("",))
+    locations = gisaid_normalize_column(np.where(has_location, locations, None))
+
+    # Extract pango lineage.
+    lineages = get_column("Pango lineage")
+    has_lineage = is_valid_string(lineages, invalid=("",))
+
+    result = _metadata_dicts(
+        keys,
+        day=(days, valid & has_day),
+        location=(locations, valid & has_location),
+        lineage=(lineages, valid & has_lineage),
+    )
+    return len(lines), result
 
 
 def load_gisaid_metadata(args):
@@ -154,45 +313,14 @@ def load_gisaid_metadata(args):
     filename = args.gisaid_metadata_file_in
     logger.info(f"Loading gisaid metadata from {filename}")
     assert filename.endswith(".tsv.gz")
-    result = defaultdict(dict)
-    header = ()
-    for i, line in enumerate(gzip_open_tqdm(filename, "rt")):
-        line = line.strip().split("\t")
-        if i == 0:
-            header = tuple(line)
-            continue
-        row = dict(zip(header, line))
-
-        # Key on gisaid accession id.
-        key = row.get("Accession ID")
-        if not key:
-            continue
-
-        # Extract date.
-        date = row.get("Collection date")
-        if date and date != "?":
-            date = try_parse_date(date)
-            if date is not None:
-                if date < args.start_date:
-                    date = args.start_date  # Clip rows before start date.
-                result["day"][key] = (date - args.start_date).days
+    lines = gzip_open_tqdm(filename, "rt", threaded=True)
+    header = tuple(next(lines).strip().split("\t"))
+    chunks = iter(lambda: list(itertools.islice(lines, args.chunksize)), [])
+    parse_chunk = functools.partial(_parse_gisaid_chunk, args.start_date, header)
+    return _parse_chunks(parse_chunk, chunks, args, "gisaid")
 
-        # Extract location.
-        location = row.get("Location")
-        if location:
-            location = gisaid_normalize(location)
-            result["location"][key] = location
 
-        # Extract pango lineage.
-        lineage = row.get("Pango lineage")
-        if lineage:
-            result["lineage"][key] = lineage
-
-    logger.info("Found metadata:\n{}".format({k: len(v) for k, v in result.items()}))
-    return result
-
-
-def load_metadata(args):
+def load_metadata(args, nuc_mutations_by_clade, proto, tree):
     # Load metadata.
     public_to_gisaid = {}
     if args.gisaid_metadata_file_in:
@@ -216,30 +344,24 @@ def load_metadata(args):
                     if value:
                         usher_col[strain] = value
 
-    # Load usher tree.
-    # Collect all names appearing in the usher tree.
-    nuc_mutations_by_clade, proto, tree = load_mutation_tree(args.tree_file_out)
-    assert nuc_mutations_by_clade
-
     # Collect background mutation statistics.
     stats = defaultdict(Counter)
     aa_substitutions = stats["aaSubstitutions"]
-    for mutations in nuc_mutations_by_clade.values():
-        aa_substitutions.update(nuc_mutations_to_aa_mutations(mutations))
+    translator = get_translator()
+    mutation_sets = iter(nuc_mutations_by_clade.values())
+    for batch in iter(lambda: list(itertools.islice(mutation_sets, 1000)), []):
+        for aa_mutations in translator.translate_batch(batch):
+            aa_substitutions.update(aa_mutations)
 
     # Collect condensed samples.
     condensed_nodes = {}
     for node in proto.condensed_nodes:
         condensed_nodes[node.node_name] = list(node.condensed_leaves)
 
-    # Propagate fine clade names downward.
-    node_to_clade = {}
-    for clade, meta in zip(tree.find_clades(), proto.metadata):
-        if meta.clade:
-            node_to_clade[clade] = meta.clade
-        # Propagate down to descendent clones.
-        for child in clade.clades:
-            node_to_clade[child] = node_to_clade[clade]
+    # Propagate fine clade names downward to descendent clones.
+    node_to_clade = []
+    for parent, clade in zip(tree.parent.tolist(), tree.clades):
+        node_to_clade.append(clade or node_to_clade[parent])
 
     # Collect info from each node in the tree.
     fields = "day", "location", "lineage"
@@ -248,10 +370,10 @@ def load_metadata(args):
     skipped = stats["skipped"]
     skipped_by_day = Counter()
     nodename_to_count = Counter()
-    for node, meta in zip(tree.find_clades(), proto.metadata):
-        keys = condensed_nodes.get(node.name, [node.name])
+    for node, name in enumerate(tree.names):
+        keys = condensed_nodes.get(name, [name])
         for key in keys:
-            if key is None:
+            if not key:
                 continue
             sample_keys.add(key)
 
@@ -274,7 +396,7 @@ def load_metadata(args):
             columns["index"].append(key)
             for k, v in row.items():
                 columns[k].append(v)
-            nodename_to_count[node.name] += 1
+            nodename_to_count[name] += 1
     logger.info(f"Found {len(sample_keys)} samples in the usher tree")
     logger.info(f"Skipped {sum(skipped.values())} nodes because:\n{skipped}")
     columns = dict(columns)
@@ -287,6 +409,8 @@ def load_metadata(args):
     with open("results/columns.pkl", "wb") as f:
         pickle.dump(columns, f)
     logger.info("Saved results/columns.pkl")
+    save_columns(columns, "results/columns")
+    logger.info("Saved results/columns")
 
     with open(args.stats_file_out, "wb") as f:
         pickle.dump(stats, f)
@@ -295,39 +419,38 @@ def load_metadata(args):
     return columns, nodename_to_count
 
 
-def prune_tree(args, max_num_clades, coarse_to_fine, nodename_to_count):
-    proto, tree = load_proto(args.tree_file_out)
+def prune_tree(max_num_clades, coarse_to_fine, nodename_to_count, proto, tree):
+    """
+    Prunes the fine tree to each of the sizes in ``max_num_clades`` in a single
+    pass, returning a dict mapping each size to a :class:`FineToMeso` .
+    """
+    parents = tree.parent.tolist()
 
     # Add weights for leaves.
-    cum_weights = {}
-    mrca_weights = {}
-    for clade in tree.find_clades():
-        count = nodename_to_count[clade.name]
-        cum_weights[clade] = count
-        mrca_weights[clade] = count**2
-
-    # Add weights of MRCA pairs.
-    reverse_clades = list(tree.find_clades())
-    reverse_clades.reverse()  # from leaves to root
-    for parent in reverse_clades:
-        for child in parent.clades:
-            cum_weights[parent] += cum_weights[child]
-        for child in parent.clades:
-            mrca_weights[parent] += cum_weights[child] * (
-                cum_weights[parent] - cum_weights[child]
-            )
+    cum_weights = [nodename_to_count[name] for name in tree.names]
+    mrca_weights = [count**2 for count in cum_weights]
+
+    # Add weights of MRCA pairs. Since nodes are in preorder, reversed nodes
+    # are visited from leaves to root.
+    for child in range(len(tree) - 1, 0, -1):
+        cum_weights[parents[child]] += cum_weights[child]
+    for child, parent in enumerate(parents[1:], 1):
+        mrca_weights[parent] += cum_weights[child] * (
+            cum_weights[parent] - cum_weights[child]
+        )
     num_samples = sum(nodename_to_count.values())
-    assert cum_weights[tree.root] == num_samples
-    assert sum(mrca_weights.values()) == num_samples**2
+    assert cum_weights[0] == num_samples
+    assert sum(mrca_weights) == num_samples**2
 
     # Aggregate among clones to basal representative.
     weights = defaultdict(float)
-    for meta, parent in zip(reversed(proto.metadata), reverse_clades):
-        for child in parent.clades:
-            mrca_weights[parent] += mrca_weights.get(child, 0)
-        assert isinstance(meta.clade, str)
-        if meta.clade:
-            weights[meta.clade] = mrca_weights.pop(parent)
+    for node in range(len(tree) - 1, -1, -1):
+        clade = tree.clades[node]
+        if clade:
+            weights[clade] = mrca_weights[node]
+            mrca_weights[node] = 0
+        if node:
+            mrca_weights[parents[node]] += mrca_weights[node]
     assert sum(weights.values()) == num_samples**2
 
     # To ensure pango lineages remain distinct, set their weights to infinity.
@@ -336,13 +459,12 @@ def prune_tree(args, max_num_clades, coarse_to_fine, nodename_to_count):
     assert "" not in weights
 
     # Prune the tree, minimizing the number of incorrect mutations.
-    max_num_clades = max(max_num_clades, len(coarse_to_fine))
-    pruned_tree_filename = f"results/lineageTree.{max_num_clades}.pb"
-    meso_set = prune_mutation_tree(
-        args.tree_file_out, pruned_tree_filename, max_num_clades, weights
-    )
-    assert len(meso_set) == max_num_clades
-    return FineToMeso(meso_set), pruned_tree_filename
+    sizes = {n: max(n, len(coarse_to_fine)) for n in max_num_clades}
+    filenames = {size: f"results/lineageTree.{size}.pb" for size in sizes.values()}
+    meso_sets = prune_mutation_tree_multi(proto, filenames, weights, tree=tree)
+    for size, meso_set in meso_sets.items():
+        assert len(meso_set) == size
+    return {n: FineToMeso(meso_sets[size]) for n, size in sizes.items()}
 
 
 def extract_features(
@@ -350,14 +472,12 @@ def extract_features(
     max_num_clades,
     fine_to_coarse,
     coarse_to_fine,
-    nodename_to_count,
+    fine_to_meso,
+    nuc_mutations_by_clade,
     columns,
 ):
     logger.info(f"Extracting features with {max_num_clades} clades")
-    # Prune tree, updating data structures to use meso-scale clades.
-    fine_to_meso, pruned_tree_filename = prune_tree(
-        args, max_num_clades, coarse_to_fine, nodename_to_count
-    )
+    # Update data structures to use meso-scale clades.
     fine_to_coarse = {fine_to_meso(f): c for f, c in fine_to_coarse.items()}
     coarse_to_fine = {c: fine_to_meso(f) for c, f in coarse_to_fine.items()}
 
@@ -370,39 +490,56 @@ def extract_features(
     with open(columns_file_out, "wb") as f:
         pickle.dump(columns, f)
     logger.info(f"Saved {columns_file_out}")
+    columns_dir_out = f"results/columns.{max_num_clades}"
+    save_columns(columns, columns_dir_out)
+    logger.info(f"Saved {columns_dir_out}")
+    if args.incremental:
+        counts_dir_out = update_count_store(columns, f"results/counts.{max_num_clades}")
+        logger.info(f"Updated {counts_dir_out}")
     del columns
 
-    # Convert from nucleotide mutations to amino acid mutations.
-    nuc_mutations_by_clade = load_mutation_tree(pruned_tree_filename)[0]
-    assert nuc_mutations_by_clade
-    aa_mutations_by_clade = {
-        clade: nuc_mutations_to_aa_mutations(mutations)
-        for clade, mutations in nuc_mutations_by_clade.items()
-    }
+    # Convert from nucleotide mutations to amino acid mutations. Pruning
+    # preserves the mutations of each meso-scale clade, so these can be read
+    # from the fine tree.
+    clades = sorted(fine_to_meso.meso_set)
+    nuc_mutation_sets = [nuc_mutations_by_clade[clade] for clade in clades]
+    aa_mutation_sets = get_translator().translate_batch(nuc_mutation_sets)
 
-    # Create dense aa features.
-    clades = sorted(nuc_mutations_by_clade)
-    clade_ids = {k: i for i, k in enumerate(clades)}
-    aa_mutations = sorted(set().union(*aa_mutations_by_clade.values()))
+    # Create aa features as CSR indices of nonzero entries, with rows ordered
+    # as clades and columns ordered as aa_mutations.
+    aa_mutations = sorted(set().union(*aa_mutation_sets))
     logger.info(f"Found {len(aa_mutations)} amino acid mutations")
     mutation_ids = {k: i for i, k in enumerate(aa_mutations)}
-    aa_features = torch.zeros(len(clade_ids), len(mutation_ids), dtype=torch.bool)
-    for clade, ms in aa_mutations_by_clade.items():
-        i = clade_ids[clade]
-        for m in ms:
-            j = mutation_ids.get(m)
-            aa_features[i, j] = True
-
-    # Save features.
+    col_indices = [sorted(map(mutation_ids.__getitem__, ms)) for ms in aa_mutation_sets]
+    crow_indices = torch.tensor([0] + list(map(len, col_indices))).cumsum(0)
+    col_indices = torch.tensor(
+        list(itertools.chain.from_iterable(col_indices)), dtype=torch.long
+    )
+    shape = len(clades), len(aa_mutations)
+
+    # Save features, either densely or as sparse CSR indices.
     features = {
         "clades": clades,
         "clade_to_lineage": fine_to_coarse,
         "lineage_to_clade": coarse_to_fine,
         "aa_mutations": aa_mutations,
-        "aa_features": aa_features,
     }
+    if args.sparse_features:
+        features["aa_features_csr"] = {
+            "crow_indices": crow_indices,
+            "col_indices": col_indices,
+            "shape": shape,
+        }
+    else:
+        aa_features = torch.zeros(shape, dtype=torch.bool)
+        rows = torch.arange(shape[0]).repeat_interleave(crow_indices.diff())
+        aa_features[rows, col_indices] = True
+        features["aa_features"] = aa_features
     features_file_out = f"results/features.{max_num_clades}.1.pt"
-    logger.info(f"saving {tuple(aa_features.shape)} aa features to {features_file_out}")
+    logger.info(
+        f"saving {shape} aa features with {len(col_indices)} nonzeros "
+        f"to {features_file_out}"
+    )
     torch.save(features, features_file_out)
     logger.info(f"Saved {features_file_out}")
 
@@ -413,8 +550,14 @@ def main(args):
     fine_proto = args.tree_file_out
     fine_to_coarse = refine_mutation_tree(coarse_proto, fine_proto)
 
+    # Load the fine tree once, to share among all granularities.
+    nuc_mutations_by_clade, proto, tree = load_mutation_tree(fine_proto)
+    assert nuc_mutations_by_clade
+
     # Create columns.
-    columns, nodename_to_count = load_metadata(args)
+    columns, nodename_to_count = load_metadata(
+        args, nuc_mutations_by_clade, proto, tree
+    )
     columns["lineage"] = [fine_to_coarse[f] for f in columns["clade"]]
 
     # Choose the basal representative.
@@ -423,14 +566,19 @@ def main(args):
         coarse_to_fines[coarse].append(fine)
     coarse_to_fine = {c: min(fs) for c, fs in coarse_to_fines.items()}
 
-    # Extract features at various granularities.
-    for max_num_clades in map(int, args.max_num_clades.split(",")):
+    # Prune the tree to all granularities at once, then extract features.
+    max_num_clades = list(map(int, args.max_num_clades.split(",")))
+    fine_to_meso = prune_tree(
+        max_num_clades, coarse_to_fine, nodename_to_count, proto, tree
+    )
+    for n in max_num_clades:
         extract_features(
             args,
-            max_num_clades,
+            n,
             fine_to_coarse,
             coarse_to_fine,
-            nodename_to_count,
+            fine_to_meso[n],
+            nuc_mutations_by_clade,
             columns,
         )
 
@@ -451,6 +599,29 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--max-skippage", type=float, default=1e7)
     parser.add_argument("-c", "--max-num-clades", default="2000,3000,5000,10000")
     parser.add_argument("--start-date", default=START_DATE)
+    parser.add_argument(
+        "-p",
+        "--processes",
+        default=0,
+        type=int,
+        help="number of worker processes for parsing metadata, or 0 to parse serially",
+    )
+    parser.add_argument(
+        "--chunksize",
+        default=100000,
+        type=int,
+        help="number of metadata rows per parsing chunk",
+    )
+    parser.add_argument(
+        "--sparse-features",
+        action="store_true",
+        help="save aa features as sparse CSR indices rather than a dense matrix",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="also update results/counts.{N} stores of aggregated counts",
+    )
     args = parser.parse_args()
     args.start_date = try_parse_date(args.start_date)
     main(args)
@@ -0,0 +1,99 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from pyrocov.columnar import (
+    DictColumn,
+    concat_columns,
+    convert_columns,
+    load_columns,
+    save_columns,
+)
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_save_load(tmp_path, mmap):
+    expected = {
+        "day": [0, 5, 700, 5, 40000],
+        "location": ["Asia / China", "Africa", "Asia / China", "Europe", "Africa"],
+        "virus_name": ["a", None, "c", "d", "e"],
+    }
+    dirname = os.path.join(tmp_path, "columns")
+    save_columns(expected, dirname)
+    actual = load_columns(dirname, mmap=mmap)
+
+    assert list(actual) == list(expected)
+    assert isinstance(actual["day"], np.ndarray)
+    assert actual["day"].dtype == np.int32
+    assert actual["day"].tolist() == expected["day"]
+    assert isinstance(actual["location"], DictColumn)
+    assert actual["location"].tolist() == expected["location"]
+    assert actual["location"][2] == expected["location"][2]
+    assert actual["location"].value_counts() == {
+        "Asia / China": 2,
+        "Africa": 2,
+        "Europe": 1,
+    }
+    assert actual["virus_name"] == expected["virus_name"]
+
+
+def test_convert(tmp_path):
+    expected = {
+        "day": list(range(100)),
+        "clade": [f"fine.{i % 7}" for i in range(100)],
+    }
+    filename = os.path.join(tmp_path, "columns.pkl")
+    with open(filename, "wb") as f:
+        pickle.dump(expected, f)
+    dirname = convert_columns(filename)
+    assert dirname == os.path.join(tmp_path, "columns")
+    actual = load_columns(dirname)
+    assert actual["day"].dtype == np.int16
+    assert actual["day"].tolist() == expected["day"]
+    assert actual["clade"].tolist() == expected["clade"]
+    assert load_columns(filename) == expected
+
+
+def test_concat_columns():
+    parts = [
+        {
+            "day": np.array([0, 1]),
+            "location": DictColumn.from_list(["Africa", "Europe"]),
+            "virus_name": ["a", None],
+        },
+        {
+            "day": np.array([2]),
+            "location": DictColumn.from_list(["Europe"]),
+            "virus_name": ["c"],
+        },
+    ]
+    actual = concat_columns(parts)
+    assert actual["day"].tolist() == [0, 1, 2]
+    assert isinstance(actual["location"], DictColumn)
+    assert actual["location"].uniques == ["Africa", "Europe"]
+    assert actual["location"].tolist() == ["Africa", "Europe", "Europe"]
+    assert actual["virus_name"] == ["a", None, "c"]
+    assert concat_columns([]) == {}
+
+
+def test_dict_column_getitem():
+    values = ["a", "b", "a", "c", "b"]
+    column = DictColumn.from_list(values)
+    assert column[0] == "a"
+    assert column[np.int64(3)] == "c"
+    assert column[-1] == "b"
+    for index, expected in [
+        (slice(None, 2), values[:2]),
+        (slice(1, None, 2), values[1::2]),
+        ([0, 2], ["a", "a"]),
+        (np.array([3, 1]), ["c", "b"]),
+        (np.array([True, False, False, True, False]), ["a", "c"]),
+    ]:
+        actual = column[index]
+        assert isinstance(actual, DictColumn)
+        assert actual.tolist() == expected
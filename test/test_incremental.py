@@ -0,0 +1,122 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import pickle
+import random
+
+import pytest
+import torch
+
+from pyrocov.incremental import CountStore, update_count_store
+from pyrocov.mutrans import load_gisaid_data
+
+from .test_mutrans import random_gisaid_data
+
+
+def load_snapshot(filenames, offset=0):
+    with open(filenames["columns_filename"], "rb") as f:
+        columns = pickle.load(f)
+    num_rows = len(columns["day"])
+    columns["index"] = [f"EPI_ISL_{offset + i}" for i in range(num_rows)]
+    columns["lineage"] = [c.replace("fine", "B.1") for c in columns["clade"]]
+    return columns
+
+
+def next_snapshot(columns, new_columns):
+    """
+    Drops some rows, changes some rows, and adds some new rows.
+    """
+    rows = list(zip(*columns.values()))
+    new_rows = list(zip(*new_columns.values()))
+    rows = [row for row in rows if random.random() < 0.8]
+    for i in random.sample(range(len(rows)), 50):
+        row = list(rows[i])
+        row[0] = random.randrange(500)  # change day
+        rows[i] = tuple(row)
+    rows.extend(new_rows[: len(new_rows) // 2])
+    random.shuffle(rows)
+    return {k: list(v) for k, v in zip(columns, zip(*rows))}
+
+
+def distinct_rows(store):
+    columns = store.to_columns()
+    return sorted(zip(*(columns[k] for k in store.keys + ("count",))))
+
+
+def to_counts(dataset):
+    """
+    Converts a dataset to a location-order-invariant dict of counts.
+    """
+    weekly_clades = dataset["weekly_clades"]
+    result = {}
+    for location, p in dataset["location_id"].items():
+        result[location] = weekly_clades[:, p]
+    return result
+
+
+def test_update(tmp_path):
+    filenames1 = random_gisaid_data(str(tmp_path))
+    columns1 = load_snapshot(filenames1)
+    columns2 = next_snapshot(columns1, load_snapshot(filenames1, len(columns1["day"])))
+
+    store = CountStore()
+    assert store.update(columns1) == (len(columns1["day"]), 0)
+    num_appended, num_retracted = store.update(columns2)
+    assert len(store) == len(columns2["day"])
+    assert num_appended < len(columns2["day"])
+    assert num_retracted > 0
+
+    expected = CountStore()
+    expected.update(columns2)
+    assert distinct_rows(store) == distinct_rows(expected)
+
+
+@pytest.mark.parametrize("end_day", [None, 300])
+def test_load_gisaid_data(tmp_path, end_day):
+    filenames = random_gisaid_data(str(tmp_path))
+    columns1 = load_snapshot(filenames)
+    columns2 = next_snapshot(columns1, load_snapshot(filenames, len(columns1["day"])))
+    dirname = os.path.join(str(tmp_path), "counts")
+    update_count_store(columns1, dirname)
+    counts_dirname = update_count_store(columns2, dirname)
+    assert len(CountStore.load(dirname)) == len(columns2["day"])
+
+    with open(filenames["columns_filename"], "wb") as f:
+        pickle.dump(columns2, f)
+    kwargs = dict(end_day=end_day, min_region_size=15)
+    expected = load_gisaid_data(**filenames, **kwargs)
+    for vectorize in [False, True]:
+        actual = load_gisaid_data(
+            columns_filename=counts_dirname,
+            features_filename=filenames["features_filename"],
+            vectorize=vectorize,
+            **kwargs,
+        )
+        assert actual["weekly_clades"].shape == expected["weekly_clades"].shape
+        assert actual["clade_id"] == expected["clade_id"]
+        actual_counts = to_counts(actual)
+        expected_counts = to_counts(expected)
+        assert set(actual_counts) == set(expected_counts)
+        for location, counts in expected_counts.items():
+            assert torch.equal(actual_counts[location], counts), location
+
+
+def test_append_retract():
+    columns = {
+        "index": ["a", "b", "c"],
+        "day": [1, 2, 1],
+        "location": ["X / Y", "X / Y", "X / Z"],
+        "clade": ["fine.0", "fine.0", "fine.0"],
+        "lineage": ["B.1", "B.1", "B.1"],
+    }
+    store = CountStore()
+    store.append(columns)
+    assert store.count.sum() == 3
+    with pytest.raises(ValueError):
+        store.append(columns)
+    store.retract(["a", "c"])
+    assert len(store) == 1
+    assert store.count.tolist() == [1]
+    with pytest.raises(KeyError):
+        store.retract(["a"])
@@ -0,0 +1,359 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pyro
+import pytest
+import torch
+from pyro import poutine
+from pyro.infer import SVI
+
+from pyrocov import growth, mutrans
+from pyrocov.inference import (
+    LIKELIHOODS,
+    CompiledTrace_ELBO,
+    dense_likelihood,
+    expected_log_likelihood,
+    fused_likelihood,
+    get_likelihood,
+    make_guide,
+    predict,
+    sparse_likelihood,
+)
+
+from .test_mutrans import random_gisaid_data
+
+
+def random_nextstrain_dataset(T=8, P=5, L=6, F=4):
+    counts = torch.poisson(torch.rand(T, P, L) * 5)
+    counts[:, 0, 3] = 0
+    lineages = ["A", "B.1.1.7", "B.1.617.2", "AY.23.1", "B", "C"][:L]
+    return {
+        "features": (torch.rand(L, F) < 0.5).float(),
+        "time": torch.arange(float(T)) * growth.TIMESTEP / growth.GENERATION_TIME,
+        "weekly_counts": counts,
+        "sparse_counts": growth.dense_to_sparse(counts),
+        "place_lineage_index": counts.ne(0).any(0).reshape(-1).nonzero()[:, 0],
+        "mutations": [f"S:A{i}B" for i in range(F)],
+        "lineage_id": {name: i for i, name in enumerate(lineages)},
+        "location_id": {f"place{i}": i for i in range(P)},
+    }
+
+
+def test_get_likelihood():
+    assert get_likelihood("") is sparse_likelihood
+    assert get_likelihood("reparam") is sparse_likelihood
+    assert get_likelihood("reparam-dense") is dense_likelihood
+    assert get_likelihood("reparam-fused") is fused_likelihood
+    assert set(LIKELIHOODS) >= {"sparse", "dense", "fused"}
+
+
+@pytest.mark.parametrize("backend", ["dense", "fused"])
+@pytest.mark.parametrize("model_type", ["", "reparam"])
+def test_growth_likelihoods(model_type, backend):
+    torch.manual_seed(0)
+    dataset = random_nextstrain_dataset()
+    sparse = poutine.trace(growth.model).get_trace(dataset, model_type)
+    other = poutine.trace(poutine.replay(growth.model, trace=sparse)).get_trace(
+        dataset, model_type + "-" + backend
+    )
+    sparse.compute_log_prob()
+    other.compute_log_prob()
+    actual = other.nodes["obs"]["log_prob_sum"]
+    expected = sparse.nodes["obs"]["log_prob_sum"]
+    assert torch.allclose(actual, expected, rtol=1e-4)
+
+
+@pytest.mark.parametrize("backend", ["dense", "fused"])
+@pytest.mark.parametrize("model_type", ["", "localrate"])
+def test_mutrans_likelihoods(tmp_path, model_type, backend):
+    filenames = random_gisaid_data(str(tmp_path))
+    dataset = mutrans.load_gisaid_data(**filenames, min_region_size=15)
+    sparse = poutine.trace(mutrans.model).get_trace(dataset, model_type)
+    other = poutine.trace(poutine.replay(mutrans.model, trace=sparse)).get_trace(
+        dataset, model_type + "-" + backend
+    )
+    sparse.compute_log_prob()
+    other.compute_log_prob()
+    actual = other.nodes["obs"]["log_prob_sum"]
+    expected = sparse.nodes["obs"]["log_prob_sum"]
+    assert torch.allclose(actual, expected, rtol=1e-4)
+
+
+@pytest.mark.parametrize("backend", ["", "-fused"])
+def test_memory_budget(backend):
+    torch.manual_seed(0)
+    dataset = random_nextstrain_dataset()
+    model_type = "reparam" + backend
+    expected = poutine.trace(growth.model).get_trace(dataset, model_type)
+    actual = poutine.trace(poutine.replay(growth.model, trace=expected)).get_trace(
+        dataset, model_type, memory_budget=1000
+    )
+    expected.compute_log_prob()
+    actual.compute_log_prob()
+    assert torch.allclose(
+        actual.nodes["obs"]["log_prob_sum"],
+        expected.nodes["obs"]["log_prob_sum"],
+        rtol=1e-4,
+    )
+
+    expected = poutine.trace(poutine.replay(growth.model, trace=expected)).get_trace(
+        dataset, model_type, forecast_steps=2
+    )
+    actual = poutine.trace(poutine.replay(growth.model, trace=expected)).get_trace(
+        dataset, model_type, forecast_steps=2, memory_budget=1000
+    )
+    assert torch.allclose(
+        actual.nodes["probs"]["value"], expected.nodes["probs"]["value"]
+    )
+
+
+def test_predict_memory_budget(monkeypatch):
+    torch.set_default_dtype(torch.double)
+    try:
+        dataset = random_nextstrain_dataset()
+        dataset = {
+            k: v.double() if torch.is_tensor(v) and v.is_floating_point() else v
+            for k, v in dataset.items()
+        }
+        pyro.clear_param_store()
+        guide = make_guide(growth.model, "normal", growth.InitLocFn(dataset))
+        guide(dataset, "reparam")
+
+        model_budgets = []
+        itemsizes = []
+        time_chunk_size = growth.time_chunk_size
+
+        def model(*args, memory_budget=None, **kwargs):
+            model_budgets.append(memory_budget)
+            return growth.model(*args, memory_budget=memory_budget, **kwargs)
+
+        def recording_time_chunk_size(*args, itemsize=4):
+            itemsizes.append(itemsize)
+            return time_chunk_size(*args, itemsize=itemsize)
+
+        monkeypatch.setattr(growth, "time_chunk_size", recording_time_chunk_size)
+        memory_budget = 100000
+        predict(
+            model,
+            guide,
+            dataset,
+            "reparam",
+            num_samples=20,
+            forecast_steps=2,
+            memory_budget=memory_budget,
+        )
+    finally:
+        torch.set_default_dtype(torch.float)
+
+    # The model and each batch of samples share the budget.
+    assert set(model_budgets) == {memory_budget // 2}
+    assert len(model_budgets) > 2  # The samples were split into batches.
+    assert set(itemsizes) == {8}
+
+
+@pytest.mark.parametrize("guide_type", ["map", "normal"])
+@pytest.mark.parametrize("model_type", ["reparam", "reparam-dense", "reparam-fused"])
+def test_expected_log_likelihood(model_type, guide_type):
+    torch.manual_seed(0)
+    dataset = random_nextstrain_dataset()
+    pyro.clear_param_store()
+    guide = make_guide(growth.model, guide_type, growth.InitLocFn(dataset))
+    guide(dataset, model_type)
+
+    args = growth.model, guide, dataset, model_type
+    expected, expected_se = expected_log_likelihood(
+        *args, num_particles=100, vectorize=False
+    )
+    for memory_budget in [None, 10000]:
+        actual, actual_se = expected_log_likelihood(
+            *args, num_particles=100, vectorize=True, memory_budget=memory_budget
+        )
+        if guide_type == "map":
+            assert actual == pytest.approx(expected, rel=1e-5)
+            assert actual_se == pytest.approx(0, abs=1e-3)
+        else:
+            assert actual_se > 0
+            assert abs(actual - expected) < 5 * (actual_se**2 + expected_se**2) ** 0.5
+
+
+@pytest.mark.parametrize("batch_size", [None, 7])
+@pytest.mark.parametrize("guide_type", ["map", "normal", "custom"])
+def test_predict_vectorized(tmp_path, guide_type, batch_size):
+    filenames = random_gisaid_data(str(tmp_path))
+    dataset = mutrans.load_gisaid_data(**filenames, min_region_size=15)
+    pyro.clear_param_store()
+    guide = make_guide(mutrans.model, guide_type, mutrans.InitLocFn(dataset))
+    guide(dataset, "reparam")
+
+    args = mutrans.model, guide, dataset, "reparam"
+    kwargs = dict(num_samples=100, forecast_steps=2, quantiles=(0.1, 0.9))
+    expected = predict(*args, vectorize=False, **kwargs)
+    actual = predict(*args, vectorize=True, batch_size=batch_size, **kwargs)
+    for name, value in expected["mean"].items():
+        assert actual["mean"][name].shape == value.shape, name
+        assert torch.allclose(actual["mean"][name], value, atol=0.05), name
+        assert actual["std"][name].shape == value.shape, name
+        assert actual["quantiles"][name].shape == (2,) + value.shape, name
+        assert (actual["quantiles"][name][0] <= actual["quantiles"][name][1]).all()
+    if guide_type == "map":
+        for name, value in actual["std"].items():
+            assert torch.allclose(value, torch.zeros_like(value), atol=1e-5), name
+
+
+def test_fit_svi_telemetry():
+    dataset = random_nextstrain_dataset()
+    kwargs = dict(
+        model_type="reparam",
+        guide_type="custom",
+        num_steps=12,
+        num_samples=10,
+        jit=False,
+        log_every=5,
+    )
+    eager = growth.fit_svi(dataset, telemetry="eager", **kwargs)
+    buffered = growth.fit_svi(dataset, telemetry="buffered", **kwargs)
+    assert buffered["losses"] == eager["losses"]
+    assert set(buffered["series"]) == set(eager["series"])
+    for name, actual in buffered["series"].items():
+        expected = eager["series"][name]
+        if name not in buffered["params"] and name != "loss":
+            # Scalar medians are recorded only at logging steps and the end.
+            expected = [expected[i] for i in [0, 5, 10, 11]]
+        assert actual == pytest.approx(expected), name
+
+
+@pytest.mark.parametrize("backend", ["fx", "eager"])
+def test_fit_svi_compiled(tmp_path, caplog, backend):
+    filenames = random_gisaid_data(str(tmp_path))
+    dataset = mutrans.load_gisaid_data(**filenames, min_region_size=15)
+    kwargs = dict(
+        model_type="reparam-localinit",
+        guide_type="map",
+        num_steps=6,
+        num_samples=10,
+        jit=False,
+        num_ell_particles=0,
+    )
+    expected = mutrans.fit_svi(dataset, **kwargs)
+    actual = mutrans.fit_svi(dataset, compile_backend=backend, **kwargs)
+    assert "falling back" not in caplog.text
+    assert actual["losses"] == pytest.approx(expected["losses"], rel=1e-5)
+    for name, value in expected["params"].items():
+        assert torch.allclose(actual["params"][name], value, atol=1e-4), name
+
+
+def test_compiled_elbo_stochastic(tmp_path, caplog):
+    filenames = random_gisaid_data(str(tmp_path))
+    dataset = mutrans.load_gisaid_data(**filenames, min_region_size=15)
+    model_type = "reparam-localinit"
+
+    # The traced graph should draw fresh noise on each step.
+    pyro.clear_param_store()
+    guide = make_guide(mutrans.model, "full", mutrans.InitLocFn(dataset))
+    guide(dataset, model_type)
+    elbo = CompiledTrace_ELBO(backend="fx")
+    losses = [
+        elbo.loss_and_grads(mutrans.model, guide, dataset, model_type) for _ in range(4)
+    ]
+    assert elbo._graph is not None
+    assert len(set(losses[1:])) == 3
+
+    # Long-run fits should agree with Trace_ELBO.
+    kwargs = dict(
+        model_type=model_type,
+        guide_type="full",
+        num_steps=100,
+        num_samples=10,
+        jit=False,
+        num_ell_particles=0,
+    )
+    expected = mutrans.fit_svi(dataset, **kwargs)
+    actual = mutrans.fit_svi(dataset, compile_backend="fx", **kwargs)
+    assert "falling back" not in caplog.text
+    expected_loss = torch.tensor(expected["losses"][-25:]).mean()
+    actual_loss = torch.tensor(actual["losses"][-25:]).mean()
+    assert actual_loss == pytest.approx(expected_loss, rel=0.01)
+    for name, value in expected["median"].items():
+        if value.numel() == 1:
+            assert actual["median"][name].item() == pytest.approx(
+                value.item(), rel=0.2
+            ), name
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupted_fit_svi(monkeypatch, dataset, max_steps, **kwargs):
+    step = SVI.step
+    num_calls = [0]
+
+    def interrupted_step(*args, **kwargs):
+        num_calls[0] += 1
+        if num_calls[0] > max_steps:
+            raise Interrupted
+        return step(*args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(SVI, "step", interrupted_step)
+        with pytest.raises(Interrupted):
+            growth.fit_svi(dataset, **kwargs)
+
+
+@pytest.mark.parametrize("telemetry", ["eager", "buffered"])
+def test_fit_svi_checkpoint(tmp_path, monkeypatch, telemetry):
+    dataset = random_nextstrain_dataset()
+    kwargs = dict(
+        model_type="reparam",
+        guide_type="custom",
+        num_steps=12,
+        num_samples=10,
+        jit=False,
+        log_every=5,
+        telemetry=telemetry,
+    )
+    expected = growth.fit_svi(dataset, **kwargs)
+
+    # Interrupt a fit after a few checkpoints.
+    filename = str(tmp_path / "checkpoint.pt")
+    kwargs.update(checkpoint_filename=filename, checkpoint_every=4)
+    interrupted_fit_svi(monkeypatch, dataset, 10, **kwargs)
+    assert torch.load(filename)["step"] == 8
+
+    # Resume and check the result is unchanged.
+    actual = growth.fit_svi(dataset, **kwargs)
+    assert not os.path.exists(filename)
+    assert actual["losses"] == expected["losses"]
+    assert actual["series"] == expected["series"]
+    for name, value in expected["params"].items():
+        assert torch.equal(actual["params"][name], value), name
+    for name, value in expected["median"].items():
+        assert torch.equal(actual["median"][name], value), name
+
+
+@pytest.mark.parametrize(
+    "update",
+    [{"num_steps": 16}, {"model_type": "reparam-dense"}, {"guide_type": "normal"}],
+)
+def test_fit_svi_checkpoint_mismatch(tmp_path, monkeypatch, caplog, update):
+    dataset = random_nextstrain_dataset()
+    kwargs = dict(
+        model_type="reparam",
+        guide_type="custom",
+        num_steps=12,
+        num_samples=10,
+        jit=False,
+        checkpoint_filename=str(tmp_path / "checkpoint.pt"),
+        checkpoint_every=4,
+    )
+    interrupted_fit_svi(monkeypatch, dataset, 10, **kwargs)
+
+    # A mismatched checkpoint is ignored, so training starts from scratch.
+    kwargs.update(update)
+    actual = growth.fit_svi(dataset, **kwargs)
+    assert "Ignoring" in caplog.text
+    kwargs["checkpoint_filename"] = None
+    expected = growth.fit_svi(dataset, **kwargs)
+    assert actual["losses"] == expected["losses"]
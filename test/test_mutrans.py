@@ -0,0 +1,216 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import pickle
+import random
+
+import pytest
+import torch
+from pyro import poutine
+
+from pyrocov.columnar import convert_columns
+from pyrocov.mutrans import (
+    GisaidEndDayViews,
+    load_gisaid_data,
+    model,
+    rank_loo_lineages,
+    subset_gisaid_data,
+    zero_clades,
+)
+
+
+def random_gisaid_data(
+    dirname, num_rows=2000, num_clades=20, num_mutations=10, sparse_features=False
+):
+    """
+    Writes synthetic columns and features files, returning their filenames.
+    """
+    clades = [f"fine.{i}" for i in range(num_clades)]
+    lineages = [f"B.1.{i}" for i in range(num_clades // 2)]
+    clade_to_lineage = {c: lineages[i // 2] for i, c in enumerate(clades)}
+    lineage_to_clade = {lineage: clades[2 * i] for i, lineage in enumerate(lineages)}
+    locations = ["Asia / China", "Oceania / Australia / Victoria", "Africa"]
+    for region in ["Europe", "North America"]:
+        for country in range(3):
+            locations.append(f"{region} / country{country}")
+            for state in range(4):
+                locations.append(f"{region} / country{country} / state{state}")
+                locations.append(f"{region}/ country{country}/state{state} / city")
+    columns = {
+        "day": [random.randrange(500) for _ in range(num_rows)],
+        "location": [random.choice(locations) for _ in range(num_rows)],
+        "clade": [random.choice(clades + ["fine.unsampled"]) for _ in range(num_rows)],
+    }
+    features = {
+        "clades": clades,
+        "clade_to_lineage": clade_to_lineage,
+        "lineage_to_clade": lineage_to_clade,
+        "aa_mutations": [f"S:A{i}B" for i in range(num_mutations)],
+        "aa_features": torch.rand(num_clades, num_mutations) < 0.3,
+    }
+    if sparse_features:
+        aa_features = features.pop("aa_features")
+        features["aa_features_csr"] = {
+            "crow_indices": torch.cat([torch.zeros(1), aa_features.sum(-1)])
+            .cumsum(0)
+            .long(),
+            "col_indices": aa_features.nonzero()[:, 1],
+            "shape": aa_features.shape,
+        }
+    columns_filename = os.path.join(dirname, "columns.pkl")
+    features_filename = os.path.join(dirname, "features.pt")
+    with open(columns_filename, "wb") as f:
+        pickle.dump(columns, f)
+    torch.save(features, features_filename)
+    return {
+        "columns_filename": columns_filename,
+        "features_filename": features_filename,
+    }
+
+
+def assert_equal(actual, expected, name=""):
+    assert type(actual) is type(expected), name
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected), name
+        for k, v in expected.items():
+            assert_equal(actual[k], v, f"{name}[{repr(k)}]")
+    elif isinstance(expected, torch.Tensor):
+        assert actual.dtype == expected.dtype, name
+        assert actual.shape == expected.shape, name
+        assert torch.equal(actual, expected), name
+    else:
+        assert actual == expected, name
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+@pytest.mark.parametrize("end_day", [None, 300])
+@pytest.mark.parametrize(
+    "include,exclude",
+    [
+        ({}, {}),
+        ({"location": "^Europe"}, {}),
+        ({}, {"location": "^Europe"}),
+        ({"clade": "1"}, {"location": "state2"}),
+    ],
+)
+def test_load_gisaid_data_vectorize(tmp_path, include, exclude, end_day, columnar):
+    filenames = random_gisaid_data(str(tmp_path))
+    kwargs = dict(include=include, exclude=exclude, end_day=end_day, min_region_size=15)
+    expected = load_gisaid_data(vectorize=False, **filenames, **kwargs)
+    if columnar:
+        filenames["columns_filename"] = convert_columns(filenames["columns_filename"])
+    actual = load_gisaid_data(vectorize=True, **filenames, **kwargs)
+    assert_equal(actual, expected)
+
+
+@pytest.mark.parametrize("end_day", [None, 300])
+def test_load_gisaid_data_sparse(tmp_path, end_day):
+    filenames = random_gisaid_data(str(tmp_path))
+    kwargs = dict(end_day=end_day, min_region_size=15)
+    expected = load_gisaid_data(**filenames, **kwargs)
+    actual = load_gisaid_data(sparse=True, **filenames, **kwargs)
+    assert actual["weekly_clades"].is_sparse
+    actual["weekly_clades"] = actual["weekly_clades"].to_dense()
+    assert_equal(actual, expected)
+
+
+def test_subset_gisaid_data_sparse(tmp_path):
+    filenames = random_gisaid_data(str(tmp_path))
+    dense = load_gisaid_data(**filenames, min_region_size=15)
+    sparse = load_gisaid_data(sparse=True, **filenames, min_region_size=15)
+    assert rank_loo_lineages(sparse) == rank_loo_lineages(dense)
+
+    expected = subset_gisaid_data(dense, max_clades=10)
+    actual = subset_gisaid_data(sparse, max_clades=10)
+    assert actual["weekly_clades"].is_sparse
+    actual["weekly_clades"] = actual["weekly_clades"].to_dense()
+    assert_equal(actual, expected)
+
+    heldout = [0, 3, 5]
+    expected = zero_clades(dense["weekly_clades"], heldout)
+    actual = zero_clades(sparse["weekly_clades"], heldout)
+    assert expected[:, :, heldout].eq(0).all()
+    assert torch.equal(actual.to_dense(), expected)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("sparse_file", [False, True])
+def test_load_gisaid_data_sparse_features(tmp_path, sparse_file, sparse):
+    random.seed(0)
+    torch.manual_seed(0)
+    filenames = random_gisaid_data(str(tmp_path))
+    expected = load_gisaid_data(**filenames, min_region_size=15)
+    random.seed(0)
+    torch.manual_seed(0)
+    filenames = random_gisaid_data(str(tmp_path), sparse_features=sparse_file)
+    actual = load_gisaid_data(sparse_features=sparse, **filenames, min_region_size=15)
+    assert actual["features"].is_sparse == sparse
+    actual["features"] = actual["features"].to_dense()
+    assert_equal(actual, expected)
+
+    expected = subset_gisaid_data(expected, max_clades=10)
+    actual = subset_gisaid_data(
+        load_gisaid_data(sparse_features=sparse, **filenames, min_region_size=15),
+        max_clades=10,
+    )
+    actual["features"] = actual["features"].to_dense()
+    assert_equal(actual, expected)
+
+
+def test_subset_gisaid_data_sparse_features(tmp_path):
+    filenames = random_gisaid_data(str(tmp_path))
+    dense = load_gisaid_data(**filenames, min_region_size=15)
+    features = dense["features"]
+    features[:, 0] = 0  # constant, dropped
+    features[:, 1] = 1  # constant, dropped
+    features[:, 2] = 0
+    features[0, 2] = 1  # a single nonzero, kept
+    features[:, 3] = 1
+    features[-1, 3] = 0  # a single zero, kept
+    sparse = dict(dense, features=features.to_sparse())
+
+    expected = subset_gisaid_data(dense)
+    actual = subset_gisaid_data(sparse)
+    assert actual["features"].is_sparse
+    assert actual["mutations"] == expected["mutations"]
+    assert "S:A0B" not in actual["mutations"]
+    assert "S:A1B" not in actual["mutations"]
+    assert {"S:A2B", "S:A3B"} <= set(actual["mutations"])
+    assert torch.equal(actual["features"].to_dense(), expected["features"])
+
+
+@pytest.mark.parametrize("model_type", ["", "dense", "localrate"])
+def test_model_sparse(tmp_path, model_type):
+    filenames = random_gisaid_data(str(tmp_path))
+    dense = load_gisaid_data(**filenames, min_region_size=15)
+    sparse = load_gisaid_data(
+        sparse=True, sparse_features=True, **filenames, min_region_size=15
+    )
+    assert sparse["features"].is_sparse
+    expected = poutine.trace(model).get_trace(dense, model_type)
+    actual = poutine.trace(poutine.replay(model, trace=expected)).get_trace(
+        sparse, model_type
+    )
+    assert torch.allclose(actual.log_prob_sum(), expected.log_prob_sum())
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize(
+    "include,exclude",
+    [
+        ({}, {}),
+        ({"clade": "1"}, {"location": "state2"}),
+    ],
+)
+def test_end_day_views(tmp_path, include, exclude, sparse):
+    filenames = random_gisaid_data(str(tmp_path))
+    kwargs = dict(include=include, exclude=exclude, min_region_size=15, sparse=sparse)
+    views = GisaidEndDayViews(**filenames, **kwargs)
+    for end_day in [300, None, 6, 154, 155, 499]:
+        expected = load_gisaid_data(end_day=end_day, **filenames, **kwargs)
+        actual = views(end_day)
+        if sparse:
+            expected["weekly_clades"] = expected["weekly_clades"].to_dense()
+            actual["weekly_clades"] = actual["weekly_clades"].to_dense()
+        assert_equal(actual, expected)
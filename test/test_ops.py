@@ -8,8 +8,11 @@ from torch.autograd import grad
 
 from pyrocov.ops import (
     logistic_logsumexp,
+    logistic_multinomial_likelihood,
+    logistic_probs,
     sparse_multinomial_likelihood,
     sparse_poisson_likelihood,
+    time_chunk_size,
 )
 
 
@@ -64,3 +67,83 @@ def test_sparse_multinomial_likelihood(T, P, S):
     nonzero_logits = logits[nnz]
     actual = sparse_multinomial_likelihood(total_count, nonzero_logits, nonzero_value)
     assert torch.allclose(actual, expected)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 100])
+@pytest.mark.parametrize("T,P,C", [(1, 1, 2), (5, 6, 7), (8, 9, 10)])
+def test_logistic_multinomial_likelihood(T, P, C, chunk_size):
+    init = torch.randn(P, C, requires_grad=True)
+    rate = torch.randn(P, C, requires_grad=True)
+    time = torch.randn(T)
+    logits = init.detach() + rate.detach() * time[:, None, None]
+    value = dist.Poisson(logits.exp()).sample()
+    value[0, 0] = 0  # ensure some (t,p) pairs are empty
+    sparse = value.nonzero(as_tuple=True)
+    args = value.sum(-1), init, rate, time, sparse, value[sparse]
+
+    expected = logistic_multinomial_likelihood(*args, backend="naive")
+    actual = logistic_multinomial_likelihood(
+        *args, backend="fused", chunk_size=chunk_size
+    )
+    assert torch.allclose(actual, expected, rtol=1e-4)
+
+    expected_grads = grad(expected, [init, rate])
+    actual_grads = grad(actual, [init, rate])
+    for e, a, name in zip(expected_grads, actual_grads, ["init", "rate"]):
+        assert torch.allclose(a, e, rtol=1e-4, atol=1e-4), name
+
+
+def test_time_chunk_size():
+    assert time_chunk_size(None, 10, 100) == 10
+    assert time_chunk_size(4000, 10, 100) == 10
+    assert time_chunk_size(1200, 10, 100) == 3
+    assert time_chunk_size(1200, 10, 100, itemsize=8) == 1
+    assert time_chunk_size(1, 10, 100) == 1
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 3])
+@pytest.mark.parametrize("batch_shape", [(), (4, 1)])
+def test_logistic_probs(batch_shape, chunk_size):
+    T, P, C, L = 5, 6, 7, 3
+    init = torch.randn(batch_shape + (P, C))
+    rate = torch.randn(batch_shape + (P, C))
+    time = torch.randn(T)
+    index = torch.randint(0, L, (C,))
+    probs = (init + rate * time[:, None, None]).softmax(-1)
+    assert probs.shape == batch_shape[:1] + (T, P, C)
+
+    actual = logistic_probs(init, rate, time, chunk_size=chunk_size)
+    assert torch.allclose(actual, probs)
+
+    expected = probs.new_zeros(probs.shape[:-1] + (L,))
+    expected.scatter_add_(-1, index.expand_as(probs), probs)
+    actual = logistic_probs(
+        init, rate, time, index=index, size=L, chunk_size=chunk_size
+    )
+    assert torch.allclose(actual, expected)
+
+
+@pytest.mark.parametrize("backend", ["naive", "fused"])
+def test_logistic_multinomial_likelihood_batched(backend):
+    B, T, P, C = 3, 5, 6, 7
+    init = torch.randn(B, P, C, requires_grad=True)
+    rate = torch.randn(B, P, C, requires_grad=True)
+    time = torch.randn(T)
+    value = dist.Poisson(torch.ones(T, P, C)).sample()
+    sparse = value.nonzero(as_tuple=True)
+
+    def fn(init, rate):
+        return logistic_multinomial_likelihood(
+            value.sum(-1), init, rate, time, sparse, value[sparse], backend=backend
+        )
+
+    actual = fn(init, rate)
+    assert actual.shape == (B,)
+    expected = torch.stack([fn(init[b], rate[b]) for b in range(B)])
+    assert torch.allclose(actual, expected, rtol=1e-4)
+
+    weights = torch.randn(B)
+    actual_grads = grad((actual * weights).sum(), [init, rate])
+    expected_grads = grad((expected * weights).sum(), [init, rate])
+    for e, a, name in zip(expected_grads, actual_grads, ["init", "rate"]):
+        assert torch.allclose(a, e, rtol=1e-4, atol=1e-4), name
@@ -0,0 +1,155 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import pickle
+import random
+
+import pytest
+
+from pyrocov.columnar import load_columns
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "scripts",
+    "preprocess_gisaid.py",
+)
+spec = importlib.util.spec_from_file_location("preprocess_gisaid", SCRIPT)
+preprocess_gisaid = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(preprocess_gisaid)
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        (
+            b'{"covv_note": "sequence", "a": "x", "sequence": "ACGT"}',
+            {"covv_note": "sequence", "a": "x", "sequence": None},
+        ),
+        (
+            b'{"sequence": null, "covv_lineage": "B.1"}',
+            {"sequence": None, "covv_lineage": "B.1"},
+        ),
+        (
+            b'{"sequence": 5, "covv_lineage": "B.1"}',
+            {"sequence": 5, "covv_lineage": "B.1"},
+        ),
+        (
+            b'{"sequence" : "ACGT", "covv_lineage": "B.1"}\n',
+            {"sequence": None, "covv_lineage": "B.1"},
+        ),
+        (
+            b'{"a": "x, \\"sequence\\": \\"AC\\"", "sequence":"ACGT"}',
+            {"a": 'x, "sequence": "AC"', "sequence": None},
+        ),
+        (b'{"covv_lineage": "B.1"}', {"covv_lineage": "B.1"}),
+    ],
+)
+def test_parse_line(line, expected):
+    assert preprocess_gisaid.parse_line(line) == expected
+
+
+def write_feed(filename, num_lines, seed=0):
+    rng = random.Random(seed)
+    with open(filename, "w") as f:
+        for i in range(num_lines):
+            datum = {
+                "covv_virus_name": f"hCoV-19/virus/{i}",
+                "covv_accession_id": f"EPI_ISL_{i}",
+                "covv_collection_date": rng.choice(
+                    ["2020", "2020-05", "2021-01-03", "2021-02-14"]
+                ),
+                "covv_location": rng.choice(["Europe / A", "Asia / B", "Asia / C"]),
+                "covv_add_location": rng.choice(["", "x"]),
+                "covv_lineage": rng.choice(["B.1", "B.1.1.7", "A.1", ""]),
+                "sequence": "".join(rng.choices("ACGT", k=rng.randrange(1, 20))),
+            }
+            f.write(json.dumps(datum) + "\n")
+
+
+def tolist(column):
+    return column.tolist() if hasattr(column, "tolist") else list(column)
+
+
+def test_streaming(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    filename = str(tmp_path / "gisaid.json")
+    write_feed(filename, 100)
+    assert len(preprocess_gisaid.get_byte_ranges(filename, 16)) > 1
+
+    def run(streaming):
+        name = "streaming" if streaming else "legacy"
+        args = argparse.Namespace(
+            gisaid_file_in=filename,
+            columns_file_out=str(tmp_path / f"{name}.columns.pkl"),
+            stats_file_out=str(tmp_path / f"{name}.stats.pkl"),
+            start_date=datetime.datetime(2020, 1, 1),
+            truncate=preprocess_gisaid.DEFAULT_TRUNCATE,
+            streaming=streaming,
+            processes=0,
+        )
+        preprocess_gisaid.main(args)
+        if streaming:
+            columns = load_columns(args.columns_file_out[: -len(".pkl")])
+        else:
+            columns = load_columns(args.columns_file_out)
+        with open(args.stats_file_out, "rb") as f:
+            stats = pickle.load(f)
+        return {k: tolist(v) for k, v in columns.items()}, stats
+
+    expected_columns, expected_stats = run(streaming=False)
+    actual_columns, actual_stats = run(streaming=True)
+    assert expected_columns["day"]
+    assert actual_columns == expected_columns
+    assert actual_stats == expected_stats
+
+
+def test_byte_range_boundaries(tmp_path):
+    filename = str(tmp_path / "gisaid.json")
+    write_feed(filename, 20)
+    with open(filename, "rb") as f:
+        lines = f.readlines()
+    size = sum(map(len, lines))
+    line_starts = [sum(map(len, lines[:i])) for i in range(len(lines))]
+    start_date = datetime.datetime(2020, 1, 1)
+
+    def parse(byte_range):
+        num_lines, columns, stats = preprocess_gisaid.parse_byte_range(
+            filename, start_date, byte_range
+        )
+        return num_lines, {k: tolist(v) for k, v in columns.items()}
+
+    expected = parse((0, size))
+    assert expected[0] == len(lines)
+    for bound in line_starts[1:]:
+        head = parse((0, bound))
+        tail = parse((bound, size))
+        assert head[0] + tail[0] == len(lines)
+        actual = {k: head[1].get(k, []) + tail[1].get(k, []) for k in expected[1]}
+        assert actual == expected[1]
+
+    for num_ranges in [2, 3, 5, len(lines)]:
+        ranges = preprocess_gisaid.get_byte_ranges(filename, num_ranges)
+        assert ranges[0][0] == 0 and ranges[-1][1] == size
+        for (_, end), (begin, _) in zip(ranges[:-1], ranges[1:]):
+            assert end == begin and begin in line_starts
+        assert sum(parse(r)[0] for r in ranges) == len(lines)
+
+    # Pad lines to equal width so that size * i // num_ranges falls exactly on
+    # a line start.
+    width = max(map(len, lines))
+    with open(filename, "wb") as f:
+        for line in lines:
+            f.write(line[:-1].ljust(width - 1) + b"\n")
+    for num_ranges in [2, 4, 5, 10]:
+        assert (width * len(lines)) % num_ranges == 0
+        ranges = preprocess_gisaid.get_byte_ranges(filename, num_ranges)
+        assert all(begin % width == 0 for begin, _ in ranges)
+        assert sum(parse(r)[0] for r in ranges) == len(lines)
+        actual = [parse(r)[1] for r in ranges]
+        actual = {k: [x for a in actual for x in a.get(k, [])] for k in expected[1]}
+        assert actual == expected[1]
@@ -0,0 +1,43 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import importlib.util
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "scripts",
+    "preprocess_usher.py",
+)
+spec = importlib.util.spec_from_file_location("preprocess_usher", SCRIPT)
+preprocess_usher = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(preprocess_usher)
+
+
+def slow_square(x):
+    time.sleep(0.01)
+    return x * x
+
+
+def test_imap_bounded():
+    num_read = [0]
+    lock = threading.Lock()
+
+    def items():
+        for i in range(200):
+            with lock:
+                num_read[0] += 1
+            yield i
+
+    max_pending = 4
+    with ThreadPool(2) as pool:
+        results = preprocess_usher.imap_bounded(pool, slow_square, items(), max_pending)
+        actual = []
+        for result in results:
+            # The consumer is never more than max_pending items behind.
+            assert num_read[0] <= len(actual) + max_pending + 1
+            actual.append(result)
+    assert actual == [i * i for i in range(200)]
@@ -1,8 +1,70 @@
 # Copyright Contributors to the Pyro-Cov project.
 # SPDX-License-Identifier: Apache-2.0
 
-from pyrocov.sarscov2 import nuc_mutations_to_aa_mutations
+import random
+from collections import defaultdict
+
+import pytest
+
+from pyrocov.aa import DNA_TO_AA
+from pyrocov.sarscov2 import (
+    GENE_TO_POSITION,
+    AminoAcidTranslator,
+    nuc_mutations_to_aa_mutations,
+)
+from pyrocov.usher import Mutation
 
 
 def test_nuc_to_aa():
     assert nuc_mutations_to_aa_mutations(["A23403G"]) == ["S:D614G"]
+
+
+def naive_nuc_to_aa(reference, ms):
+    """
+    Translates each mutation by scanning all genes.
+    """
+    ms_by_aa = defaultdict(list)
+    for m in ms:
+        position_nuc = int(m[1:-1])
+        for gene, (start, end) in GENE_TO_POSITION.items():
+            if start <= position_nuc <= end:
+                position_aa = (position_nuc - start) // 3
+                ms_by_aa[gene, position_aa].append(((position_nuc - start) % 3, m[-1]))
+    result = []
+    for (gene, position_aa), ms in ms_by_aa.items():
+        pos = GENE_TO_POSITION[gene][0] + position_aa * 3 - 1
+        new_codon = list(reference[pos : pos + 3])
+        for position_codon, new_nuc in ms:
+            new_codon[position_codon] = new_nuc
+        old_aa = DNA_TO_AA[reference[pos : pos + 3]] or "STOP"
+        new_aa = DNA_TO_AA["".join(new_codon)] or "STOP"
+        if new_aa != old_aa:
+            result.append(f"{gene}:{old_aa}{position_aa + 1}{new_aa}")
+    return result
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_translator(seed):
+    rng = random.Random(seed)
+    reference = "".join(rng.choice("ACGT") for _ in range(29903))
+    translator = AminoAcidTranslator(reference)
+
+    # Include overlapping genes and positions outside of any gene.
+    hotspots = [13468, 21563, 27757, 28300, 28800, 29600, 29900]
+    mutation_sets = []
+    for _ in range(50):
+        ms = []
+        for _ in range(rng.randrange(20)):
+            position = rng.choice([rng.randrange(1, 29904), rng.choice(hotspots)])
+            position += rng.randrange(3)
+            ms.append(f"{reference[position - 1]}{position}{rng.choice('ACGT')}")
+        mutation_sets.append(ms)
+
+    expected = [naive_nuc_to_aa(reference, ms) for ms in mutation_sets]
+    assert translator.translate_batch(mutation_sets) == expected
+    assert [translator.translate(ms) for ms in mutation_sets] == expected
+    assert translator.translate_batch([]) == []
+
+    # Check usher mutations.
+    usher_ms = [Mutation(int(m[1:-1]), m[0], m[-1]) for m in mutation_sets[0]]
+    assert translator.translate(usher_ms) == expected[0]
@@ -1,14 +1,35 @@
 # Copyright Contributors to the Pyro-Cov project.
 # SPDX-License-Identifier: Apache-2.0
 
+import gzip
 import math
 import os
 import random
 import tempfile
 from collections import defaultdict
 
+import pytest
+from Bio.Phylo.BaseTree import Tree
+from Bio.Phylo.Newick import Clade
+from Bio.Phylo.NewickIO import Parser, Writer
+
+from pyrocov import usher
 from pyrocov.align import PANGOLEARN_DATA
-from pyrocov.usher import prune_mutation_tree, refine_mutation_tree
+from pyrocov.external.usher import parsimony_pb2
+from pyrocov.usher import (
+    NUCLEOTIDE,
+    Mutation,
+    MutationTree,
+    _prune_batched,
+    _prune_greedy,
+    load_mutation_tree,
+    load_proto,
+    parse_newick,
+    prune_mutation_tree,
+    prune_mutation_tree_multi,
+    read_proto,
+    refine_mutation_tree,
+)
 
 
 def test_refine_prune():
@@ -31,3 +52,239 @@ def test_refine_prune():
         for fine in coarse_to_fine.values():
             weights[fine] = math.inf
         prune_mutation_tree(filename2, filename3, weights=weights, max_num_nodes=10000)
+
+
+LINEAGES = ["B.1", "B.1.1", "B.1.2", "A", "A.1"]
+
+
+def random_proto(num_nodes, seed=0):
+    rng = random.Random(seed)
+    clades = [Clade(name="node_0")]
+    for i in range(1, num_nodes):
+        clade = Clade(name=f"node_{i}", branch_length=rng.randrange(3))
+        clades[rng.randrange(i)].clades.append(clade)
+        clades.append(clade)
+    for clade in clades:
+        if not clade.clades:
+            clade.name = f"England/{clade.name}/2021|MW{clade.name[5:]}.1"
+    tree = Tree(root=clades[0])
+
+    proto = parsimony_pb2.data()
+    proto.newick = next(iter(Writer([tree]).to_strings()))
+    for i, clade in enumerate(tree.find_clades()):
+        meta = proto.metadata.add()
+        if i == 0:
+            meta.clade = "B"
+        elif rng.random() < 0.1:
+            meta.clade = rng.choice(LINEAGES)
+        mutations = proto.node_mutations.add()
+        for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            m = mutations.mutation.add()
+            m.position = rng.randrange(1, 30000)
+            m.ref_nuc = m.par_nuc = rng.randrange(4)
+            m.mut_nuc.extend([rng.randrange(4)] if rng.random() < 0.9 else [0, 2])
+    return proto
+
+
+def write_proto(proto, filename):
+    with open(filename, "wb") as f:
+        f.write(proto.SerializeToString())
+
+
+def get_clade_mutations(filename):
+    """
+    Accumulates mutations of named clades using a Bio.Phylo tree.
+    """
+    proto, tree = load_proto(filename)
+    clades = list(tree.find_clades())
+    parents = {c: p for p in clades for c in p.clades}
+    node_mutations = dict(zip(clades, proto.node_mutations))
+    result = {}
+    for clade, meta in zip(clades, proto.metadata):
+        if not meta.clade:
+            continue
+        path = [clade]
+        while path[-1] in parents:
+            path.append(parents[path[-1]])
+        by_position = {}
+        for c in reversed(path):
+            for m in node_mutations[c].mutation:
+                by_position[m.position] = Mutation(
+                    m.position,
+                    NUCLEOTIDE[m.ref_nuc],
+                    "".join(NUCLEOTIDE[n] for n in m.mut_nuc),
+                )
+        result[meta.clade] = frozenset(by_position.values())
+    return result
+
+
+@pytest.mark.parametrize(
+    "newick",
+    [
+        "(a:1,b:2)c:0;",
+        "((a,'b c')d,(e:1.5,f)g,h);",
+        "(('x''y',[comment]z)w)v;",
+    ],
+)
+def test_parse_newick(newick):
+    tree = next(Parser.from_string(newick).parse())
+    clades = list(tree.find_clades())
+    clade_to_id = {c: i for i, c in enumerate(clades)}
+    expected_parent = [-1] * len(clades)
+    for p in clades:
+        for c in p.clades:
+            expected_parent[clade_to_id[c]] = clade_to_id[p]
+
+    parent, names, branch_length = parse_newick(newick)
+    assert parent == expected_parent
+    assert names == [c.name or "" for c in clades]
+    assert [c.branch_length for c in clades] == [
+        None if math.isnan(x) else x for x in branch_length
+    ]
+
+
+def test_mutation_tree():
+    proto = random_proto(200)
+    tree = MutationTree.from_proto(proto)
+    assert len(tree) == 200
+    for i in range(1, len(tree)):
+        assert i in tree.get_children(tree.parent[i]).tolist()
+    assert tree.to_newick() == proto.newick
+    assert MutationTree.from_proto(proto).names == tree.names
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "tree.pb")
+        write_proto(proto, filename)
+        mutations_by_lineage, _, _ = load_mutation_tree(filename)
+        assert mutations_by_lineage == get_clade_mutations(filename)
+
+
+@pytest.mark.parametrize("cache_size", [0, 1, 10, 1000])
+def test_get_mutations(cache_size):
+    proto = random_proto(200)
+    expected = MutationTree.from_proto(proto, cache_size=0)
+    tree = MutationTree.from_proto(proto, cache_size=cache_size)
+    nodes = list(range(len(tree))) + random.Random(0).choices(range(len(tree)), k=300)
+    for node in nodes:
+        assert tree.get_mutations(node) == expected.get_mutations(node)
+        assert len(tree._mutation_cache) <= cache_size
+
+
+@pytest.mark.filterwarnings("ignore:Failed to find")
+@pytest.mark.parametrize("max_num_nodes", [10, 100, 1000])
+def test_refine_prune_random(max_num_nodes):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename1 = os.path.join(tmpdirname, "lineageTree.pb")
+        filename2 = os.path.join(tmpdirname, "refinedTree.pb")
+        filename3 = os.path.join(tmpdirname, "prunedTree.pb")
+        write_proto(random_proto(1000), filename1)
+
+        # Refine the tree.
+        fine_to_coarse = refine_mutation_tree(filename1, filename2)
+        proto = read_proto(filename2)
+        tree = MutationTree.from_proto(proto)
+        fine_set = {m.clade for m in proto.metadata if m.clade}
+        assert set(fine_to_coarse) == fine_set
+        assert len(fine_set) == 1 + (tree.num_mutations()[1:] > 0).sum()
+        assert set(fine_to_coarse.values()) <= {"B"} | set(LINEAGES)
+
+        # Prune the tree, preserving mutations of remaining clades.
+        weights = {fine: random.lognormvariate(0, 1) for fine in fine_to_coarse}
+        weights["fine"] = math.inf
+        expected = get_clade_mutations(filename2)
+        meso_set = prune_mutation_tree(filename2, filename3, max_num_nodes, weights)
+        assert "fine" in meso_set
+        proto = read_proto(filename3)
+        assert len(proto.node_mutations) == max_num_nodes
+        actual = get_clade_mutations(filename3)
+        assert set(actual) == meso_set
+        assert actual == {k: expected[k] for k in meso_set}
+
+
+@pytest.mark.parametrize("min_batch_fraction", [0.0, 0.01, 1.0])
+@pytest.mark.parametrize("seed", range(20))
+def test_prune_batched(seed, min_batch_fraction):
+    rng = random.Random(seed)
+    num_nodes = rng.choice([2, 10, 100, 1000])
+    parent = [-1] + [rng.randrange(max(0, i - 3), i) for i in range(1, num_nodes)]
+    num_mutations = [rng.choice([0, 0, 1, 2, 3]) for _ in range(num_nodes)]
+    if seed % 2:
+        weights = [rng.choice([0, 0, 1, 2, 5]) for _ in range(num_nodes)]  # ties
+    else:
+        weights = [rng.lognormvariate(0, 1) * rng.randrange(2) for _ in parent]
+    num_pruned = rng.randrange(num_nodes)
+
+    expected = _prune_greedy(
+        parent, num_mutations, list(weights), list(range(1, num_nodes)), num_pruned
+    )
+    actual = _prune_batched(
+        parent, num_mutations, weights, num_pruned, min_batch_fraction
+    )
+    assert actual == expected
+
+
+@pytest.mark.filterwarnings("ignore:Failed to find")
+def test_prune_multi():
+    sizes = [10, 100, 300, 1000, 2000]
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename1 = os.path.join(tmpdirname, "lineageTree.pb")
+        filename2 = os.path.join(tmpdirname, "refinedTree.pb")
+        write_proto(random_proto(1000), filename1)
+        fine_to_coarse = refine_mutation_tree(filename1, filename2)
+        rng = random.Random(0)
+        weights = {fine: rng.choice([0, 1, 2.5]) for fine in fine_to_coarse}
+
+        filenames = {n: os.path.join(tmpdirname, f"multi.{n}.pb") for n in sizes}
+        proto = read_proto(filename2)
+        actual = prune_mutation_tree_multi(proto, filenames, weights)
+        assert set(actual) == set(sizes)
+        for n in sizes:
+            filename = os.path.join(tmpdirname, f"single.{n}.pb")
+            expected = prune_mutation_tree(filename2, filename, n, weights)
+            assert actual[n] == expected
+            assert read_proto(filenames[n]) == read_proto(filename)
+
+
+@pytest.mark.parametrize("num_members", [1, 2])
+def test_read_proto(num_members):
+    proto = random_proto(100)
+    data = proto.SerializeToString()
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "tree.pb")
+        write_proto(proto, filename)
+        assert read_proto(filename) == proto
+
+        # Multi-member files have an inexact size trailer.
+        split = len(data) // num_members
+        with open(filename + ".gz", "wb") as f:
+            f.write(gzip.compress(data[:split]))
+            f.write(gzip.compress(data[split:]))
+        assert read_proto(filename + ".gz") == proto
+
+        empty = os.path.join(tmpdirname, "empty.pb")
+        open(empty, "wb").close()
+        assert read_proto(empty) == parsimony_pb2.data()
+
+
+def test_load_mutation_tree_cache():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "tree.pb")
+        write_proto(random_proto(100), filename)
+        _, proto1, tree1 = load_mutation_tree(filename)
+        _, proto2, tree2 = load_mutation_tree(filename)
+        assert proto2 is proto1
+        assert tree2 is tree1
+        _, proto3, tree3 = load_mutation_tree(filename, cache=False)
+        assert proto3 is not proto1
+        assert proto3 == proto1
+
+        # Modifying the file should invalidate the cache.
+        write_proto(random_proto(200, seed=1), filename)
+        stat = os.stat(filename)
+        os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        _, proto4, tree4 = load_mutation_tree(filename)
+        assert tree4 is not tree1
+        assert len(tree4) == 200
+        assert len(usher._TREE_CACHE) <= usher.TREE_CACHE_SIZE
+        keys = [k for k in usher._TREE_CACHE if k[0] == os.path.realpath(filename)]
+        assert len(keys) == 1
@@ -0,0 +1,122 @@
+# Copyright Contributors to the Pyro-Cov project.
+# SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import os
+import random
+import tempfile
+import threading
+
+import pytest
+import torch
+
+from pyrocov.util import (
+    BatchMeanVarianceStats,
+    ReservoirQuantileStats,
+    gzip_open_tqdm,
+)
+
+
+def write_lines(filename, num_lines, seed=0):
+    rng = random.Random(seed)
+    with gzip.open(filename, "wt", newline="") as f:
+        for i in range(num_lines):
+            sep = rng.choice(["\n", "\r\n"])
+            f.write(f"{i}\t{'x' * rng.randrange(100)}{sep}")
+        f.write("no trailing newline")
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+@pytest.mark.parametrize("block_size", [1, 100, 2**20])
+@pytest.mark.parametrize("mode", ["rb", "rt"])
+def test_gzip_open_tqdm(mode, block_size, threaded):
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "lines.tsv.gz")
+        write_lines(filename, 1000)
+        expected = list(gzip_open_tqdm(filename, mode))
+        assert len(expected) == 1001
+
+        kwargs = dict(block_size=block_size, threaded=threaded, max_blocks=2)
+        actual = list(gzip_open_tqdm(filename, mode, **kwargs))
+        assert actual == expected
+
+        blocks = list(gzip_open_tqdm(filename, mode, blocks=True, **kwargs))
+        assert all(blocks)
+        assert [line for block in blocks for line in block] == expected
+
+
+def test_gzip_open_tqdm_close():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "lines.tsv.gz")
+        write_lines(filename, 10000)
+        num_threads = threading.active_count()
+        lines = gzip_open_tqdm(filename, "rt", threaded=True, block_size=1)
+        assert next(lines).startswith("0\t")
+        lines.close()
+        assert threading.active_count() == num_threads
+
+
+def test_gzip_open_tqdm_error():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        filename = os.path.join(tmpdirname, "lines.tsv.gz")
+        write_lines(filename, 1000)
+        with open(filename, "r+b") as f:
+            f.truncate(os.path.getsize(filename) // 2)
+        with pytest.raises(EOFError):
+            list(gzip_open_tqdm(filename, "rt", threaded=True))
+
+
+@pytest.mark.parametrize("batch_sizes", [[1] * 10, [10], [3, 1, 6], [4, 4, 2]])
+def test_batch_mean_variance_stats(batch_sizes):
+    samples = torch.randn(sum(batch_sizes), 3, 4)
+    stats = BatchMeanVarianceStats()
+    for batch in samples.split(batch_sizes):
+        if len(batch) == 1:
+            stats.update(batch[0])
+        else:
+            stats.update_batch(batch)
+    actual = stats.get()
+    assert actual["count"] == len(samples)
+    assert torch.allclose(actual["mean"], samples.mean(0), atol=1e-6)
+    assert torch.allclose(actual["variance"], samples.var(0), atol=1e-6)
+
+    lhs = BatchMeanVarianceStats()
+    rhs = BatchMeanVarianceStats()
+    lhs.update_batch(samples[:3])
+    rhs.update_batch(samples[3:])
+    merged = lhs.merge(rhs).get()
+    assert merged["count"] == len(samples)
+    assert torch.allclose(merged["mean"], samples.mean(0), atol=1e-6)
+    assert torch.allclose(merged["variance"], samples.var(0), atol=1e-6)
+
+
+def test_reservoir_quantile_stats():
+    quantiles = (0.1, 0.5, 0.9)
+
+    # The sketch is exact until the reservoir fills.
+    samples = torch.randn(50, 3)
+    stats = ReservoirQuantileStats(100, quantiles)
+    for batch in samples.split(7):
+        stats.update_batch(batch)
+    expected = samples.quantile(torch.tensor(quantiles), dim=0)
+    actual = stats.get()
+    assert actual["count"] == 50
+    assert torch.allclose(actual["quantiles"], expected, atol=1e-6)
+
+    # Afterwards the sketch is approximate.
+    torch.manual_seed(0)
+    samples = torch.rand(10000, 3)
+    stats = ReservoirQuantileStats(1000, quantiles)
+    for batch in samples.split(300):
+        stats.update_batch(batch)
+    expected = torch.tensor(quantiles)[:, None].expand(3, 3)
+    assert torch.allclose(stats.get()["quantiles"], expected, atol=0.05)
+
+    # Merging preserves the weights of each sketch.
+    lhs = ReservoirQuantileStats(1000, quantiles)
+    rhs = ReservoirQuantileStats(1000, quantiles)
+    lhs.update_batch(torch.zeros(9000, 3))
+    rhs.update_batch(torch.ones(1000, 3))
+    merged = lhs.merge(rhs).get()
+    assert merged["count"] == 10000
+    assert torch.allclose(merged["quantiles"][:, 0], torch.tensor([0.0, 0.0, 1.0]))